@@ -0,0 +1,720 @@
+#!/usr/bin/env python3
+#
+#  Copyright 2015-2018 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+""" Benchmark of the metric ingestion pipeline
+
+    Graphite streams, as sent by Telegraf and jmxtrans, are replayed through
+    GraphiteConnection, the Telegraf/jmxtrans decoders and Core.emit_metric
+    up to stubbed Bleemeo and InfluxDB connectors. Nothing is sent over the
+    network.
+
+    For each scenario it reports:
+
+    * points/s: points received by the connectors per second of processing
+    * p99 batch: 99th percentile of the time to process one batch. A batch is
+      all lines sent for one timestamp (one Telegraf flush)
+    * alloc peak: peak memory allocated (tracemalloc) while processing a batch
+    * retained: memory still allocated after a few batches, per batch
+    * peak RSS: peak resident memory of the process
+
+    Each scenario runs in its own process, so peak RSS is per scenario.
+
+    Usage, from the repository root:
+
+        python benchmarks/ingestion.py
+        python benchmarks/ingestion.py --scenario docker --containers 500
+        python benchmarks/ingestion.py --scenario telegraf-tagged \\
+            --replay /tmp/telegraf-capture.txt
+
+    A capture could be recorded with "nc -l 2003 > capture.txt" while
+    Telegraf is configured to send to port 2003. --replay uses the hosts
+    definition (services and containers) of the selected scenario.
+"""
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows
+    resource = None
+
+import psutil
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+)
+
+import bleemeo_agent.config  # noqa pylint: disable=wrong-import-position
+import bleemeo_agent.core  # noqa pylint: disable=wrong-import-position
+import bleemeo_agent.graphite  # noqa pylint: disable=wrong-import-position
+import bleemeo_agent.jmxtrans  # noqa pylint: disable=wrong-import-position
+import bleemeo_agent.util  # noqa pylint: disable=wrong-import-position
+
+
+CONFIG_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'etc', 'agent.conf',
+)
+
+HOST = 'host=benchmark'
+
+Scenario = collections.namedtuple('Scenario', (
+    'description', 'services', 'containers', 'names',
+))
+
+
+class StubConnector:
+    """ Replace BleemeoConnector and InfluxDBConnector, only count points
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.points = 0
+
+    def emit_metric(self, metric_point):
+        # pylint: disable=unused-argument
+        self.points += 1
+
+
+LINUX_SERVICES = {
+    ('apache', ''): {'address': '127.0.0.1', 'port': 80},
+    ('nginx', ''): {'address': '127.0.0.1', 'port': 8080},
+    ('mysql', ''): {'address': '127.0.0.1', 'port': 3306},
+    ('postgresql', ''): {'address': '127.0.0.1', 'port': 5432},
+    ('redis', ''): {'address': '127.0.0.1', 'port': 6379},
+    ('memcached', ''): {'address': '127.0.0.1', 'port': 11211},
+}
+
+THRESHOLDS = {
+    'cpu_used': {'high_warning': 80, 'high_critical': 90},
+    'disk_used_perc': {'high_warning': 80, 'high_critical': 90},
+    'mem_used_perc': {'high_warning': 80, 'high_critical': 90},
+    'swap_used_perc': {'high_warning': 80, 'high_critical': 90},
+    'docker_container_mem_used_perc': {'high_warning': 95},
+}
+
+CPU_FIELDS = [
+    'usage_idle', 'usage_user', 'usage_system', 'usage_irq',
+    'usage_iowait', 'usage_steal', 'usage_nice', 'usage_softirq',
+    'usage_guest', 'usage_guest_nice',
+]
+DISK_FIELDS = [
+    'used_percent', 'used', 'free', 'total', 'inodes_free', 'inodes_used',
+    'inodes_total',
+]
+DISKIO_FIELDS = [
+    'reads', 'writes', 'read_bytes', 'write_bytes', 'read_time',
+    'write_time', 'io_time', 'iops_in_progress', 'weighted_io_time',
+]
+MEM_FIELDS = [
+    'used', 'used_percent', 'available', 'available_percent', 'buffered',
+    'cached', 'free', 'total', 'slab', 'active', 'inactive',
+]
+NET_FIELDS = [
+    'bytes_recv', 'bytes_sent', 'packets_recv', 'packets_sent', 'err_in',
+    'err_out', 'drop_in', 'drop_out',
+]
+SWAP_FIELDS = ['used', 'free', 'total', 'used_percent', 'in', 'out']
+SYSTEM_FIELDS = ['uptime', 'n_users', 'load1', 'load5', 'load15', 'n_cpus']
+PROCESSES_FIELDS = [
+    'blocked', 'running', 'sleeping', 'stopped', 'zombies', 'paging',
+    'total', 'unknown', 'dead', 'idle', 'total_threads',
+]
+SERVICE_FIELDS = {
+    'apache': [
+        'IdleWorkers', 'BusyWorkers', 'TotalAccesses', 'TotalkBytes',
+        'ConnsTotal', 'Uptime', 'scboard_waiting', 'scboard_open',
+        'scboard_starting', 'scboard_reading', 'scboard_sending',
+        'scboard_keepalive', 'scboard_dnslookup', 'scboard_closing',
+        'scboard_logging', 'scboard_finishing', 'scboard_idle_cleanup',
+    ],
+    'nginx': ['requests', 'accepts', 'handled', 'active', 'reading',
+              'writing', 'waiting'],
+    'mysql': [
+        'qcache_lowmem_prunes', 'qcache_queries_in_cache',
+        'qcache_total_blocks', 'qcache_free_blocks', 'qcache_free_memory',
+        'qcache_hits', 'table_locks_waited', 'bytes_received', 'bytes_sent',
+        'threads_created', 'threads_running', 'threads_connected',
+        'commands_select', 'commands_insert', 'commands_update',
+        'commands_delete', 'handler_write', 'queries', 'slow_queries',
+        'aborted_clients', 'open_files', 'opened_tables',
+    ],
+    'postgresql': [
+        'xact_commit', 'xact_rollback', 'blks_read', 'blks_hit',
+        'tup_returned', 'tup_fetched', 'tup_inserted', 'tup_updated',
+        'tup_deleted', 'temp_files', 'temp_bytes', 'blk_read_time',
+        'blk_write_time', 'numbackends', 'conflicts', 'deadlocks',
+    ],
+    'redis': [
+        'clients', 'connected_slaves', 'used_memory', 'used_memory_rss',
+        'total_connections_received', 'total_commands_processed',
+        'rdb_changes_since_last_save', 'evicted_keys', 'keyspace_hits',
+        'keyspace_misses', 'expired_keys', 'uptime', 'pubsub_patterns',
+        'pubsub_channels', 'keyspace_hitrate', 'blocked_clients',
+    ],
+    'memcached': [
+        'cmd_get', 'cmd_set', 'curr_connections', 'curr_items', 'bytes_read',
+        'bytes_written', 'evictions', 'threads', 'get_misses', 'get_hits',
+        'delete_misses', 'delete_hits', 'incr_hits', 'incr_misses',
+        'decr_hits', 'decr_misses', 'uptime',
+    ],
+}
+POSTGRESQL_SERVER = 'host=127_0_0_1_port=5432_user=bleemeo_dbname=postgres'
+DISKS = [('-', 'ext4', 'sda1'), ('-home', 'ext4', 'sda2'),
+         ('-boot', 'ext2', 'sdb1'), ('-srv', 'xfs', 'sdb2')]
+DISKIO = ['sda', 'sdb', 'nvme0n1', 'loop0']
+INTERFACES = ['eth0', 'eth1', 'lo', 'docker0']
+CPU_COUNT = 8
+
+
+def _tagged(plugin, fields, tags=''):
+    if tags:
+        tags = tags + ';' + HOST
+    else:
+        tags = HOST
+    return [
+        'telegraf.%s.%s;%s' % (plugin, field, tags)
+        for field in fields
+    ]
+
+
+def _linux_tagged_names():
+    names = []
+    for cpu in ['cpu-total'] + ['cpu%d' % i for i in range(CPU_COUNT)]:
+        names.extend(_tagged('cpu', CPU_FIELDS, 'cpu=%s' % cpu))
+    for (path, fstype, device) in DISKS:
+        names.extend(_tagged(
+            'disk',
+            DISK_FIELDS,
+            'device=%s;fstype=%s;mode=rw;path=%s' % (device, fstype, path),
+        ))
+    for disk in DISKIO:
+        names.extend(_tagged('diskio', DISKIO_FIELDS, '_name=%s' % disk))
+    for interface in INTERFACES:
+        names.extend(_tagged('net', NET_FIELDS, 'interface=%s' % interface))
+    names.extend(_tagged(
+        'net', ['tcp_established', 'udp_indatagrams'], 'interface=all',
+    ))
+    names.extend(_tagged('mem', MEM_FIELDS))
+    names.extend(_tagged('swap', SWAP_FIELDS))
+    names.extend(_tagged('system', SYSTEM_FIELDS))
+    names.extend(_tagged('processes', PROCESSES_FIELDS))
+
+    names.extend(_tagged(
+        'apache', SERVICE_FIELDS['apache'], 'port=80;server=127_0_0_1',
+    ))
+    names.extend(_tagged(
+        'nginx', SERVICE_FIELDS['nginx'], 'port=8080;server=127_0_0_1',
+    ))
+    names.extend(_tagged(
+        'mysql', SERVICE_FIELDS['mysql'], 'server=127_0_0_1:3306',
+    ))
+    for database in ['app', 'postgres', 'template1']:
+        names.extend(_tagged(
+            'postgresql',
+            SERVICE_FIELDS['postgresql'],
+            'db=%s;server=%s' % (database, POSTGRESQL_SERVER),
+        ))
+    names.extend(_tagged(
+        'redis', SERVICE_FIELDS['redis'], 'port=6379;server=127_0_0_1',
+    ))
+    names.extend(_tagged(
+        'memcached', SERVICE_FIELDS['memcached'], 'server=127_0_0_1:11211',
+    ))
+    return names
+
+
+def _linux_legacy_names():
+    # Telegraf without graphite_tag_support: telegraf.HOST.(TAGS)*.PLUGIN.FIELD
+    # where tags are sorted by their name.
+    host = HOST.split('=')[1]
+    names = []
+
+    def legacy(tags, plugin, fields):
+        prefix = '.'.join(['telegraf', host] + tags + [plugin])
+        names.extend('%s.%s' % (prefix, field) for field in fields)
+
+    for cpu in ['cpu-total'] + ['cpu%d' % i for i in range(CPU_COUNT)]:
+        legacy([cpu], 'cpu', CPU_FIELDS)
+    for (path, fstype, device) in DISKS:
+        legacy([device, fstype, 'rw', path], 'disk', DISK_FIELDS)
+    for disk in DISKIO:
+        legacy([disk], 'diskio', DISKIO_FIELDS)
+    for interface in INTERFACES:
+        legacy([interface], 'net', NET_FIELDS)
+    legacy([], 'mem', MEM_FIELDS)
+    legacy([], 'swap', SWAP_FIELDS)
+    legacy([], 'system', SYSTEM_FIELDS)
+    legacy([], 'processes', PROCESSES_FIELDS)
+
+    legacy(['80', '127_0_0_1'], 'apache', SERVICE_FIELDS['apache'])
+    legacy(['8080', '127_0_0_1'], 'nginx', SERVICE_FIELDS['nginx'])
+    legacy(['127_0_0_1:3306'], 'mysql', SERVICE_FIELDS['mysql'])
+    for database in ['app', 'postgres', 'template1']:
+        legacy(
+            [database, POSTGRESQL_SERVER],
+            'postgresql',
+            SERVICE_FIELDS['postgresql'],
+        )
+    legacy(['6379', 'master', '127_0_0_1'], 'redis', SERVICE_FIELDS['redis'])
+    legacy(['127_0_0_1:11211'], 'memcached', SERVICE_FIELDS['memcached'])
+    return names
+
+
+def _docker_scenario(container_count):
+    containers = {}
+    names = _linux_tagged_names()
+    names.extend(_tagged('docker', [
+        'n_containers', 'n_containers_running', 'n_containers_stopped',
+        'n_images', 'n_cpus', 'n_goroutines',
+    ]))
+    for i in range(container_count):
+        name = 'app-%d' % i
+        containers[name] = {
+            'Config': {
+                'Labels': {
+                    'com.docker.compose.project': 'benchmark',
+                    'com.docker.compose.service': 'app',
+                },
+            },
+        }
+        tags = 'container_image=nginx;container_name=%s' % name
+        names.extend(_tagged(
+            'docker_container_cpu',
+            ['usage_total', 'usage_system', 'usage_in_usermode',
+             'usage_in_kernelmode', 'throttling_periods'],
+            tags + ';cpu=cpu-total',
+        ))
+        for cpu in range(2):
+            names.extend(_tagged(
+                'docker_container_cpu',
+                ['usage_total'],
+                tags + ';cpu=cpu%d' % cpu,
+            ))
+        names.extend(_tagged(
+            'docker_container_mem',
+            ['usage', 'usage_percent', 'limit', 'max_usage', 'cache', 'rss',
+             'active_anon', 'inactive_file'],
+            tags,
+        ))
+        for network in ['total', 'eth0']:
+            names.extend(_tagged(
+                'docker_container_net',
+                ['rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
+                 'rx_errors', 'tx_errors'],
+                tags + ';network=%s' % network,
+            ))
+        for device in ['total', '8:0']:
+            names.extend(_tagged(
+                'docker_container_blkio',
+                ['io_service_bytes_recursive_read',
+                 'io_service_bytes_recursive_write',
+                 'io_serviced_recursive_read',
+                 'io_serviced_recursive_write'],
+                tags + ';device=%s' % device,
+            ))
+    return (containers, names)
+
+
+def _windows_names():
+    names = []
+    for instance in ['_Total'] + [str(i) for i in range(CPU_COUNT)]:
+        names.extend(_tagged('win_cpu', [
+            'Percent_Idle_Time', 'Percent_Interrupt_Time',
+            'Percent_User_Time', 'Percent_Privileged_Time',
+            'Percent_DPC_Time', 'Percent_Processor_Time',
+        ], 'instance=%s;objectname=Processor' % instance))
+    for instance in ['_Total', 'C:', 'D:', 'HarddiskVolume1']:
+        names.extend(_tagged('win_disk', [
+            'Percent_Free_Space', 'Free_Megabytes', 'Percent_Idle_Time',
+        ], 'instance=%s;objectname=LogicalDisk' % instance))
+    for instance in ['_Total', '0_C:', '1_D:']:
+        names.extend(_tagged('win_diskio', [
+            'Disk_Read_Bytes_persec', 'Disk_Write_Bytes_persec',
+            'Current_Disk_Queue_Length', 'Disk_Reads_persec',
+            'Disk_Writes_persec', 'Percent_Idle_Time',
+        ], 'instance=%s;objectname=PhysicalDisk' % instance))
+    names.extend(_tagged('win_mem', [
+        'Available_Bytes', 'Standby_Cache_Reserve_Bytes',
+        'Standby_Cache_Normal_Priority_Bytes', 'Standby_Cache_Core_Bytes',
+        'Cache_Faults_persec', 'Pages_persec',
+    ], 'objectname=Memory'))
+    for instance in ['Ethernet', 'Ethernet_2', 'isatap']:
+        names.extend(_tagged('win_net', [
+            'Bytes_Sent_persec', 'Bytes_Received_persec',
+            'Packets_Sent_persec', 'Packets_Received_persec',
+            'Packets_Received_Discarded', 'Packets_Outbound_Discarded',
+            'Packets_Received_Errors', 'Packets_Outbound_Errors',
+        ], 'instance=%s;objectname=Network_Interface' % instance))
+    names.extend(_tagged('win_swap', [
+        'Percent_Usage', 'Percent_Usage_Peak',
+    ], 'instance=_Total;objectname=Paging_File'))
+    names.extend(_tagged('win_system', [
+        'System_Up_Time', 'Processor_Queue_Length', 'Context_Switches_persec',
+    ], 'objectname=System'))
+    return names
+
+
+def _jmxtrans_scenario(service_count):
+    services = {}
+    for i in range(service_count):
+        for (service_name, port) in [
+                ('cassandra', 7199), ('bitbucket', 3333), ('jira', 8000),
+                ('confluence', 8001), ('kafka', 9999)]:
+            service_info = {
+                'address': '10.0.%d.%d' % (i // 250, i % 250 + 1),
+                'port': port,
+                'jmx_port': port,
+            }
+            if service_name == 'cassandra':
+                service_info['cassandra_detailed_tables'] = [
+                    'app.users', 'app.events',
+                ]
+            services[(service_name, 'instance%d' % i)] = service_info
+    return services
+
+
+def _jmxtrans_names(jmx_config):
+    names = []
+    for (key, jmx_metrics) in sorted(jmx_config.to_metric.items()):
+        (md5_service, md5_mbean, attr) = key
+        if any('typeNames' in jmx_metric for jmx_metric in jmx_metrics):
+            for type_names in ['G1_Young_Generation', 'G1_Old_Generation']:
+                names.append('jmxtrans.%s.%s.%s.%s' % (
+                    md5_service, md5_mbean, type_names, attr,
+                ))
+        else:
+            names.append('jmxtrans.%s.%s.%s' % (md5_service, md5_mbean, attr))
+    return names
+
+
+def get_scenario(name, args):
+    """ Return the Scenario with given name
+    """
+    if name == 'telegraf-tagged':
+        return Scenario(
+            'Linux host, Telegraf with graphite_tag_support',
+            LINUX_SERVICES, {}, _linux_tagged_names(),
+        )
+    if name == 'telegraf-legacy':
+        return Scenario(
+            'Linux host, Telegraf without graphite_tag_support',
+            LINUX_SERVICES, {}, _linux_legacy_names(),
+        )
+    if name == 'docker':
+        (containers, names) = _docker_scenario(args.containers)
+        return Scenario(
+            'Linux host with %d containers' % args.containers,
+            LINUX_SERVICES, containers, names,
+        )
+    if name == 'windows':
+        return Scenario(
+            'Windows host, win_* plugins', {}, {}, _windows_names(),
+        )
+    if name == 'jmxtrans':
+        services = _jmxtrans_scenario(args.jmx_services)
+        # names are known once jmxtrans configuration is generated
+        return Scenario(
+            '%d Java services monitored by jmxtrans' % len(services),
+            services, {}, [],
+        )
+    raise ValueError('unknown scenario %s' % name)
+
+
+SCENARIOS = [
+    'telegraf-tagged', 'telegraf-legacy', 'docker', 'windows', 'jmxtrans',
+]
+
+
+def make_core(scenario):
+    """ Build a Core which is not started, with stubbed connectors
+    """
+    core = bleemeo_agent.core.Core()
+    (core.config, errors, _) = (
+        bleemeo_agent.config.load_config_with_default([CONFIG_FILE])
+    )
+    if errors:
+        raise ValueError('\n'.join(errors))
+    core.cache = bleemeo_agent.core.Cache(None, skip_load=True)
+    core.last_facts = {'swap_present': True, 'installation_format': 'manual'}
+    core.services = scenario.services
+    core.docker_containers_by_name = scenario.containers
+    core.thresholds = THRESHOLDS
+    core.bleemeo_connector = StubConnector()
+    core.influx_connector = StubConnector()
+    core.started_at = bleemeo_agent.util.get_clock()
+
+    server = bleemeo_agent.graphite.GraphiteServer(core)
+    server.update_service_index()
+    return (core, server)
+
+
+def build_batches(names, rounds, read_size):
+    """ Return the stream, as a list of batches. Each batch is the list of
+        chunks (of read_size bytes) received for one timestamp.
+    """
+    start = int(time.time()) // 10 * 10 - 10 * rounds
+    batches = []
+    for round_index in range(rounds):
+        timestamp = start + 10 * round_index
+        lines = []
+        for (index, name) in enumerate(names):
+            # Values increase with time, so derived values are positive and
+            # percentages cross thresholds from time to time.
+            value = (index % 97 + 1) * (round_index + 1) * 1.5
+            lines.append('%s %s %d\n' % (name, value, timestamp))
+        data = ''.join(lines).encode('utf-8')
+        batches.append([
+            data[i:i + read_size] for i in range(0, len(data), read_size)
+        ])
+    return batches
+
+
+def load_replay(path, read_size):
+    """ Return a recorded stream as a list of batches.
+
+        Consecutive lines with the same timestamp form one batch.
+    """
+    batches = []
+    current = []
+    current_timestamp = None
+    with open(path, 'rb') as replay_file:
+        for line in replay_file:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            if fields[-1] != current_timestamp and current:
+                batches.append(current)
+                current = []
+            current_timestamp = fields[-1]
+            current.append(line.rstrip(b'\r\n') + b'\n')
+    if current:
+        batches.append(current)
+
+    result = []
+    for lines in batches:
+        data = b''.join(lines)
+        result.append([
+            data[i:i + read_size] for i in range(0, len(data), read_size)
+        ])
+    return result
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def _peak_rss():
+    """ Return the peak resident memory of this process in bytes
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return max_rss
+        return max_rss * 1024
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss)
+
+
+def run_scenario(name, args):
+    """ Run one scenario in this process and return its result as a dict
+    """
+    # pylint: disable=too-many-locals
+    scenario = get_scenario(name, args)
+    (core, server) = make_core(scenario)
+    if name == 'jmxtrans':
+        # pylint: disable=protected-access
+        jmx_config = bleemeo_agent.jmxtrans._CURRENT_CONFIG
+        jmx_config.core = core
+        jmx_config.get_jmxtrans_config()
+        scenario = scenario._replace(names=_jmxtrans_names(jmx_config))
+
+    if args.replay:
+        batches = load_replay(args.replay, args.read_size)
+    else:
+        total_rounds = args.warmup + args.rounds + args.alloc_rounds
+        batches = build_batches(scenario.names, total_rounds, args.read_size)
+
+    warmup_batches = batches[:args.warmup]
+    measured_batches = batches[args.warmup:len(batches) - args.alloc_rounds]
+    alloc_batches = batches[len(batches) - args.alloc_rounds:]
+    if not measured_batches:
+        raise ValueError('stream is too short for warmup and alloc rounds')
+
+    connection = bleemeo_agent.graphite.GraphiteConnection(
+        server, ('127.0.0.1', 0),
+    )
+
+    def process(batch):
+        for chunk in batch:
+            connection.feed(chunk)
+        connection.flush()
+
+    for batch in warmup_batches:
+        process(batch)
+
+    connectors = (core.bleemeo_connector, core.influx_connector)
+    points_before = core.bleemeo_connector.points
+    latencies = []
+    for batch in measured_batches:
+        start = time.perf_counter()
+        process(batch)
+        latencies.append(time.perf_counter() - start)
+    points = core.bleemeo_connector.points - points_before
+
+    alloc_peak = 0
+    retained = 0
+    if alloc_batches:
+        # tracemalloc.reset_peak() needs Python 3.9: restart tracing for each
+        # batch instead, so only allocations made during it are counted.
+        for batch in alloc_batches:
+            tracemalloc.start()
+            process(batch)
+            (after, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            alloc_peak = max(alloc_peak, peak)
+            retained += after
+        retained = retained / len(alloc_batches)
+
+    connection.close()
+
+    lines = sum(
+        chunk.count(b'\n') for batch in measured_batches for chunk in batch
+    )
+    elapsed = sum(latencies)
+    return {
+        'scenario': name,
+        'description': scenario.description,
+        'batches': len(measured_batches),
+        'lines_per_batch': lines / len(measured_batches),
+        'points_per_batch': points / len(measured_batches),
+        'points_per_second': points / elapsed if elapsed else 0,
+        'lines_per_second': lines / elapsed if elapsed else 0,
+        'batch_p50_ms': _percentile(latencies, 50) * 1000,
+        'batch_p99_ms': _percentile(latencies, 99) * 1000,
+        'alloc_peak_kib': alloc_peak / 1024,
+        'retained_kib_per_batch': retained / 1024,
+        'peak_rss_mib': _peak_rss() / 1024 / 1024,
+        'connectors_points': [
+            connector.points for connector in connectors
+        ],
+    }
+
+
+def print_results(results):
+    header = (
+        '%-16s %9s %9s %10s %9s %9s %11s %10s %9s' % (
+            'scenario', 'lines/b', 'points/b', 'points/s', 'p50 ms',
+            'p99 ms', 'alloc KiB', 'kept KiB', 'RSS MiB',
+        )
+    )
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print('%-16s %9d %9d %10d %9.2f %9.2f %11.1f %10.1f %9.1f' % (
+            result['scenario'],
+            result['lines_per_batch'],
+            result['points_per_batch'],
+            result['points_per_second'],
+            result['batch_p50_ms'],
+            result['batch_p99_ms'],
+            result['alloc_peak_kib'],
+            result['retained_kib_per_batch'],
+            result['peak_rss_mib'],
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the metric ingestion pipeline',
+    )
+    parser.add_argument(
+        '--scenario',
+        choices=SCENARIOS + ['all'],
+        default='all',
+        help='Scenario to run (default: all, each in its own process)',
+    )
+    parser.add_argument(
+        '--rounds', type=int, default=200,
+        help='Number of measured batches (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--warmup', type=int, default=3,
+        help='Number of batches processed before measuring'
+             ' (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--alloc-rounds', type=int, default=5,
+        help='Number of batches processed with tracemalloc'
+             ' (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--read-size', type=int, default=65536,
+        help='Size of chunks given to GraphiteConnection'
+             ' (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--containers', type=int, default=200,
+        help='Number of containers for the docker scenario'
+             ' (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--jmx-services', type=int, default=4,
+        help='Number of each Java service for the jmxtrans scenario'
+             ' (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--replay',
+        help='Replay a recorded Graphite stream instead of the generated one',
+    )
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Output results as JSON, one line per scenario',
+    )
+    args = parser.parse_args()
+
+    if args.scenario != 'all':
+        results = [run_scenario(args.scenario, args)]
+    else:
+        results = []
+        for name in SCENARIOS:
+            command = [sys.executable, os.path.abspath(__file__)]
+            command.extend(sys.argv[1:])
+            command.extend(['--scenario', name, '--json'])
+            output = subprocess.check_output(command)
+            results.append(json.loads(output.decode('utf-8')))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result, sort_keys=True))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
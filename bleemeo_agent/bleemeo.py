@@ -18,9 +18,9 @@
 # pylint: disable=too-many-lines
 
 import collections
+import concurrent.futures
 import copy
 import datetime
-import hashlib
 import json
 import logging
 import os
@@ -37,17 +37,53 @@ from six.moves import queue
 from six.moves import urllib_parse
 
 import bleemeo_agent
+import bleemeo_agent.spool
 import bleemeo_agent.util
 
 
 MQTT_QUEUE_MAX_SIZE = 2000
+MQTT_QUEUE_MAX_BYTES = 32 * 1024 * 1024
+# When that many points wait in BleemeoConnector._metric_queue, stop waiting
+# for MQTT and spool (or drop) them.
+METRIC_QUEUE_HIGH_WATERMARK = 8000
+# Points drained from the spool are removed from it only once acknowledged.
+# If the acknowledgments don't arrive within this delay, send them again.
+SPOOL_ACK_TIMEOUT = 300
+# Full synchronizations only fetch metrics updated since the previous one,
+# and the list of IDs of active metrics to find deleted ones. Fetch all
+# metrics at least with this interval.
+METRICS_FULL_SYNC_INTERVAL = 6 * 3600
+METRICS_MAX_PAGE_SIZE = 1000
+# Points of metrics not yet registered are kept at most that long
+UNREGISTERED_POINT_MAX_AGE = 7200
 REQUESTS_TIMEOUT = 15.0
+METRIC_REGISTRATION_FIELDS = (
+    'id,label,labels,item,service,container'
+    ',deactivated_at,'
+    'threshold_low_warning,threshold_low_critical,'
+    'threshold_high_warning,threshold_high_critical,'
+    'unit,unit_text,agent,status_of,service,'
+    'last_status,last_status_changed_at,'
+    'problem_origins'
+)
 
 # API don't accept full length for some object.
 API_METRIC_ITEM_LENGTH = 100
 API_CONTAINER_NAME_LENGTH = 100
 API_SERVICE_INSTANCE_LENGTH = 50
 
+# Metrics registered first and sent first when draining the spool
+PRIORITY_METRIC_LABELS = frozenset((
+    'cpu_idle', 'cpu_wait', 'cpu_nice', 'cpu_user', 'cpu_system',
+    'cpu_interrupt', 'cpu_softirq', 'cpu_steal',
+    'mem_free', 'mem_cached', 'mem_buffered', 'mem_used',
+    'io_utilization', 'io_read_bytes', 'io_write_bytes', 'io_reads',
+    'io_writes', 'net_bits_recv', 'net_bits_sent', 'net_packets_recv',
+    'net_packets_sent', 'net_err_in', 'net_err_out', 'disk_used_perc',
+    'swap_used_perc', 'cpu_used', 'mem_used_perc',
+    'agent_status',
+))
+
 
 MetricThreshold = collections.namedtuple('MetricThreshold', (
     'low_warning',
@@ -204,6 +240,26 @@ def _api_metric_to_internal(data):
     return metric
 
 
+def _registered_metric(data):
+    """ Convert the API response of a metric registration
+    """
+    metric = _api_metric_to_internal(data)
+    if 'item' in metric.labels:
+        logging.debug(
+            'Metric %s (item %s) registered with uuid %s',
+            metric.label,
+            metric.labels['item'],
+            metric.uuid,
+        )
+    else:
+        logging.debug(
+            'Metric %s registered with uuid %s',
+            metric.label,
+            metric.uuid,
+        )
+    return metric
+
+
 class ApiError(Exception):
     def __init__(self, response):
         super(ApiError, self).__init__()
@@ -228,17 +284,57 @@ class AuthApiError(ApiError):
     """ Fail to authenticate on API (bad username/password) """
 
 
+class RateLimiter:
+    """ Token bucket allowing rate calls per second, with bursts of at most
+        burst calls. A rate of 0 disables the limit.
+
+        It could be shared between threads.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        if burst is None:
+            burst = max(1, rate)
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = bleemeo_agent.util.get_clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Wait until a call is allowed
+        """
+        if not self.rate:
+            return
+        with self._lock:
+            clock_now = bleemeo_agent.util.get_clock()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (clock_now - self._updated_at) * self.rate,
+            )
+            self._updated_at = clock_now
+            self._tokens -= 1
+            # When tokens are negative, the call is reserved in the future
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
 class BleemeoAPI:
     """ class to handle communication with Bleemeo API
     """
 
-    def __init__(self, base_url, auth, user_agent, ssl_verify):
+    def __init__(self, base_url, auth, user_agent, ssl_verify,
+                 max_prefetch=4):
+        # pylint: disable=too-many-arguments
         self.auth = auth
         self.user_agent = user_agent
         self.base_url = base_url
         self.requests_session = requests.Session()
         self._jwt_token = None
+        self._jwt_lock = threading.Lock()
         self.ssl_verify = ssl_verify
+        # Number of pages api_iterator fetch concurrently
+        self.max_prefetch = max_prefetch
 
     def _get_jwt(self):
         url = urllib_parse.urljoin(self.base_url, 'v1/jwt-auth/')
@@ -279,9 +375,11 @@ class BleemeoAPI:
 
         first_call = True
         while True:
-            if self._jwt_token is None:
-                self._jwt_token = self._get_jwt()
-            headers['Authorization'] = 'JWT %s' % self._jwt_token
+            with self._jwt_lock:
+                if self._jwt_token is None:
+                    self._jwt_token = self._get_jwt()
+                jwt_token = self._jwt_token
+            headers['Authorization'] = 'JWT %s' % jwt_token
             response = self.requests_session.request(
                 method=method,
                 url=url,
@@ -296,16 +394,47 @@ class BleemeoAPI:
                 # If authentication failed for the first call,
                 # retry immediatly
                 logging.debug('JWT token expired, retry authentication')
-                self._jwt_token = None
+                with self._jwt_lock:
+                    # Another thread may already have renewed it
+                    if self._jwt_token == jwt_token:
+                        self._jwt_token = None
                 first_call = False
                 continue
             first_call = False
 
             return response
 
+    def _api_page(self, url, params=None):
+        """ Fetch one page of a list endpoint. Return None if it doesn't
+            exist.
+        """
+        response = self.api_call(url, params=params)
+
+        if response.status_code == 404:
+            return None
+
+        if response.status_code != 200:
+            raise ApiError(response)
+
+        return response.json()
+
+    def _iter_next_pages(self, data):
+        """ Return items of pages after data, fetched one after the other
+        """
+        # After first call, params are present in URL data['next']
+        while data['next']:
+            data = self._api_page(data['next'])
+            if data is None:
+                return
+            yield from data['results']
+
     def api_iterator(self, url, params=None):
         """ Call Bleemeo API on a list endpoints and return a iterator
             that request all pages
+
+            Pages are fetched in background while the previous one is
+            consumed. When the number of pages is known, up to max_prefetch
+            pages are fetched concurrently. Items are returned in order.
         """
         if params is None:
             params = {}
@@ -315,25 +444,73 @@ class BleemeoAPI:
         if 'page_size' not in params:
             params['page_size'] = 100
 
-        data = {'next': url}
-        while data['next']:
-            response = self.api_call(
-                data['next'],
-                params=params,
-            )
+        data = self._api_page(url, params)
+        if data is None:
+            return
+        if not data['next'] or self.max_prefetch < 1:
+            yield from data['results']
+            yield from self._iter_next_pages(data)
+            return
 
-            if response.status_code == 404:
-                break
+        executor = concurrent.futures.ThreadPoolExecutor(self.max_prefetch)
+        futures = collections.deque()
+        try:
+            page_urls = _page_urls(data)
+            if page_urls is None:
+                # Number of pages unknown: only prefetch the next one
+                while data is not None:
+                    if data['next']:
+                        futures.append(
+                            executor.submit(self._api_page, data['next'])
+                        )
+                    yield from data['results']
+                    data = futures.popleft().result() if futures else None
+                return
 
-            if response.status_code != 200:
-                raise ApiError(response)
+            yield from data['results']
+            page_urls = iter(page_urls)
+            while True:
+                for page_url in page_urls:
+                    futures.append(executor.submit(self._api_page, page_url))
+                    if len(futures) >= self.max_prefetch:
+                        break
+                if not futures:
+                    break
+                data = futures.popleft().result()
+                if data is None:
+                    return
+                yield from data['results']
 
-            # After first call, params are present in URL data['next']
-            params = None
+            # Objects were created since the first page
+            yield from self._iter_next_pages(data)
+        finally:
+            # The consumer may stop before the last page
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
-            data = response.json()
-            for item in data['results']:
-                yield item
+
+def _page_urls(data):
+    """ Return the URLs of all pages after the first one, using the count
+        of objects and the "page" parameter of the URL of the second page.
+
+        Return None if the API does not use page number pagination.
+    """
+    count = data.get('count')
+    page_size = len(data['results'])
+    url = urllib_parse.urlparse(data['next'])
+    query = urllib_parse.parse_qsl(url.query)
+    if not count or not page_size or ('page', '2') not in query:
+        return None
+
+    page_count = -(-count // page_size)
+    return [
+        url._replace(query=urllib_parse.urlencode([
+            (key, str(page) if key == 'page' else value)
+            for (key, value) in query
+        ])).geturl()
+        for page in range(2, page_count + 1)
+    ]
 
 
 def convert_docker_date(input_date):
@@ -388,25 +565,433 @@ def _prioritize_metrics(metrics):
     # We do this by swapping "high" priority metric with
     # another metrics.
 
-    priority_label = set((
-        'cpu_idle', 'cpu_wait', 'cpu_nice', 'cpu_user', 'cpu_system',
-        'cpu_interrupt', 'cpu_softirq', 'cpu_steal',
-        'mem_free', 'mem_cached', 'mem_buffered', 'mem_used',
-        'io_utilization', 'io_read_bytes', 'io_write_bytes', 'io_reads',
-        'io_writes', 'net_bits_recv', 'net_bits_sent', 'net_packets_recv',
-        'net_packets_sent', 'net_err_in', 'net_err_out', 'disk_used_perc',
-        'swap_used_perc', 'cpu_used', 'mem_used_perc',
-        'agent_status',
-    ))
-
     swap_idx = 0
     for (idx, metric) in enumerate(metrics):
-        if metric.label in priority_label:
+        if metric.label in PRIORITY_METRIC_LABELS:
             metrics[idx], metrics[swap_idx] = metrics[swap_idx], metrics[idx]
             swap_idx += 1
     return metrics
 
 
+class DataPayload:
+    """ Points sent in one message to v1/agent/<uuid>/data
+
+        With the "json" encoding, the message is a JSON list of points.
+        With the "compact" encoding, the message is sent to
+        v1/agent/<uuid>/data_compact as zlib-compressed JSON with one list per
+        field (columnar). Metrics (uuid, measurement and item) are only sent
+        once per message and points refer to them by index:
+
+            {
+                "metrics": [[uuid, measurement, item or null], ...],
+                "metric": [index in metrics of each point, ...],
+                "time": [...],
+                "value": [...],
+                "status": {"point index": status, ...},
+                "check_output": {"point index": check_output, ...},
+                "event_grace_period": {"point index": grace_period, ...},
+            }
+
+        size is the size of the message before compression. It's exact for
+        "json" and estimated for "compact".
+    """
+    SPARSE_FIELDS = ('status', 'check_output', 'event_grace_period')
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.size = 2
+        self._encoded_points = []
+
+        self._metrics = []
+        self._metric_index = {}
+        self._columns = {
+            'metric': [],
+            'time': [],
+            'value': [],
+        }
+        self._sparse_columns = {name: {} for name in self.SPARSE_FIELDS}
+
+    def __len__(self):
+        return len(self._columns['time']) + len(self._encoded_points)
+
+    def add(self, bleemeo_metric):
+        """ Add a point, as a dict with the keys uuid, measurement, time,
+            value and optionally item, status, check_output and
+            event_grace_period
+        """
+        if not self.compact:
+            encoded = json.dumps(bleemeo_metric)
+            if self._encoded_points:
+                # separator ", "
+                self.size += 2
+            self._encoded_points.append(encoded)
+            self.size += len(encoded)
+            return
+
+        index = len(self._columns['time'])
+        uuid = bleemeo_metric['uuid']
+        metric_index = self._metric_index.get(uuid)
+        if metric_index is None:
+            metric_index = len(self._metrics)
+            self._metric_index[uuid] = metric_index
+            metric = [
+                uuid,
+                bleemeo_metric['measurement'],
+                bleemeo_metric.get('item'),
+            ]
+            self._metrics.append(metric)
+            self.size += len(json.dumps(metric)) + 2
+
+        self._columns['metric'].append(metric_index)
+        self._columns['time'].append(bleemeo_metric['time'])
+        self._columns['value'].append(bleemeo_metric['value'])
+        # index, time and value with their separators
+        self.size += 40
+
+        for name in self.SPARSE_FIELDS:
+            value = bleemeo_metric.get(name)
+            if value is not None:
+                self._sparse_columns[name][index] = value
+                self.size += len(str(value)) + 12
+
+    def topic(self, agent_uuid):
+        if self.compact:
+            return 'v1/agent/%s/data_compact' % agent_uuid
+        return 'v1/agent/%s/data' % agent_uuid
+
+    def encode(self):
+        """ Return the message to publish
+        """
+        if not self.compact:
+            return '[' + ', '.join(self._encoded_points) + ']'
+
+        payload = {'metrics': self._metrics}
+        payload.update(self._columns)
+        for (name, column) in self._sparse_columns.items():
+            if column:
+                payload[name] = column
+        return bytearray(zlib.compress(
+            json.dumps(payload, separators=(',', ':')).encode('utf8')
+        ))
+
+
+class MqttPublisher:
+    """ Publish MQTT messages with QoS 1 and track them until the broker
+        acknowledged them (PUBACK).
+
+        paho-mqtt calls on_publish from its network thread, so in-flight
+        messages are protected by a lock. mqtt_client.publish is called
+        without that lock held: paho holds its own lock while calling
+        on_publish.
+    """
+
+    def __init__(self, mqtt_client, max_messages=MQTT_QUEUE_MAX_SIZE,
+                 max_bytes=MQTT_QUEUE_MAX_BYTES):
+        self.mqtt_client = mqtt_client
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+
+        self._condition = threading.Condition()
+        # mid => (size, publish time, on_ack)
+        self._in_flight = {}
+        self._in_flight_bytes = 0
+        # mid acknowledged before publish() recorded them
+        self._early_acks = set()
+        self._latencies = []
+        self._dropped = 0
+        self.dropped_total = 0
+        # Exponentially weighted moving average of publish to PUBACK delay
+        self.latency = None
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    @property
+    def in_flight_bytes(self):
+        return self._in_flight_bytes
+
+    def _is_full(self):
+        return (
+            len(self._in_flight) >= self.max_messages
+            or self._in_flight_bytes >= self.max_bytes
+        )
+
+    def is_full(self):
+        with self._condition:
+            return self._is_full()
+
+    def publish(self, topic, message, force=False, on_ack=None):
+        """ Publish a message. Return False if it was dropped because too
+            many messages are in-flight, unless force is True
+
+            on_ack, if not None, is called without argument once the broker
+            acknowledged the message.
+        """
+        with self._condition:
+            if self._is_full() and not force:
+                self._dropped += 1
+                self.dropped_total += 1
+                return False
+
+        published_at = bleemeo_agent.util.get_clock()
+        message_info = self.mqtt_client.publish(topic, message, 1)
+
+        with self._condition:
+            acknowledged = message_info.mid in self._early_acks
+            if acknowledged:
+                self._early_acks.discard(message_info.mid)
+                self._record_latency(
+                    bleemeo_agent.util.get_clock() - published_at
+                )
+            else:
+                self._in_flight[message_info.mid] = (
+                    len(message), published_at, on_ack,
+                )
+                self._in_flight_bytes += len(message)
+        if acknowledged and on_ack is not None:
+            on_ack()
+        return True
+
+    def on_publish(self, mid):
+        """ Called when the broker acknowledged message mid
+        """
+        with self._condition:
+            entry = self._in_flight.pop(mid, None)
+            if entry is None:
+                self._early_acks.add(mid)
+                return
+            (size, published_at, on_ack) = entry
+            self._in_flight_bytes -= size
+            self._record_latency(
+                bleemeo_agent.util.get_clock() - published_at
+            )
+            self._condition.notify_all()
+        if on_ack is not None:
+            on_ack()
+
+    def _record_latency(self, latency):
+        self._latencies.append(latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+
+    def wait_for_capacity(self, timeout):
+        """ Wait until new messages could be published
+
+            Return False if still full after timeout seconds
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._is_full(), timeout,
+            )
+
+    def wait_empty(self, timeout):
+        """ Wait until all messages are acknowledged
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._in_flight, timeout,
+            )
+
+    def pop_stats(self):
+        """ Return statistics since last call as a dict with keys:
+
+            * in_flight and in_flight_bytes: messages not yet acknowledged
+            * dropped: messages dropped
+            * latency_avg and latency_max: time between publish and PUBACK,
+              None if no message was acknowledged
+        """
+        with self._condition:
+            latencies = self._latencies
+            self._latencies = []
+            dropped = self._dropped
+            self._dropped = 0
+            return {
+                'in_flight': len(self._in_flight),
+                'in_flight_bytes': self._in_flight_bytes,
+                'dropped': dropped,
+                'latency_avg': (
+                    sum(latencies) / len(latencies) if latencies else None
+                ),
+                'latency_max': max(latencies) if latencies else None,
+            }
+
+
+class SpoolDrain:
+    """ Messages of points read from the spool, waiting for acknowledgment
+
+        The spool read position is moved after those points only once all
+        messages are acknowledged, so points are not lost if the agent stops
+        before.
+    """
+
+    def __init__(self, spool, position, messages):
+        self.spool = spool
+        self.position = position
+        self.remaining = messages
+        self.started_at = bleemeo_agent.util.get_clock()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.remaining <= 0
+
+    def on_ack(self):
+        with self._lock:
+            self.remaining -= 1
+            if self.remaining:
+                return
+        self.spool.commit(self.position)
+
+    def cut(self, position, unpublished):
+        """ Stop waiting for the unpublished messages, which were not sent.
+            The spool read position is only moved to position, the position
+            after points of published messages.
+        """
+        with self._lock:
+            self.position = position
+            self.remaining -= unpublished
+            if self.remaining > 0:
+                return
+        self.spool.commit(self.position)
+
+
+class AdaptiveBatching:
+    """ Decide when BleemeoConnector._loop sends its batch of points
+
+        A batch is sent when its size reaches batch_size or when
+        flush_interval is elapsed since its first point.
+
+        * flush_interval follows the broker latency: with a responsive broker
+          points are sent quickly, with a slow one they are grouped in fewer
+          messages.
+        * batch_size is the volume of points expected during flush_interval,
+          so at high rate batches grow up to max_size.
+    """
+    MIN_FLUSH_INTERVAL = 0.5
+    MAX_FLUSH_INTERVAL = 6
+    MIN_BATCH_SIZE = 16 * 1024
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # Exponentially weighted moving average of bytes per second
+        self.rate = None
+        self.latency = None
+        self._last_flush = bleemeo_agent.util.get_clock()
+
+    @property
+    def flush_interval(self):
+        if self.latency is None:
+            return self.MAX_FLUSH_INTERVAL
+        return min(
+            self.MAX_FLUSH_INTERVAL,
+            max(self.MIN_FLUSH_INTERVAL, 2 * self.latency),
+        )
+
+    @property
+    def batch_size(self):
+        if self.rate is None:
+            return self.max_size
+        return min(
+            self.max_size,
+            max(self.MIN_BATCH_SIZE, int(self.rate * self.flush_interval)),
+        )
+
+    def record_flush(self, size, latency):
+        """ Update rate and latency after a batch of size bytes was sent
+
+            latency is the broker latency (None if unknown)
+        """
+        clock_now = bleemeo_agent.util.get_clock()
+        elapsed = max(clock_now - self._last_flush, 0.001)
+        self._last_flush = clock_now
+
+        rate = size / elapsed
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = 0.8 * self.rate + 0.2 * rate
+        if latency is not None:
+            self.latency = latency
+
+
+class UnregisteredPoints:
+    """ Points waiting for the registration of their metric
+
+        Points are indexed by metric key (label, item). Each key holds a
+        bounded ring of points, the oldest being dropped first. Releasing
+        the points of a registered metric or expiring old points only
+        touches the concerned keys.
+    """
+
+    def __init__(self, max_points_per_key=720, max_points=100000,
+                 max_age=UNREGISTERED_POINT_MAX_AGE):
+        self.max_points_per_key = max_points_per_key
+        self.max_points = max_points
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._points = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def keys(self):
+        """ Return the keys that have points waiting
+        """
+        with self._lock:
+            return list(self._points)
+
+    def put(self, key, metric_point):
+        """ Add a point. Return False if the buffer is full and the point
+            was dropped.
+        """
+        with self._lock:
+            ring = self._points.get(key)
+            if ring is None:
+                if self._count >= self.max_points:
+                    return False
+                ring = collections.deque(maxlen=self.max_points_per_key)
+                self._points[key] = ring
+            elif len(ring) == ring.maxlen:
+                self._count -= 1
+            elif self._count >= self.max_points:
+                return False
+            ring.append(metric_point)
+            self._count += 1
+            return True
+
+    def pop(self, key):
+        """ Remove and return points of given key, the oldest first
+        """
+        with self._lock:
+            ring = self._points.pop(key, None)
+            if ring is None:
+                return []
+            self._count -= len(ring)
+            return list(ring)
+
+    def expire(self, current_keys):
+        """ Drop points older than max_age and points whose key is no longer
+            in current_keys
+        """
+        min_time = time.time() - self.max_age
+        with self._lock:
+            for key in list(self._points):
+                ring = self._points[key]
+                if key not in current_keys:
+                    self._count -= len(ring)
+                    ring.clear()
+                # Points are appended in time order, old ones are at the left
+                while ring and ring[0].time < min_time:
+                    ring.popleft()
+                    self._count -= 1
+                if not ring:
+                    del self._points[key]
+
+
 class BleemeoCache:
     # pylint: disable=too-many-instance-attributes
     """ In-memory cache backed with state file for Bleemeo API
@@ -437,6 +1022,10 @@ class BleemeoCache:
         self.next_config_at = None
         self.registration_at = None
         self.account_id = None
+        # Highest updated_at of metrics read by the last full or incremental
+        # synchronization (as sent by API) and time of the last full one.
+        self.metrics_updated_at = None
+        self.metrics_full_sync_at = None
 
         self.metrics_by_labelitem = {}
         self.containers_by_name = {}
@@ -450,6 +1039,12 @@ class BleemeoCache:
             self._reload()
 
     def copy(self):
+        """ Return a snapshot of the cache
+
+            Lookup maps are copied rather than rebuilt. The snapshot is
+            never modified after its creation, so it could be published
+            to other threads by a simple assignment.
+        """
         new = BleemeoCache(self._state, skip_load=True)
         new.metrics = self.metrics.copy()
         new.services = self.services.copy()
@@ -460,12 +1055,16 @@ class BleemeoCache:
         new.next_config_at = self.next_config_at
         new.registration_at = self.registration_at
         new.account_id = self.account_id
-        new.update_lookup_map()
+        new.metrics_updated_at = self.metrics_updated_at
+        new.metrics_full_sync_at = self.metrics_full_sync_at
+        new.metrics_by_labelitem = self.metrics_by_labelitem.copy()
+        new.containers_by_name = self.containers_by_name.copy()
+        new.services_by_labelinstance = self.services_by_labelinstance.copy()
+        new.facts_by_key = self.facts_by_key.copy()
         return new
 
     def _reload(self):
         # pylint: disable=too-many-branches
-        self._state.reload()
         cache = self._state.get("_bleemeo_cache")
 
         if cache['version'] > self.CACHE_VERSION:
@@ -487,6 +1086,9 @@ class BleemeoCache:
         if account_id:
             self.account_id = account_id
 
+        self.metrics_updated_at = cache.get('metrics_updated_at')
+        self.metrics_full_sync_at = cache.get('metrics_full_sync_at')
+
         for metric_uuid, values in cache['metrics'].items():
             values[6] = MetricThreshold(*values[6])
             if cache['version'] < 3:
@@ -545,25 +1147,42 @@ class BleemeoCache:
 
         self.update_lookup_map()
 
-    def update_lookup_map(self):
-        self.metrics_by_labelitem = {}
-        self.containers_by_name = {}
-        self.services_by_labelinstance = {}
-        self.facts_by_key = {}
+        if cache['version'] < self.CACHE_VERSION:
+            # Store the converted cache, so conversion is only done once
+            self.save()
 
-        for metric in self.metrics.values():
-            item = metric.labels.get('item', '')
-            self.metrics_by_labelitem[(metric.label, item)] = metric
+    def update_lookup_map(self, *partitions):
+        """ Rebuild lookup maps of given partitions ("metrics",
+            "containers", "services" or "facts"). All by default.
+
+            Each map is built before being assigned, so other threads never
+            see a partially built map.
+        """
+        if not partitions:
+            partitions = ('metrics', 'containers', 'services', 'facts')
 
-        for container in self.containers.values():
-            self.containers_by_name[container.name] = container
+        if 'metrics' in partitions:
+            self.metrics_by_labelitem = {
+                (metric.label, metric.labels.get('item', '')): metric
+                for metric in self.metrics.values()
+            }
 
-        for service in self.services.values():
-            key = (service.label, service.instance)
-            self.services_by_labelinstance[key] = service
+        if 'containers' in partitions:
+            self.containers_by_name = {
+                container.name: container
+                for container in self.containers.values()
+            }
+
+        if 'services' in partitions:
+            self.services_by_labelinstance = {
+                (service.label, service.instance): service
+                for service in self.services.values()
+            }
 
-        for fact in self.facts.values():
-            self.facts_by_key[fact.key] = fact
+        if 'facts' in partitions:
+            self.facts_by_key = {
+                fact.key: fact for fact in self.facts.values()
+            }
 
     def get_core_thresholds(self):
         """ Return thresholds in a format adapted for bleemeo_agent.core
@@ -590,11 +1209,13 @@ class BleemeoCache:
     def save(self):
         cache = {
             'version': self.CACHE_VERSION,
-            'metrics': self.metrics,
-            'services': self.services,
-            'tags': self.tags,
+            # State is written in background, don't give it dicts which
+            # are modified by next synchronization
+            'metrics': dict(self.metrics),
+            'services': dict(self.services),
+            'tags': list(self.tags),
             'facts': list(self.facts.values()),
-            'containers': self.containers,
+            'containers': dict(self.containers),
             'current_config': self.current_config,
             'next_config_at':
                 self.next_config_at.timestamp()
@@ -603,6 +1224,8 @@ class BleemeoCache:
                 self.registration_at.strftime('%Y-%m-%d %H:%M:%S.%f')
                 if self.registration_at else None,
             'account_id': self.account_id,
+            'metrics_updated_at': self.metrics_updated_at,
+            'metrics_full_sync_at': self.metrics_full_sync_at,
         }
         self._state.set('_bleemeo_cache', cache)
 
@@ -705,14 +1328,21 @@ class BleemeoConnector(threading.Thread):
         self.core = core
 
         self._metric_queue = queue.Queue(10000)
-        self._unregistered_metric_queue = queue.Queue()
+        self._unregistered_points = UnregisteredPoints()
         self.connected = False
         self._last_disconnects = []
         self._successive_mqtt_errors = 0
         self._mqtt_reconnect_at = 0
         self._duplicate_disable_until = 0
-        self._mqtt_queue_size = 0
         self._mqtt_thread = None
+        self._spool = None
+        self._spool_drained_at = bleemeo_agent.util.get_clock()
+        self._spool_drain = None
+        self._batching = None
+        # (label, item, has service_instance) => (uuid, measurement, item)
+        # for registered metrics. Valid for one metrics_by_labelitem.
+        self._wire_metrics = {}
+        self._wire_metrics_source = None
         self._last_diagnostic = None
 
         self.trigger_full_sync = False
@@ -726,8 +1356,13 @@ class BleemeoConnector(threading.Thread):
         self._account_mismatch_notify_at = None
 
         self.mqtt_client = mqtt.Client()
+        self._publisher = MqttPublisher(self.mqtt_client)
 
         self._api_support_labels = True
+        self._api_support_bulk = True
+        self._registration_limiter = RateLimiter(
+            self.core.config['bleemeo.metric_registration.rate_limit'],
+        )
         self._current_metrics = {}
         self._current_metrics_lock = threading.Lock()
         # Make sure this metrics exists and try to be registered
@@ -854,8 +1489,8 @@ class BleemeoConnector(threading.Thread):
                     bleemeo_agent.util.get_clock()
                 )
 
-    def on_publish(self, _client, _userdata, _mid):
-        self._mqtt_queue_size -= 1
+    def on_publish(self, _client, _userdata, mid):
+        self._publisher.on_publish(mid)
         self.core.update_last_report()
 
     def check_config_requirement(self):
@@ -875,6 +1510,7 @@ class BleemeoConnector(threading.Thread):
         if self.core.state.get('password') is None:
             self.core.state.set(
                 'password', bleemeo_agent.util.generate_password())
+            self.core.state.flush()
 
     def init(self):
         if self.core.sentry_client and self.agent_uuid:
@@ -895,6 +1531,27 @@ class BleemeoConnector(threading.Thread):
                 self._bleemeo_cache.current_config.metric_resolution,
             )
 
+        if self.core.config['bleemeo.spool.enabled']:
+            spool_directory = self.core.config['bleemeo.spool.directory']
+            if not spool_directory:
+                spool_directory = os.path.join(
+                    os.path.dirname(self.core.config['agent.state_file']),
+                    'spool',
+                )
+            try:
+                self._spool = bleemeo_agent.spool.MetricSpool(
+                    spool_directory,
+                    self.core.config['bleemeo.spool.max_size'],
+                    PRIORITY_METRIC_LABELS,
+                )
+            except (OSError, IOError) as exc:
+                logging.warning(
+                    'Unable to use spool directory %s: %s. Points will be'
+                    ' dropped while Bleemeo Cloud platform is unreachable',
+                    spool_directory,
+                    exc,
+                )
+
     def run(self):
         try:
             self.check_config_requirement()
@@ -914,6 +1571,7 @@ class BleemeoConnector(threading.Thread):
 
         while not self.core.is_terminating.is_set():
             self._loop()
+            self._drain_spool()
             self._mqtt_check()
 
         if self.connected and self.upgrade_in_progress:
@@ -930,6 +1588,9 @@ class BleemeoConnector(threading.Thread):
             )
 
         self._mqtt_stop(wait_delay=5)
+        if self._spool is not None:
+            self._spool_queued_points()
+            self._spool.close()
         self._sync_loop_event.set()  # unblock sync_loop thread
         sync_thread.join(5)
 
@@ -977,21 +1638,26 @@ class BleemeoConnector(threading.Thread):
             )
             need_diag = True
 
-        if self._mqtt_queue_size >= MQTT_QUEUE_MAX_SIZE:
+        if self._publisher.is_full():
             logging.warning(
                 'Sending queue to Bleemeo Cloud is full. '
-                'New messages are dropped'
+                'New points are delayed or dropped'
             )
-        elif self._mqtt_queue_size > 10:
+        elif self._publisher.in_flight > 10:
             logging.info(
                 '%s messages waiting to be sent to Bleemeo Cloud',
-                self._mqtt_queue_size,
+                self._publisher.in_flight,
+            )
+        if self._publisher.dropped_total:
+            logging.info(
+                '%s messages to Bleemeo Cloud were dropped since agent start',
+                self._publisher.dropped_total,
             )
 
-        if self._unregistered_metric_queue.qsize() > 10:
+        if len(self._unregistered_points) > 10:
             logging.info(
                 '%s metric points blocked due to metric not yet registered',
-                self._unregistered_metric_queue.qsize(),
+                len(self._unregistered_points),
             )
 
         if need_diag and (
@@ -1153,9 +1819,7 @@ class BleemeoConnector(threading.Thread):
     def _mqtt_stop(self, wait_delay=5):
         if wait_delay:
             deadline = bleemeo_agent.util.get_clock() + wait_delay
-            while (self._mqtt_queue_size > 0
-                   and bleemeo_agent.util.get_clock() < deadline):
-                time.sleep(0.1)
+            self._publisher.wait_empty(wait_delay)
         else:
             deadline = 0
 
@@ -1189,91 +1853,241 @@ class BleemeoConnector(threading.Thread):
             self._mqtt_start()
 
     def _loop(self):
-        # pylint: disable=too-many-branches
         """ Call as long as agent is running. It's the "main" method for
             Bleemeo connector thread.
         """
-        metrics = []
-        timeout = 6
-        deadline = None
+        if (self.connected
+                and not self._publisher.wait_for_capacity(timeout=1)
+                and self._metric_queue.qsize() < METRIC_QUEUE_HIGH_WATERMARK):
+            # Too many messages are waiting for acknowledgment. Leave points
+            # in the queue until the broker catch up.
+            return
 
-        try:
-            while True:
-                metric_point = self._metric_queue.get(timeout=timeout)
-                if metric_point is None:
-                    break
-                if deadline is None:
-                    deadline = time.time() + 6
-                timeout = max(0, min(deadline - time.time(), 6))
-                if self._duplicate_disable_until:
-                    continue
-                item = metric_point.labels.get('item', '')
-                short_item = item[:API_METRIC_ITEM_LENGTH]
-                if metric_point.service_instance:
-                    short_item = short_item[:API_SERVICE_INSTANCE_LENGTH]
-                key = (
-                    metric_point.label,
-                    short_item,
-                )
-                metric = self._bleemeo_cache.metrics_by_labelitem.get(key)
+        max_size = self.core.config['bleemeo.mqtt.data_max_size']
+        if self._batching is None or self._batching.max_size != max_size:
+            self._batching = AdaptiveBatching(max_size)
+        batch_size = self._batching.batch_size
 
-                if metric is None:
-                    if time.time() - metric_point.time > 7200:
-                        continue
-                    elif key not in self._current_metrics:
-                        continue
-                    else:
-                        if self._unregistered_metric_queue.qsize() > 100000:
-                            self._unregistered_metric_queue_cleanup()
-                        self._unregistered_metric_queue.put(metric_point)
-                    continue
+        payload = self._new_data_payload()
+        metrics = []
 
-                bleemeo_metric = {
-                    'uuid': metric.uuid,
-                    'measurement': metric.label,
-                    'time': metric_point.time,
-                    'value': metric_point.value,
-                }
-                if 'item' in metric.labels:
-                    bleemeo_metric['item'] = metric.labels['item']
-                if metric_point.status_code is not None:
-                    bleemeo_metric['status'] = bleemeo_agent.type.STATUS_NAME[
-                        metric_point.status_code
-                    ]
-                    if metric_point.service_label:
-                        # If the service received a kill signal, give 5 minutes
-                        # of grace time after that kill signal.
-                        service_key = (
-                            metric_point.service_label,
-                            metric_point.service_instance,
-                        )
-                        last_kill_at = self.core.services.get(
-                            service_key, {}
-                        ).get(
-                            'last_kill_at', 0,
-                        )
-                        clock_now = bleemeo_agent.util.get_clock()
-                        grace_period = last_kill_at + 300 - clock_now
-                        # Ignore grace period shorter than 1 minute. Without
-                        # explicit grace period, a default of 1 minute will
-                        # be used.
-                        if grace_period > 60:
-                            bleemeo_metric['event_grace_period'] = grace_period
-                if metric_point.problem_origin:
-                    bleemeo_metric['check_output'] = (
-                        metric_point.problem_origin
-                    )
-                metrics.append(bleemeo_metric)
-                if len(metrics) > 2000:
+        try:
+            metric_point = self._metric_queue.get(timeout=6)
+            deadline = (
+                bleemeo_agent.util.get_clock() + self._batching.flush_interval
+            )
+            while metric_point is not None:
+                self._add_metric_point(payload, metrics, metric_point)
+                if payload.size >= batch_size:
                     break
+                # Take all points already queued before waiting
+                try:
+                    metric_point = self._metric_queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - bleemeo_agent.util.get_clock()
+                    if timeout <= 0:
+                        break
+                    metric_point = self._metric_queue.get(timeout=timeout)
         except queue.Empty:
             pass
 
-        if metrics:
+        if not payload:
+            return
+
+        if self._spool is not None and not self._can_publish_data():
+            # Keep points on disk rather than dropping them. They are sent
+            # by _drain_spool once connection is back.
+            self._spool.put(metrics)
+        else:
             self.publish(
-                'v1/agent/%s/data' % self.agent_uuid,
-                json.dumps(metrics)
+                payload.topic(self.agent_uuid),
+                payload.encode(),
+            )
+        self._batching.record_flush(payload.size, self._publisher.latency)
+
+    def _get_wire_metric(self, metric_point):
+        """ Return (uuid, measurement, item) of the registered metric for
+            metric_point and the key in metrics_by_labelitem.
+
+            The first element is None if the metric isn't registered. item
+            is None if the metric has no item label.
+        """
+        metrics_by_labelitem = self._bleemeo_cache.metrics_by_labelitem
+        if metrics_by_labelitem is not self._wire_metrics_source:
+            # The cache was refreshed, metrics may have been deleted.
+            self._wire_metrics = {}
+            self._wire_metrics_source = metrics_by_labelitem
+
+        item = metric_point.labels.get('item', '')
+        cache_key = (
+            metric_point.label, item, bool(metric_point.service_instance),
+        )
+        wire_metric = self._wire_metrics.get(cache_key)
+        if wire_metric is not None:
+            return (wire_metric, None)
+
+        short_item = item[:API_METRIC_ITEM_LENGTH]
+        if metric_point.service_instance:
+            short_item = short_item[:API_SERVICE_INSTANCE_LENGTH]
+        key = (metric_point.label, short_item)
+        metric = metrics_by_labelitem.get(key)
+        if metric is None:
+            return (None, key)
+
+        wire_metric = (metric.uuid, metric.label, metric.labels.get('item'))
+        self._wire_metrics[cache_key] = wire_metric
+        return (wire_metric, key)
+
+    def _add_metric_point(self, payload, metrics, metric_point):
+        """ Convert metric_point to the format sent to Bleemeo Cloud platform
+            and add it to payload and metrics.
+
+            Points of not yet registered metrics are kept in
+            _unregistered_points.
+        """
+        if self._duplicate_disable_until:
+            return
+
+        (wire_metric, key) = self._get_wire_metric(metric_point)
+        if wire_metric is None:
+            if time.time() - metric_point.time > UNREGISTERED_POINT_MAX_AGE:
+                return
+            elif key not in self._current_metrics:
+                return
+            if not self._unregistered_points.put(key, metric_point):
+                self._unregistered_points.expire(self._current_metrics)
+                self._unregistered_points.put(key, metric_point)
+            return
+
+        (uuid, measurement, item) = wire_metric
+        bleemeo_metric = {
+            'uuid': uuid,
+            'measurement': measurement,
+            'time': metric_point.time,
+            'value': metric_point.value,
+        }
+        if item is not None:
+            bleemeo_metric['item'] = item
+        if metric_point.status_code is not None:
+            bleemeo_metric['status'] = bleemeo_agent.type.STATUS_NAME[
+                metric_point.status_code
+            ]
+            if metric_point.service_label:
+                # If the service received a kill signal, give 5 minutes
+                # of grace time after that kill signal.
+                service_key = (
+                    metric_point.service_label,
+                    metric_point.service_instance,
+                )
+                last_kill_at = self.core.services.get(
+                    service_key, {}
+                ).get(
+                    'last_kill_at', 0,
+                )
+                clock_now = bleemeo_agent.util.get_clock()
+                grace_period = last_kill_at + 300 - clock_now
+                # Ignore grace period shorter than 1 minute. Without
+                # explicit grace period, a default of 1 minute will
+                # be used.
+                if grace_period > 60:
+                    bleemeo_metric['event_grace_period'] = grace_period
+        if metric_point.problem_origin:
+            bleemeo_metric['check_output'] = metric_point.problem_origin
+        payload.add(bleemeo_metric)
+        metrics.append(bleemeo_metric)
+
+    def _new_data_payload(self):
+        return DataPayload(
+            compact=self.core.config['bleemeo.mqtt.data_encoding'] == 'compact'
+        )
+
+    def _can_publish_data(self):
+        return self.connected and not self._publisher.is_full()
+
+    def _drain_spool(self):
+        """ Send points kept in the spool during a disconnection
+
+            At most bleemeo.spool.drain_rate points per second are sent and
+            only when few messages are waiting to be sent, so live points
+            are not delayed.
+        """
+        clock_now = bleemeo_agent.util.get_clock()
+        elapsed = min(clock_now - self._spool_drained_at, 10)
+        self._spool_drained_at = clock_now
+
+        if self._spool is None or not self.connected:
+            return
+        if self._publisher.in_flight > 10 or not self._spool:
+            return
+
+        drain = self._spool_drain
+        if drain is not None and not drain.done:
+            if clock_now - drain.started_at < SPOOL_ACK_TIMEOUT:
+                # Wait for the previous points to be acknowledged
+                return
+            logging.info(
+                'Points sent from the spool were not acknowledged, '
+                'sending them again'
             )
+        self._spool_drain = None
+
+        (points, position) = self._spool.peek(
+            int(elapsed * self.core.config['bleemeo.spool.drain_rate'])
+        )
+        max_size = self.core.config['bleemeo.mqtt.data_max_size']
+        # List of (payload, number of points up to the end of this payload)
+        payloads = []
+        payload = self._new_data_payload()
+        for (index, bleemeo_metric) in enumerate(points):
+            payload.add(bleemeo_metric)
+            if payload.size >= max_size:
+                payloads.append((payload, index + 1))
+                payload = self._new_data_payload()
+        if payload:
+            payloads.append((payload, len(points)))
+
+        if not payloads:
+            # Only corrupted or already read records were skipped
+            self._spool.commit(position)
+            return
+
+        drain = SpoolDrain(self._spool, position, len(payloads))
+        published_points = 0
+        for (index, (payload, points_count)) in enumerate(payloads):
+            published = self.publish(
+                payload.topic(self.agent_uuid),
+                payload.encode(),
+                on_ack=drain.on_ack,
+            )
+            if not published:
+                if index == 0:
+                    # Points stay in the spool, they will be sent again
+                    return
+                # Only points of published messages are removed from the
+                # spool once acknowledged, others will be sent again.
+                # Corrupted records count as points in peek(), so in the
+                # worst case some points are sent twice but none are lost.
+                (_, published_position) = self._spool.peek(published_points)
+                drain.cut(published_position, len(payloads) - index)
+                break
+            published_points = points_count
+        self._spool_drain = drain
+
+    def _spool_queued_points(self):
+        """ Store in the spool points still in _metric_queue, so they are
+            sent after the restart instead of being lost
+        """
+        payload = self._new_data_payload()
+        metrics = []
+        while True:
+            try:
+                metric_point = self._metric_queue.get_nowait()
+            except queue.Empty:
+                break
+            if metric_point is not None:
+                self._add_metric_point(payload, metrics, metric_point)
+        if metrics:
+            self._spool.put(metrics)
 
     def publish_top_info(self, top_info):
         if self.agent_uuid is None:
@@ -1287,15 +2101,35 @@ class BleemeoConnector(threading.Thread):
             bytearray(zlib.compress(json.dumps(top_info).encode('utf8')))
         )
 
-    def publish(self, topic, message, force=False):
-        if self._mqtt_queue_size > MQTT_QUEUE_MAX_SIZE and not force:
-            return
+    def publish(self, topic, message, force=False, on_ack=None):
+        """ Publish a message. Return False if it was dropped
+
+            on_ack is called once the message is acknowledged
+        """
+        return self._publisher.publish(topic, message, force, on_ack)
 
-        self._mqtt_queue_size += 1
-        self.mqtt_client.publish(
-            topic,
-            message,
-            1)
+    def get_internal_metrics(self, timestamp):
+        """ Return points about the connection to Bleemeo Cloud platform:
+            messages waiting for acknowledgment, publish latency, dropped
+            messages and points waiting to be sent
+        """
+        stats = self._publisher.pop_stats()
+        values = [
+            ('agent_mqtt_in_flight_messages', stats['in_flight']),
+            ('agent_mqtt_in_flight_bytes', stats['in_flight_bytes']),
+            ('agent_mqtt_dropped_messages', stats['dropped']),
+            ('agent_mqtt_publish_latency', stats['latency_avg']),
+            ('agent_metric_queue_size', self._metric_queue.qsize()),
+        ]
+        return [
+            bleemeo_agent.type.MetricPoint(
+                label=label,
+                time=timestamp,
+                value=float(value),
+            )
+            for (label, value) in values
+            if value is not None
+        ]
 
     def register(self):
         """ Register the agent to Bleemeo SaaS service
@@ -1351,6 +2185,8 @@ class BleemeoConnector(threading.Thread):
                 and content is not None
                 and 'id' in content):
             self.core.state.set('agent_uuid', content['id'])
+            # Losing it would register the agent again
+            self.core.state.flush()
             logging.debug('Regisration successfull')
         elif content is not None:
             if 'Invalid username/password' in str(content):
@@ -1648,6 +2484,9 @@ class BleemeoConnector(threading.Thread):
                         # After 3 successive_errors force a full sync.
                         successive_errors == 3
                     )
+                    if successive_errors == 3:
+                        # Don't trust incremental synchronization either
+                        bleemeo_cache.metrics_full_sync_at = None
                     sync_success = self._sync_metrics(
                         bleemeo_cache, bleemeo_api, update_metrics, full,
                     )
@@ -1676,9 +2515,7 @@ class BleemeoConnector(threading.Thread):
             self._bleemeo_cache = bleemeo_cache.copy()
 
             if sync_run:
-                self._unregistered_metric_queue_cleanup(
-                    push_to_metric_queue=True
-                )
+                self._unregistered_points_cleanup()
 
     @property
     def registration_at(self):
@@ -1840,20 +2677,70 @@ class BleemeoConnector(threading.Thread):
             inactive_full = True
 
         if full:
-            # retry labels update
+            # retry labels update and bulk registration
             self._api_support_labels = True
+            self._api_support_bulk = True
+
+        # Only fetch metrics changed since last synchronization, unless
+        # the last full synchronization is too old.
+        delta_since = None
+        if (full and not inactive_full
+                and bleemeo_cache.metrics_updated_at
+                and bleemeo_cache.metrics_full_sync_at
+                and time.time() - bleemeo_cache.metrics_full_sync_at
+                < METRICS_FULL_SYNC_INTERVAL):
+            delta_since = bleemeo_cache.metrics_updated_at
+
+        # Larger pages for agents with lots of metrics
+        page_size = min(
+            METRICS_MAX_PAGE_SIZE,
+            max(100, len(bleemeo_cache.metrics) // 10),
+        )
 
         # Step 1: refresh cache from API
-        if full and inactive_full:
+        active_uuids = None
+        if delta_since:
+            # Metrics deleted from API are not returned by a query on
+            # updated_at. Find them by listing the IDs of active metrics.
+            active_uuids = set(
+                data['id']
+                for data in bleemeo_api.api_iterator(
+                    metric_url,
+                    params={
+                        'agent': self.agent_uuid,
+                        'active': 'True',
+                        'page_size': METRICS_MAX_PAGE_SIZE,
+                        'fields': 'id',
+                    },
+                )
+            )
+            logging.debug('Fetch metrics updated since %s', delta_since)
+            api_metrics = bleemeo_api.api_iterator(
+                metric_url,
+                params={
+                    'agent': self.agent_uuid,
+                    'updated_at__gte': delta_since,
+                    'page_size': page_size,
+                    'fields':
+                        'id,item,label,labels,unit,unit_text,deactivated_at'
+                        ',threshold_low_warning,threshold_low_critical'
+                        ',threshold_high_warning,threshold_high_critical'
+                        ',service,container,status_of,updated_at',
+                },
+            )
+
+            old_metrics = bleemeo_cache.metrics.copy()
+        elif full and inactive_full:
             api_metrics = bleemeo_api.api_iterator(
                 metric_url,
                 params={
                     'agent': self.agent_uuid,
+                    'page_size': page_size,
                     'fields':
                         'id,item,label,labels,unit,unit_text,deactivated_at'
                         ',threshold_low_warning,threshold_low_critical'
                         ',threshold_high_warning,threshold_high_critical'
-                        ',service,container,status_of',
+                        ',service,container,status_of,updated_at',
                 },
             )
 
@@ -1865,11 +2752,12 @@ class BleemeoConnector(threading.Thread):
                 params={
                     'agent': self.agent_uuid,
                     'active': 'True',
+                    'page_size': page_size,
                     'fields':
                         'id,item,label,labels,unit,unit_text,deactivated_at'
                         ',threshold_low_warning,threshold_low_critical'
                         ',threshold_high_warning,threshold_high_critical'
-                        ',service,container,status_of',
+                        ',service,container,status_of,updated_at',
                 },
             )
 
@@ -1910,10 +2798,32 @@ class BleemeoConnector(threading.Thread):
             old_metrics = bleemeo_cache.metrics.copy()
 
         if api_metrics:
+            updated_at = bleemeo_cache.metrics_updated_at
+            updated_at_time = _api_datetime_to_time(updated_at) or 0
+            fetched_uuids = set()
             for data in api_metrics:
                 metric = _api_metric_to_internal(data)
                 bleemeo_cache.metrics[metric.uuid] = metric
-            bleemeo_cache.update_lookup_map()
+                fetched_uuids.add(metric.uuid)
+                metric_time = _api_datetime_to_time(data.get('updated_at'))
+                if metric_time and metric_time > updated_at_time:
+                    updated_at = data['updated_at']
+                    updated_at_time = metric_time
+            if active_uuids is not None:
+                # Inactive metrics are kept, as in other full synchronization
+                bleemeo_cache.metrics = {
+                    metric_uuid: metric
+                    for (metric_uuid, metric) in bleemeo_cache.metrics.items()
+                    if metric_uuid in active_uuids
+                    or metric_uuid in fetched_uuids
+                    or metric.deactivated_at
+                }
+            if full:
+                # The cursor is only valid after reading all changes
+                bleemeo_cache.metrics_updated_at = updated_at
+                if not delta_since:
+                    bleemeo_cache.metrics_full_sync_at = time.time()
+            bleemeo_cache.update_lookup_map('metrics')
 
         if not inactive_full:
             for key in pending_registrations:
@@ -1937,7 +2847,7 @@ class BleemeoConnector(threading.Thread):
                 for data in api_metrics:
                     metric = _api_metric_to_internal(data)
                     bleemeo_cache.metrics[metric.uuid] = metric
-            bleemeo_cache.update_lookup_map()
+            bleemeo_cache.update_lookup_map('metrics')
 
         # Step 2: delete local object that are deleted from API
         deleted_metrics = []
@@ -1950,17 +2860,10 @@ class BleemeoConnector(threading.Thread):
             self.core.purge_metrics(deleted_metrics)
 
         # Step 3: register/update object present in local but not in API
-        registration_error = 0
-        last_error = None
-
         metric_last_seen = {}
         service_short_lookup = services_to_short_key(self.core.services)
-        metrics_req_count = len(current_metrics)
-        count = 0
-        reg_count_before_update = 30
-        while current_metrics:
-            reg_req = current_metrics.pop(0)
-            count += 1
+        registrations = []
+        for reg_req in current_metrics:
             item = reg_req.labels.get('item', '')
             short_item = item[:API_METRIC_ITEM_LENGTH]
             if reg_req.service_label:
@@ -2020,37 +2923,7 @@ class BleemeoConnector(threading.Thread):
                         del bleemeo_cache.metrics[metric.uuid]
                         continue
             else:
-                if reg_req.status_of_label:
-                    status_of_key = (reg_req.status_of_label, short_item)
-                    if status_of_key not in bleemeo_cache.metrics_by_labelitem:
-                        if count >= metrics_req_count:
-                            logging.debug(
-                                'Metric %s need the metric %s (for status_of)',
-                                reg_req.label,
-                                reg_req.status_of_label,
-                            )
-                        else:
-                            current_metrics.append(reg_req)
-                        continue
-                try:
-                    metric = self._register_metric(
-                        bleemeo_cache,
-                        bleemeo_api,
-                        reg_req,
-                        short_item,
-                        service_short_lookup,
-                    )
-                except ApiError as error:
-                    metric = None
-                    if error.response.status_code >= 500:
-                        raise
-                    registration_error += 1
-                    last_error = error
-                    time.sleep(min(registration_error * 0.5, 5))
-                    if registration_error > 10:
-                        raise last_error
-                reg_count_before_update -= 1
-            if not metric:
+                registrations.append((reg_req, short_item))
                 continue
 
             bleemeo_cache.metrics[metric.uuid] = metric
@@ -2058,15 +2931,15 @@ class BleemeoConnector(threading.Thread):
                 metric
             )
             metric_last_seen[metric.uuid] = reg_req.last_seen
-            if reg_count_before_update == 0:
-                bleemeo_cache.update_lookup_map()
-                self._bleemeo_cache = bleemeo_cache
-                reg_count_before_update = 60
-                self._unregistered_metric_queue_cleanup(
-                    push_to_metric_queue=True
-                )
 
-        bleemeo_cache.update_lookup_map()
+        last_error = self._sync_register_metrics(
+            bleemeo_cache,
+            bleemeo_api,
+            registrations,
+            service_short_lookup,
+            metric_last_seen,
+        )
+        bleemeo_cache.update_lookup_map('metrics')
 
         # Step 4: delete object present in API by not in local
         # Only metric $SERVICE_NAME_status from service with ignore_check=True
@@ -2142,7 +3015,7 @@ class BleemeoConnector(threading.Thread):
                     bleemeo_cache.metrics[metric.uuid] = (
                         metric._replace(deactivated_at=time.time())
                     )
-            bleemeo_cache.update_lookup_map()
+            bleemeo_cache.update_lookup_map('metrics')
 
         self.core.update_thresholds(bleemeo_cache.get_core_thresholds())
         self.core.metrics_unit = bleemeo_cache.get_core_units()
@@ -2176,7 +3049,7 @@ class BleemeoConnector(threading.Thread):
             for (metric_uuid, metric) in bleemeo_cache.metrics.items()
             if not metric.deactivated_at or metric.deactivated_at > cutoff
         }
-        bleemeo_cache.update_lookup_map()
+        bleemeo_cache.update_lookup_map('metrics')
 
         if last_error is not None:
             raise last_error  # pylint: disable=raising-bad-type
@@ -2242,14 +3115,150 @@ class BleemeoConnector(threading.Thread):
             api_labels = data['labels']
         return metric._replace(labels=api_labels)
 
-    def _register_metric(
-            self, bleemeo_cache, bleemeo_api, reg_req, short_item,
-            service_short_lookup):
+    def _sync_register_metrics(
+            self, bleemeo_cache, bleemeo_api, registrations,
+            service_short_lookup, metric_last_seen):
         # pylint: disable=too-many-arguments
         # pylint: disable=too-many-locals
-        # pylint: disable=too-many-return-statements
-        # pylint: disable=too-many-branches
-        metric_url = 'v1/metric/'
+        """ Register metrics that are not present on API
+
+            registrations is a list of (reg_req, short_item), the first ones
+            are registered first. Metrics are registered by chunk, using
+            bleemeo.metric_registration.workers concurrent requests. After
+            each chunk the cache is made visible, so points of registered
+            metrics could be sent.
+
+            A metric with a status_of is registered once the metric it
+            refers to is registered.
+
+            Return the last client error (or None). Server errors are raised.
+        """
+        registration_error = 0
+        last_error = None
+        chunk_size = 30
+
+        workers = max(
+            1, self.core.config['bleemeo.metric_registration.workers'],
+        )
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            while registrations:
+                ready = []
+                waiting = []
+                for (reg_req, short_item) in registrations:
+                    status_of_key = (reg_req.status_of_label, short_item)
+                    if (reg_req.status_of_label and status_of_key
+                            not in bleemeo_cache.metrics_by_labelitem):
+                        waiting.append((reg_req, short_item))
+                    else:
+                        ready.append((reg_req, short_item))
+
+                if not ready:
+                    for (reg_req, short_item) in waiting:
+                        logging.debug(
+                            'Metric %s need the metric %s (for status_of)',
+                            reg_req.label,
+                            reg_req.status_of_label,
+                        )
+                    break
+                registrations = waiting
+
+                while ready:
+                    chunk = ready[:chunk_size]
+                    ready = ready[chunk_size:]
+                    chunk_size = 60
+
+                    results = self._register_metrics_chunk(
+                        executor,
+                        bleemeo_cache,
+                        bleemeo_api,
+                        chunk,
+                        service_short_lookup,
+                    )
+                    chunk_error = 0
+                    for ((reg_req, short_item), result) in zip(chunk, results):
+                        if isinstance(result, ApiError):
+                            if result.response.status_code >= 500:
+                                raise result
+                            chunk_error += 1
+                            last_error = result
+                            continue
+                        if result is None:
+                            continue
+                        bleemeo_cache.metrics[result.uuid] = result
+                        bleemeo_cache.metrics_by_labelitem[
+                            (reg_req.label, short_item)
+                        ] = result
+                        metric_last_seen[result.uuid] = reg_req.last_seen
+
+                    if chunk_error:
+                        registration_error += chunk_error
+                        if registration_error > 10:
+                            raise last_error
+                        time.sleep(min(registration_error * 0.5, 5))
+
+                    # metrics_by_labelitem is already up-to-date, publish it
+                    self._bleemeo_cache = bleemeo_cache.copy()
+                    self._unregistered_points_cleanup()
+
+        return last_error
+
+    def _register_metrics_chunk(
+            self, executor, bleemeo_cache, bleemeo_api, chunk,
+            service_short_lookup):
+        # pylint: disable=too-many-arguments
+        """ Register a chunk of metrics and return, for each of them, the
+            registered metric, None if it could not yet be registered or
+            the ApiError.
+        """
+        payloads = [
+            self._metric_registration_payload(
+                bleemeo_cache, reg_req, short_item, service_short_lookup,
+            )
+            for (reg_req, short_item) in chunk
+        ]
+        results = [None] * len(chunk)
+
+        indexes = [i for (i, payload) in enumerate(payloads) if payload]
+        if (self.core.config['bleemeo.metric_registration.bulk']
+                and self._api_support_bulk):
+            bulk_size = max(
+                1, self.core.config['bleemeo.metric_registration.bulk_size']
+            )
+            remaining = []
+            for start in range(0, len(indexes), bulk_size):
+                batch = indexes[start:start + bulk_size]
+                metrics = self._register_metrics_bulk(
+                    bleemeo_api, [payloads[i] for i in batch],
+                )
+                if metrics is None:
+                    remaining.extend(batch)
+                    continue
+                for (i, metric) in zip(batch, metrics):
+                    results[i] = metric
+            indexes = remaining
+
+        def register(index):
+            try:
+                return self._register_metric_with_retry(
+                    bleemeo_api, payloads[index],
+                )
+            except ApiError as error:
+                logging.debug(
+                    'Metric registration failed for %s: %s',
+                    chunk[index][0].label,
+                    error,
+                )
+                return error
+
+        for (i, result) in zip(indexes, executor.map(register, indexes)):
+            results[i] = result
+        return results
+
+    def _metric_registration_payload(
+            self, bleemeo_cache, reg_req, short_item, service_short_lookup):
+        """ Return the object to POST to register the metric, or None if
+            objects it depends on are not yet registered
+        """
         payload = {
             'agent': self.agent_uuid,
             'label': reg_req.label,
@@ -2258,7 +3267,7 @@ class BleemeoConnector(threading.Thread):
         if reg_req.status_of_label:
             status_of_key = (reg_req.status_of_label, short_item)
             if status_of_key not in bleemeo_cache.metrics_by_labelitem:
-                return (None, None)
+                return None
             payload['status_of'] = (
                 bleemeo_cache.metrics_by_labelitem[status_of_key].uuid
             )
@@ -2294,47 +3303,130 @@ class BleemeoConnector(threading.Thread):
             )
             payload['problem_origins'] = [reg_req.last_problem_origins]
 
+        return payload
+
+    def _register_metric_with_retry(self, bleemeo_api, payload):
+        """ Register one metric, retrying on server errors and when the
+            request didn't reach the server.
+
+            After a read timeout the metric may have been created, so it's
+            looked up before being registered again.
+        """
+        retries = self.core.config['bleemeo.metric_registration.retries']
+        attempt = 0
+        while True:
+            self._registration_limiter.acquire()
+            try:
+                return self._register_metric(bleemeo_api, payload)
+            except ApiError as error:
+                if error.response.status_code < 500 or attempt >= retries:
+                    raise
+                logging.debug(
+                    'Metric registration of %s failed, will retry: %s',
+                    payload['label'],
+                    error,
+                )
+            except requests.exceptions.ConnectionError as exc:
+                # Also catch ConnectTimeout
+                if attempt >= retries:
+                    raise
+                logging.debug(
+                    'Metric registration of %s failed, will retry: %s',
+                    payload['label'],
+                    exc,
+                )
+            except requests.exceptions.ReadTimeout as exc:
+                if attempt >= retries:
+                    raise
+                logging.debug(
+                    'Metric registration of %s timed out: %s',
+                    payload['label'],
+                    exc,
+                )
+                metric = self._find_registered_metric(bleemeo_api, payload)
+                if metric is not None:
+                    return metric
+            attempt += 1
+            time.sleep(min(0.5 * 2 ** attempt, 10) * random.uniform(0.5, 1))
+
+    def _find_registered_metric(self, bleemeo_api, payload):
+        """ Return the metric with label and item of payload if it's
+            registered on API, else None
+        """
+        api_metrics = bleemeo_api.api_iterator(
+            'v1/metric/',
+            params={
+                'agent': self.agent_uuid,
+                'label': payload['label'],
+                'item': payload.get('item', ''),
+                'fields': METRIC_REGISTRATION_FIELDS,
+            },
+        )
+        for data in api_metrics:
+            return _registered_metric(data)
+        return None
+
+    def _register_metric(self, bleemeo_api, payload):
+        metric_url = 'v1/metric/'
         response = bleemeo_api.api_call(
             metric_url,
             method='post',
             data=json.dumps(payload),
-            params={
-                'fields': 'id,label,labels,item,service,container'
-                          ',deactivated_at,'
-                          'threshold_low_warning,threshold_low_critical,'
-                          'threshold_high_warning,threshold_high_critical,'
-                          'unit,unit_text,agent,status_of,service,'
-                          'last_status,last_status_changed_at,'
-                          'problem_origins',
-            },
+            params={'fields': METRIC_REGISTRATION_FIELDS},
         )
         if 400 <= response.status_code < 500:
             logging.debug(
                 'Metric registration failed for %s. '
                 'Server reported a client error: %s',
-                reg_req.label,
+                payload['label'],
                 response.content,
             )
             raise ApiError(response)
         if response.status_code != 201:
             raise ApiError(response)
-        data = response.json()
+        return _registered_metric(response.json())
 
-        metric = _api_metric_to_internal(data)
-        if 'item' in metric.labels:
-            logging.debug(
-                'Metric %s (item %s) registered with uuid %s',
-                metric.label,
-                metric.labels['item'],
-                metric.uuid,
+    def _register_metrics_bulk(self, bleemeo_api, payloads):
+        """ Register multiple metrics with one request
+
+            Return the list of registered metrics, in the order of payloads,
+            or None if the bulk registration failed. In this case metrics
+            should be registered one by one.
+        """
+        metric_url = 'v1/metric/'
+        self._registration_limiter.acquire()
+        try:
+            response = bleemeo_api.api_call(
+                metric_url,
+                method='post',
+                data=json.dumps(payloads),
+                params={'fields': METRIC_REGISTRATION_FIELDS},
+            )
+        except requests.exceptions.RequestException as exc:
+            logging.debug('Bulk metric registration failed: %s', exc)
+            return None
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+
+        if response.status_code == 201 and isinstance(data, list):
+            return [_registered_metric(x) for x in data]
+
+        if 400 <= response.status_code < 500 and not isinstance(data, list):
+            # The API refused the list itself, not one of the metrics
+            logging.info(
+                'API does not support bulk metric registration (%s), '
+                'metrics will be registered one by one',
+                ApiError(response),
             )
+            self._api_support_bulk = False
         else:
             logging.debug(
-                'Metric %s registered with uuid %s',
-                metric.label,
-                metric.uuid,
+                'Bulk metric registration failed: %s', ApiError(response),
             )
-        return metric
+        return None
 
     def _sync_services(self, bleemeo_cache, bleemeo_api, full=True):
         # pylint: disable=too-many-locals
@@ -2373,7 +3465,7 @@ class BleemeoConnector(threading.Thread):
                 )
                 new_services[service.uuid] = service
             bleemeo_cache.services = new_services
-            bleemeo_cache.update_lookup_map()
+            bleemeo_cache.update_lookup_map('services')
         else:
             old_services = bleemeo_cache.services
 
@@ -2490,7 +3582,7 @@ class BleemeoConnector(threading.Thread):
                         bleemeo_cache.metrics[metric_key] = metric._replace(
                             deactivated_at=deactivated_at,
                         )
-        bleemeo_cache.update_lookup_map()
+        bleemeo_cache.update_lookup_map('services', 'metrics')
 
         # Step 4: delete object present in API by not in local
         try:
@@ -2531,7 +3623,7 @@ class BleemeoConnector(threading.Thread):
                     'Service %s deleted',
                     service.label,
                 )
-        bleemeo_cache.update_lookup_map()
+        bleemeo_cache.update_lookup_map('services')
 
     def _sync_containers(self, bleemeo_cache, bleemeo_api, full=True):
         # pylint: disable=too-many-branches
@@ -2542,31 +3634,49 @@ class BleemeoConnector(threading.Thread):
 
         # Step 1: refresh cache from API
         if full:
-            api_containers = bleemeo_api.api_iterator(
-                container_url,
-                params={
-                    'agent': self.agent_uuid,
-                    'fields': 'id,name,docker_id,docker_inspect'
-                },
-            )
-
+            # The docker_inspect stored on API is only changed by the agent,
+            # so the hash of containers already known is still valid. Only
+            # fetch (and parse) inspects if there are unknown containers.
             new_containers = {}
-            for data in api_containers:
-                docker_inspect = json.loads(data['docker_inspect'])
-                docker_inspect = sort_docker_inspect(docker_inspect)
-                name = docker_inspect['Name'].lstrip('/')
-                inspect_hash = hashlib.sha1(
-                    json.dumps(docker_inspect, sort_keys=True).encode('utf-8')
-                ).hexdigest()
-                container = Container(
-                    data['id'],
-                    name,
-                    data['docker_id'],
-                    inspect_hash,
-                )
+            all_known = True
+            for data in bleemeo_api.api_iterator(
+                    container_url,
+                    params={
+                        'agent': self.agent_uuid,
+                        'fields': 'id,docker_id',
+                    }):
+                container = bleemeo_cache.containers.get(data['id'])
+                if (container is None
+                        or container.docker_id != data['docker_id']):
+                    all_known = False
+                    break
                 new_containers[container.uuid] = container
+
+            if not all_known:
+                api_containers = bleemeo_api.api_iterator(
+                    container_url,
+                    params={
+                        'agent': self.agent_uuid,
+                        'fields': 'id,name,docker_id,docker_inspect'
+                    },
+                )
+
+                new_containers = {}
+                for data in api_containers:
+                    docker_inspect = json.loads(data['docker_inspect'])
+                    name = docker_inspect['Name'].lstrip('/')
+                    inspect_hash = bleemeo_agent.util.docker_inspect_hash(
+                        docker_inspect,
+                    )
+                    container = Container(
+                        data['id'],
+                        name,
+                        data['docker_id'],
+                        inspect_hash,
+                    )
+                    new_containers[container.uuid] = container
             bleemeo_cache.containers = new_containers
-            bleemeo_cache.update_lookup_map()
+            bleemeo_cache.update_lookup_map('containers')
 
         # Step 2: delete local object that are deleted from API
         # Not done for containers. API never delete a container
@@ -2577,17 +3687,19 @@ class BleemeoConnector(threading.Thread):
             local_containers = {}
 
         # Step 3: register/update object present in local but not in API
+        local_hashes = self.core.docker_containers_hash
         for docker_id, inspect in local_containers.items():
             name = inspect['Name'].lstrip('/')
-            inspect = sort_docker_inspect(copy.deepcopy(inspect))
-            new_hash = hashlib.sha1(
-                json.dumps(inspect, sort_keys=True).encode('utf-8')
-            ).hexdigest()
+            new_hash = local_hashes.get(docker_id)
+            if new_hash is None:
+                new_hash = bleemeo_agent.util.docker_inspect_hash(inspect)
             container = bleemeo_cache.containers_by_name.get(name)
 
             if container is not None and container.inspect_hash == new_hash:
                 continue
 
+            inspect = sort_docker_inspect(copy.deepcopy(inspect))
+
             if container is None:
                 method = 'post'
                 action_text = 'registered'
@@ -2643,7 +3755,7 @@ class BleemeoConnector(threading.Thread):
             )
             bleemeo_cache.containers[obj_uuid] = container
             logging.debug('Container %s %s', container.name, action_text)
-        bleemeo_cache.update_lookup_map()
+        bleemeo_cache.update_lookup_map('containers')
 
         # Step 4: delete object present in API by not in local
         try:
@@ -2689,7 +3801,7 @@ class BleemeoConnector(threading.Thread):
             bleemeo_cache.metrics = new_metrics
             if deleted_metrics:
                 self.core.purge_metrics(deleted_metrics)
-        bleemeo_cache.update_lookup_map()
+        bleemeo_cache.update_lookup_map('containers', 'metrics')
 
         with self._current_metrics_lock:
             self._current_metrics = {
@@ -2745,7 +3857,7 @@ class BleemeoConnector(threading.Thread):
             )
             facts[fact.uuid] = fact
         bleemeo_cache.facts = facts
-        bleemeo_cache.update_lookup_map()
+        bleemeo_cache.update_lookup_map('facts')
 
     def _sync_facts(self, bleemeo_cache, bleemeo_api):
         # pylint: disable=too-many-locals
@@ -2838,36 +3950,18 @@ class BleemeoConnector(threading.Thread):
                 fact.uuid,
             )
 
-    def _unregistered_metric_queue_cleanup(self, push_to_metric_queue=False):
-        """ Process metrics that are waiting in _unregistered_metric_queue
+    def _unregistered_points_cleanup(self):
+        """ Process metrics that are waiting in _unregistered_points
 
-            * Any now regirested metrics are moved back to _metric_queue
-            * Metrics points too old are droped
+            * Any now registered metrics are moved back to _metric_queue
+            * Metrics points too old or of removed metrics are dropped
         """
-        try:
-            repush_metric_points = []
-            for _ in range(self._unregistered_metric_queue.qsize()):
-                metric_point = self._unregistered_metric_queue.get(timeout=0.3)
-                item = metric_point.labels.get('item', '')
-                short_item = item[:API_METRIC_ITEM_LENGTH]
-                if metric_point.service_instance:
-                    short_item = short_item[:API_SERVICE_INSTANCE_LENGTH]
-                key = (metric_point.label, short_item)
-                metric = self._bleemeo_cache.metrics_by_labelitem.get(key)
-
-                if metric is not None and push_to_metric_queue:
+        metrics_by_labelitem = self._bleemeo_cache.metrics_by_labelitem
+        for key in self._unregistered_points.keys():
+            if key in metrics_by_labelitem:
+                for metric_point in self._unregistered_points.pop(key):
                     self._metric_queue.put(metric_point)
-                elif (key in self._current_metrics
-                      and time.time() - metric_point.time < 7200):
-                    repush_metric_points.append(metric_point)
-        except queue.Empty:
-            pass
-
-        if len(repush_metric_points) > 90000:
-            repush_metric_points.sort(key=lambda x: x.time)
-            repush_metric_points = repush_metric_points[-90000:]
-        for point in repush_metric_points:
-            self._unregistered_metric_queue.put(point)
+        self._unregistered_points.expire(self._current_metrics)
 
     def _sync_check_duplicated(
             self, bleemeo_cache, bleemeo_api, last_duplicated_events):
@@ -39,6 +39,9 @@ import bleemeo_agent.util
 # information
 STATUS_CHECK_NOT_RUN = -1
 
+# The first run of a check is delayed by up to CHECK_JITTER seconds
+CHECK_JITTER = 10
+
 
 CHECKS_INFO = {
     'mysql': {
@@ -226,10 +229,13 @@ class Check:
 
         self.tcp_sockets = self._initialize_tcp_sockets()
 
+        # jitter spreads the checks of services discovered at the same time
         self.current_job = self.core.add_scheduled_job(
             self.run_check,
             seconds=60,
             next_run_in=0,
+            jitter=CHECK_JITTER,
+            job_class='check',
         )
 
     def _initialize_tcp_sockets(self):
@@ -339,6 +345,7 @@ class Check:
                     self.open_sockets,
                     seconds=0,
                     next_run_in=0,
+                    job_class='check',
                 )
 
     def run_check(self):
@@ -441,6 +448,7 @@ class Check:
                         self.run_check,
                         seconds=0,
                         next_run_in=10,
+                        job_class='check',
                     )
                 return
         if self.instance:
@@ -488,6 +496,7 @@ class Check:
                         self.run_check,
                         seconds=0,
                         next_run_in=30,
+                        job_class='check',
                     )
 
         if return_code == bleemeo_agent.type.STATUS_OK and self.tcp_sockets:
@@ -501,6 +510,7 @@ class Check:
                     self.open_sockets,
                     seconds=0,
                     next_run_in=5,
+                    job_class='check',
                 )
 
         self._last_status = return_code
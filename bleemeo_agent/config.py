@@ -88,10 +88,23 @@ CONFIG_VARS = [
         '/etc/ssl/certs/ca-certificates.crt'
     ),
     ('bleemeo.mqtt.ssl_insecure', 'bool', False),
+    ('bleemeo.mqtt.data_encoding', 'string', 'json'),
+    ('bleemeo.mqtt.data_max_size', 'int', 256 * 1024),
+    ('bleemeo.spool.enabled', 'bool', True),
+    ('bleemeo.spool.directory', 'string', None),
+    ('bleemeo.spool.max_size', 'int', 50 * 1024 * 1024),
+    ('bleemeo.spool.drain_rate', 'int', 1000),
+    ('bleemeo.metric_registration.workers', 'int', 4),
+    ('bleemeo.metric_registration.rate_limit', 'int', 20),
+    ('bleemeo.metric_registration.retries', 'int', 3),
+    ('bleemeo.metric_registration.bulk', 'bool', False),
+    ('bleemeo.metric_registration.bulk_size', 'int', 100),
     ('bleemeo.sentry.dsn', 'string', None),
     ('graphite.metrics_source', 'string', 'telegraf'),
     ('graphite.listener.address', 'string', '127.0.0.1'),
     ('graphite.listener.port', 'int', 2003),
+    ('graphite.listener.mode', 'string', 'selector'),
+    ('graphite.listener.read_size', 'int', 64 * 1024),
     ('telegraf.statsd.enabled', 'bool', True),
     ('telegraf.statsd.address', 'string', '127.0.0.1'),
     ('telegraf.statsd.port', 'int', 8125),
@@ -37,14 +37,6 @@ import sys
 import threading
 import time
 
-try:
-    import apscheduler.scheduler
-    APSCHEDULE_IS_3X = False
-except ImportError:
-    import apscheduler.schedulers.background
-    from apscheduler.jobstores.base import JobLookupError
-    APSCHEDULE_IS_3X = True
-
 import psutil
 import requests
 import six
@@ -56,6 +48,7 @@ import bleemeo_agent.checker
 import bleemeo_agent.config
 import bleemeo_agent.facts
 import bleemeo_agent.graphite
+import bleemeo_agent.scheduler
 import bleemeo_agent.services
 import bleemeo_agent.type
 import bleemeo_agent.util
@@ -361,10 +354,7 @@ loggers:
     requests: {level: WARNING}
     urllib3: {level: WARNING}
     werkzeug: {level: WARNING}
-    apscheduler: {level: WARNING}
     kubernetes.client.rest: {level: INFO}
-    apscheduler.executors: {level: ERROR}
-    apscheduler.scheduler: {level: ERROR}
 root:
     # Level and handlers will be updated at runtime
     level: INFO
@@ -842,6 +832,92 @@ def _check_soft_status(softstatus_state, metric, soft_status, period, now):
     )
 
 
+class CompiledThreshold:
+    """ Threshold definition of one (label, item), ready to be checked
+
+        It holds the threshold bounds, the soft-status period and the
+        unit used to format the problem text. The part of the problem text
+        describing the crossed threshold is kept and only formatted again
+        when the status or the crossed threshold change.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = (
+        'low_critical', 'low_warning', 'high_critical', 'high_warning',
+        'period', 'unit', 'unit_text',
+        '_suffix', '_suffix_key',
+    )
+
+    def __init__(self, threshold, period, unit, unit_text):
+        # pylint: disable=too-many-arguments
+        self.low_critical = threshold.get('low_critical')
+        self.low_warning = threshold.get('low_warning')
+        self.high_critical = threshold.get('high_critical')
+        self.high_warning = threshold.get('high_warning')
+        self.period = period
+        self.unit = unit
+        self.unit_text = unit_text
+        self._suffix = None
+        self._suffix_key = None
+
+    def soft_status(self, value):
+        """ Return the instant status of value: ok, warning or critical
+        """
+        if self.low_critical is not None and value < self.low_critical:
+            return 'critical'
+        if self.low_warning is not None and value < self.low_warning:
+            return 'warning'
+        if self.high_critical is not None and value > self.high_critical:
+            return 'critical'
+        if self.high_warning is not None and value > self.high_warning:
+            return 'warning'
+        return 'ok'
+
+    def threshold_value(self, value, status):
+        """ Return the threshold crossed by value for given status
+        """
+        if status == 'warning':
+            if self.low_warning is not None and value < self.low_warning:
+                return self.low_warning
+            return self.high_warning
+        if status == 'critical':
+            if self.low_critical is not None and value < self.low_critical:
+                return self.low_critical
+            return self.high_critical
+        return None
+
+    def problem_text(self, value, status):
+        """ Return the problem text for value, reusing the previous
+            threshold description if the crossed threshold didn't change
+        """
+        threshold = self.threshold_value(value, status)
+        key = (status, threshold)
+        if self._suffix is None or self._suffix_key != key:
+            if status == 'ok':
+                suffix = ''
+            else:
+                threshold_text = format_value(
+                    threshold, self.unit, self.unit_text,
+                )
+                if self.period:
+                    suffix = (
+                        ' threshold (%s) exceeded'
+                        ' over last %s' % (
+                            threshold_text,
+                            format_duration(self.period),
+                        )
+                    )
+                else:
+                    suffix = ' threshold (%s) exceeded' % threshold_text
+            self._suffix = suffix
+            self._suffix_key = key
+
+        return 'Current value: %s%s' % (
+            format_value(value, self.unit, self.unit_text),
+            self._suffix,
+        )
+
+
 def _service_ignore(rules, service_name, instance):
     """ Return True if the service should be ignored
     """
@@ -891,62 +967,366 @@ def _service_ignore(rules, service_name, instance):
     return False
 
 
+def _index_state(text):
+    """ Return a dict key => JSON text of the value from a state file
+        written with one key per line.
+
+        Return None if the file doesn't use this layout.
+    """
+    lines = text.split('\n')
+    if lines[0] != '{' or lines[-2:] != ['}', '']:
+        return None
+
+    decoder = json.JSONDecoder()
+    raw = {}
+    for line in lines[1:-2]:
+        try:
+            (key, end) = decoder.raw_decode(line)
+        except ValueError:
+            return None
+        if not isinstance(key, str) or line[end:end + 2] != ': ':
+            return None
+        raw[key] = line[end + 2:].rstrip(',')
+    return raw
+
+
 class State:
     """ Persistant store for state of the agent.
 
-        Currently store in a json file
+        The state is stored in a JSON file. Changes done by set and delete
+        are appended to a journal (the JSON file name followed by
+        ".journal") by a background thread. Successive changes of a key
+        are coalesced in one write.
+
+        When the journal grows larger than the JSON file, or when the
+        state is closed, it's merged into the JSON file (compaction).
+        The JSON file records the generation of the journal that applies
+        to it, so an outdated journal is ignored.
+
+        The JSON file is written with one key per line. This allows to
+        decode each key on its first access rather than the whole file at
+        startup. Keys never accessed are written back without decoding
+        them. A file written on a single line (by older versions) is
+        still supported.
     """
+    # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, filename):
+    def __init__(self, filename, coalesce_delay=1):
         self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.coalesce_delay = coalesce_delay
         self._content = {}
+        # key => JSON text of keys not yet decoded
+        self._raw = {}
         self._write_lock = threading.RLock()
+        self._write_cond = threading.Condition(self._write_lock)
+        # Only one thread write files at a time
+        self._file_lock = threading.Lock()
+        self._generation = 0
+        self._file_size = 0
+        self._journal_size = 0
+        self._compaction_needed = False
+        # Keys changed but not yet written
+        self._dirty = set()
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+        self._writer = None
         self.reload()
 
     def reload(self):
+        self.flush()
         with self._write_lock:
+            self._content = {}
+            self._raw = {}
+            self._file_size = 0
             if os.path.exists(self.filename):
                 with open(self.filename) as state_file:
-                    self._content = json.load(state_file)
+                    text = state_file.read()
+                self._raw = _index_state(text)
+                if self._raw is None:
+                    self._raw = {}
+                    self._content = json.loads(text)
+                self._file_size = len(text)
+            self._decode('_journal_generation')
+            self._generation = self._content.pop('_journal_generation', 0)
+            self._load_journal()
+
+    def _load_journal(self):
+        """ Apply changes from the journal to _content
+        """
+        self._journal_size = 0
+        try:
+            with open(self.journal_filename) as journal_file:
+                lines = journal_file.readlines()
+        except (OSError, IOError):
+            return
+
+        self._journal_size = sum(len(line) for line in lines)
+        # Even if the journal is ignored or corrupted, write a new one
+        self._compaction_needed = True
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        if header.get('generation') != self._generation:
+            return
+
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line partially written before a crash
+                logging.debug('State journal is truncated')
+                break
+            self._raw.pop(entry['key'], None)
+            if entry.get('deleted'):
+                self._content.pop(entry['key'], None)
             else:
-                self._content = {}
+                self._content[entry['key']] = entry['value']
 
     def save(self):
+        """ Write the whole state to the JSON file now
+
+            Return False if the file could not be written
+        """
         with self._write_lock:
+            content = dict(self._content)
+            raw = dict(self._raw)
+            self._dirty = set()
+            generation = self._generation + 1
+        return self._write_state_file(content, raw, generation)
+
+    def _write_state_file(self, content, raw, generation):
+        # _write_lock is only taken once _file_lock is released. Holding
+        # both locks at once could deadlock with another thread.
+        content['_journal_generation'] = generation
+        compaction_needed = False
+        with self._file_lock:
             try:
+                lines = [
+                    json.dumps(key) + ': ' + text
+                    for (key, text) in raw.items()
+                ]
+                lines.extend(
+                    json.dumps(key) + ': ' + json.dumps(
+                        value, cls=bleemeo_agent.util.JSONEncoder,
+                    )
+                    for (key, value) in content.items()
+                )
                 # Don't simply use open. This file must have limited permission
                 open_flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
                 fileno = os.open(self.filename + '.tmp', open_flags, 0o600)
                 with os.fdopen(fileno, 'w') as state_file:
-                    json.dump(
-                        self._content,
-                        state_file,
-                        cls=bleemeo_agent.util.JSONEncoder,
-                    )
+                    state_file.write('{\n' + ',\n'.join(lines) + '\n}\n')
                     state_file.flush()
                     os.fsync(state_file.fileno())
+                    file_size = state_file.tell()
                 if os.name == 'nt':
                     try:
                         os.remove(self.filename)
                     except OSError:
                         pass
                 os.rename(self.filename + '.tmp', self.filename)
-                return True
+                try:
+                    os.remove(self.journal_filename)
+                except OSError:
+                    pass
             except OSError as exc:
                 logging.warning('Failed to store file: %s', exc)
+            except RuntimeError as exc:
+                # A value was modified while being encoded, retry later
+                logging.debug('Failed to encode state: %s', exc)
+                compaction_needed = True
+            except (ValueError, TypeError) as exc:
+                logging.warning('Failed to encode state: %s', exc)
                 return False
+            else:
+                self._generation = generation
+                self._file_size = file_size
+                self._journal_size = 0
+                self._compaction_needed = False
+                return True
+
+        with self._write_lock:
+            # Changes will be written on next save
+            self._dirty.update(content)
+            self._dirty.discard('_journal_generation')
+            if compaction_needed:
+                self._compaction_needed = True
+        return False
+
+    def _write_journal(self, entries):
+        """ Append entries (list of (key, deleted, value)) to the journal
+        """
+        lines = []
+        for (key, deleted, value) in entries:
+            try:
+                if deleted:
+                    entry = {'key': key, 'deleted': True}
+                else:
+                    entry = {'key': key, 'value': value}
+                lines.append(
+                    json.dumps(entry, cls=bleemeo_agent.util.JSONEncoder)
+                )
+            except RuntimeError as exc:
+                # The value was modified while being encoded, retry later
+                logging.debug('Failed to encode state key %s: %s', key, exc)
+                with self._write_lock:
+                    self._dirty.add(key)
+            except (ValueError, TypeError) as exc:
+                logging.warning('Failed to encode state key %s: %s', key, exc)
+
+        if not lines:
+            return
+        data = ''.join(line + '\n' for line in lines)
+
+        failed = False
+        with self._file_lock:
+            try:
+                open_flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+                fileno = os.open(self.journal_filename, open_flags, 0o600)
+                with os.fdopen(fileno, 'a') as journal_file:
+                    if journal_file.tell() == 0:
+                        data = json.dumps(
+                            {'generation': self._generation}
+                        ) + '\n' + data
+                    journal_file.write(data)
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+                self._journal_size += len(data)
+            except OSError as exc:
+                logging.warning('Failed to store file: %s', exc)
+                failed = True
+
+        if failed:
+            with self._write_lock:
+                self._dirty.update(key for (key, _, _) in entries)
+
+    def _writer_loop(self):
+        while True:
+            with self._write_lock:
+                while not self._dirty and not self._closed:
+                    self._write_cond.wait()
+                if not self._dirty:
+                    return
+
+                # Wait a bit, to write successive changes at once
+                deadline = bleemeo_agent.util.get_clock() + self.coalesce_delay
+                while not self._closed and not self._flush_requested:
+                    remaining = deadline - bleemeo_agent.util.get_clock()
+                    if remaining <= 0:
+                        break
+                    self._write_cond.wait(remaining)
+                self._flush_requested = False
+
+                self._writing = True
+                compaction = (
+                    self._compaction_needed
+                    or self._journal_size > max(self._file_size, 64 * 1024)
+                )
+                if compaction:
+                    content = dict(self._content)
+                    raw = dict(self._raw)
+                    generation = self._generation + 1
+                    entries = None
+                else:
+                    entries = [
+                        (key, key not in self._content, self._content.get(key))
+                        for key in self._dirty
+                    ]
+                self._dirty = set()
+
+            try:
+                if compaction:
+                    self._write_state_file(content, raw, generation)
+                else:
+                    self._write_journal(entries)
+            finally:
+                with self._write_lock:
+                    self._writing = False
+                    self._write_cond.notify_all()
+
+    def _mark_dirty(self, key):
+        """ Schedule the write of key. Must be called with _write_lock held
+
+            Return True if the state is closed. The caller must then call
+            save() once _write_lock is released.
+        """
+        self._dirty.add(key)
+        if self._closed:
+            return True
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._writer_loop, name='state-writer',
+            )
+            self._writer.daemon = True
+            self._writer.start()
+        self._write_cond.notify_all()
+        return False
+
+    def flush(self, timeout=None):
+        """ Wait until all changes are written to disk
+        """
+        with self._write_lock:
+            if self._writer is None or not self._writer.is_alive():
+                return
+            self._flush_requested = True
+            self._write_cond.notify_all()
+            self._write_cond.wait_for(
+                lambda: not self._dirty and not self._writing,
+                timeout,
+            )
+
+    def close(self):
+        """ Write pending changes, merge the journal and stop the background
+            writer
+        """
+        with self._write_lock:
+            self._closed = True
+            self._write_cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        self.save()
+
+    def _decode(self, key):
+        """ Decode the value of key, if not yet done
+        """
+        with self._write_lock:
+            text = self._raw.pop(key, None)
+            if text is None:
+                return
+            try:
+                self._content[key] = json.loads(text)
+            except ValueError as exc:
+                logging.warning(
+                    'Ignoring invalid value for %s in state file: %s',
+                    key,
+                    exc,
+                )
 
     def get(self, key, default=None):
+        if key in self._raw:
+            self._decode(key)
         return self._content.get(key, default)
 
     def set(self, key, value):
+        """ Set a value. It's written to disk in background, so value must
+            not be modified once given to set.
+        """
         with self._write_lock:
+            self._raw.pop(key, None)
             self._content[key] = value
+            closed = self._mark_dirty(key)
+        if closed:
             self.save()
 
     def delete(self, key):
         with self._write_lock:
-            del self._content[key]
+            if self._raw.pop(key, None) is None:
+                del self._content[key]
+            closed = self._mark_dirty(key)
+        if closed:
             self.save()
 
     def set_complex_dict(self, key, value):
@@ -1019,6 +1399,155 @@ class Cache:
         self._state.set('_core_cache', cache)
 
 
+class _LastMetricShard:
+    """ Part of a LastMetricStore, with its own lock
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (label, item) => metric_point
+        self.points = {}
+        # label => {(label, item) => metric_point}
+        self.by_label = {}
+        # keys of points with a status (status_code set and not a *_status
+        # metric)
+        self.status_keys = set()
+        # bucket of time => set of keys whose last point is in that bucket
+        self.buckets = {}
+
+
+class LastMetricStore:
+    """ Store the last point of each metric, keyed by (label, item)
+
+        It's written by all Graphite clients. Keys are split in shards with
+        their own lock, so writers rarely wait for each other.
+
+        Points are also indexed by label and points with a status are
+        tracked, so readers (like the local web UI) don't need to scan all
+        points.
+
+        Points are grouped in buckets of BUCKET_SECONDS by their time, so
+        expiring old points only look at points from old buckets.
+    """
+    SHARD_COUNT = 16
+    BUCKET_SECONDS = 60
+
+    def __init__(self):
+        self._shards = [
+            _LastMetricShard() for _ in range(self.SHARD_COUNT)
+        ]
+
+    def _get_shard(self, key):
+        return self._shards[hash(key) % self.SHARD_COUNT]
+
+    def set(self, metric_point):
+        """ Store metric_point, replacing the previous point of the metric
+        """
+        key = (metric_point.label, metric_point.labels.get('item', ''))
+        bucket = int(metric_point.time // self.BUCKET_SECONDS)
+        shard = self._get_shard(key)
+        with shard.lock:
+            old_point = shard.points.get(key)
+            shard.points[key] = metric_point
+            if old_point is None:
+                shard.by_label.setdefault(key[0], {})[key] = metric_point
+                old_bucket = None
+            else:
+                shard.by_label[key[0]][key] = metric_point
+                old_bucket = int(old_point.time // self.BUCKET_SECONDS)
+
+            if old_bucket != bucket:
+                if old_bucket is not None:
+                    old_keys = shard.buckets[old_bucket]
+                    old_keys.discard(key)
+                    if not old_keys:
+                        del shard.buckets[old_bucket]
+                shard.buckets.setdefault(bucket, set()).add(key)
+
+            if (metric_point.status_code is not None
+                    and metric_point.status_of == ''):
+                shard.status_keys.add(key)
+            elif old_point is not None:
+                shard.status_keys.discard(key)
+
+    def get(self, key, default=None):
+        """ Return the last point for key (label, item)
+        """
+        return self._get_shard(key).points.get(key, default)
+
+    def values(self):
+        """ Return a list of all last points
+        """
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(shard.points.values())
+        return result
+
+    def get_by_label(self, label):
+        """ Return a list of last points of all items of given metric label
+        """
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(shard.by_label.get(label, {}).values())
+        return result
+
+    def get_with_status(self):
+        """ Return a list of last points which have a status
+        """
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(shard.points[key] for key in shard.status_keys)
+        return result
+
+    def __len__(self):
+        return sum(len(shard.points) for shard in self._shards)
+
+    def _delete(self, shard, key):
+        """ Remove key from shard. shard.lock must be held
+        """
+        metric_point = shard.points.pop(key, None)
+        if metric_point is None:
+            return
+        by_label = shard.by_label[key[0]]
+        del by_label[key]
+        if not by_label:
+            del shard.by_label[key[0]]
+        shard.status_keys.discard(key)
+        bucket = int(metric_point.time // self.BUCKET_SECONDS)
+        shard.buckets[bucket].discard(key)
+        if not shard.buckets[bucket]:
+            del shard.buckets[bucket]
+
+    def purge(self, cutoff, deleted_metrics=None):
+        """ Remove points older than cutoff and points of deleted_metrics, a
+            list of (label, item)
+        """
+        if deleted_metrics:
+            for key in deleted_metrics:
+                key = tuple(key)
+                shard = self._get_shard(key)
+                with shard.lock:
+                    self._delete(shard, key)
+
+        cutoff_bucket = int(cutoff // self.BUCKET_SECONDS)
+        for shard in self._shards:
+            with shard.lock:
+                old_buckets = [
+                    bucket for bucket in shard.buckets
+                    if bucket <= cutoff_bucket
+                ]
+                for bucket in old_buckets:
+                    for key in list(shard.buckets.get(bucket, ())):
+                        if shard.points[key].time < cutoff:
+                            self._delete(shard, key)
+                    if not shard.buckets.get(bucket, True):
+                        del shard.buckets[bucket]
+
+
 class Core:
     # pylint: disable=too-many-instance-attributes
     # pylint: disable=too-many-public-methods
@@ -1043,17 +1572,12 @@ class Core:
         self.k8s_docker_to_pods = {}
         self.docker_containers = {}
         self.docker_containers_by_name = {}
+        # docker_id => docker_inspect_hash of docker_containers[docker_id]
+        self.docker_containers_hash = {}
         self.docker_containers_ignored = {}
         self.docker_networks = {}
-        if APSCHEDULE_IS_3X:
-            self._scheduler = (
-                apscheduler.schedulers.background.BackgroundScheduler(
-                    timezone='UTC',
-                )
-            )
-        else:
-            self._scheduler = apscheduler.scheduler.Scheduler()  # noqa pylint: disable=no-member
-        self.last_metrics = {}
+        self._scheduler = bleemeo_agent.scheduler.Scheduler()
+        self.last_metrics = LastMetricStore()
         self.last_report = None
 
         self._discovery_job = None  # scheduled in schedule_tasks
@@ -1062,7 +1586,8 @@ class Core:
         self.metric_resolution = 10
         self.discovered_services = {}
         self.services = {}
-        self.metrics_unit = {}
+        self._compiled_thresholds = {}
+        self._metrics_unit = {}
         self._trigger_condition = threading.Condition()
         self._trigger_discovery = False
         self._trigger_facts = False
@@ -1078,7 +1603,7 @@ class Core:
         self.started_at = None
         self.state = None
         self.cache = None
-        self.thresholds = {}
+        self._thresholds = {}
         self._update_facts_job = None
         self._gather_update_metrics_job = None
         self._gather_metrics_job = None
@@ -1232,8 +1757,6 @@ class Core:
         self.metric_resolution = metric_resolution
         if self._topinfo_job is not None:
             # Don't schedule the topinfo job before schedule_tasks()
-            # This is needed because APscheduler 2.x does not allow to
-            # unschedule a job while the scheduler it not yet started.
             self.schedule_topinfo()
         if self._init_completed:
             self.graphite_server.update_discovery()
@@ -1306,126 +1829,81 @@ class Core:
             # https://github.com/getsentry/raven-python/pull/723
             install_thread_hook(self.sentry_client)
 
-    def add_scheduled_job(self, func, seconds, args=None, next_run_in=None):
-        # pylint: disable=too-many-branches
-        """ Schedule a recuring job using APScheduler
-
-            It's a wrapper to add_job/add_interval_job+add_date_job depending
-            on APScheduler version.
+    def add_scheduled_job(self, func, seconds, args=None, next_run_in=None,
+                          jitter=0, job_class='default'):
+        # pylint: disable=too-many-arguments
+        """ Schedule a recuring job
 
             if seconds is 0 or None, job will run only once based on
             next_run_in. In this case next_run_in could not be None
 
             next_run_in if not None, specify a delay for next run (in second).
-            If None, it lets APScheduler choose the next run date.
+            If None, the first run is one interval from now. If next_run_in
+            is 0, the next run is scheduled as soon as possible.
 
-            If next_run_in is 0, the next_run is scheduled as soon as possible.
-            With APScheduler 3.x it means that next run is scheduled for now.
-            With APScheduler 2.x, it means that next run is scheduled for
-            now + 1 seconds.
-        """
-        options = {}
-        if args is not None:
-            options['args'] = args
-
-        if APSCHEDULE_IS_3X:
-            if seconds is None or seconds == 0:
-                if next_run_in is None:
-                    raise ValueError(
-                        'next_run_in could not be None if seconds is 0'
-                    )
-                options['trigger'] = 'date'
-                options['run_date'] = (
-                    datetime.datetime.utcnow() +
-                    datetime.timedelta(seconds=next_run_in)
-                )
-            else:
-                options['trigger'] = 'interval'
-                options['seconds'] = seconds
-
-                if next_run_in is not None and next_run_in == 0:
-                    options['next_run_time'] = datetime.datetime.utcnow()
-                elif next_run_in is not None:
-                    options['next_run_time'] = (
-                        datetime.datetime.utcnow() +
-                        datetime.timedelta(seconds=next_run_in)
-                    )
+            The first run is delayed by a random delay up to jitter seconds.
 
-            job = self._scheduler.add_job(
-                func,
-                **options
-            )
-        else:
-            if next_run_in is not None and next_run_in < 1.0:
-                next_run_in = 1
-            if seconds is None or seconds == 0:
-                if next_run_in is None:
-                    raise ValueError(
-                        'next_run_in could not be None if seconds is 0'
-                    )
-                options['date'] = (
-                    datetime.datetime.now() +
-                    datetime.timedelta(seconds=next_run_in)
-                )
-
-                job = self._scheduler.add_date_job(
-                    func,
-                    **options
-                )
-            else:
-                if next_run_in is not None:
-                    options['start_date'] = (
-                        datetime.datetime.now() +
-                        datetime.timedelta(seconds=next_run_in)
-                    )
-
-                job = self._scheduler.add_interval_job(
-                    func,
-                    seconds=seconds,
-                    **options
-                )
-
-        return job
+            job_class select the pool of workers which run the job, see
+            bleemeo_agent.scheduler.DEFAULT_WORKERS.
+        """
+        return self._scheduler.add_job(
+            func,
+            interval=seconds,
+            args=args,
+            next_run_in=next_run_in,
+            jitter=jitter,
+            job_class=job_class,
+        )
 
     def trigger_job(self, job):
         """ Trigger a job to run immediately
 
-            In APScheduler 2.x it will trigger the job in 1 seconds.
-
-            In APScheduler 2.x, it will recreate a NEW job. For all version it
-            will return the job that is still valid. Caller must use the
+            Return the job, which is still valid. Caller could use the
             returned job e.g.::
 
             >>> self.the_job = self.trigger_job(self.the_job)  # doctest: +SKIP
         """
-        if APSCHEDULE_IS_3X:
-            job.modify(next_run_time=datetime.datetime.utcnow())
-        else:
-            self._scheduler.unschedule_job(job)
-            job = self._scheduler.add_interval_job(
-                job.func,
-                args=job.args,
-                seconds=job.trigger.interval.total_seconds(),
-                start_date=(
-                    datetime.datetime.now() + datetime.timedelta(seconds=1)
-                )
-            )
+        self._scheduler.trigger(job)
         return job
 
     def unschedule_job(self, job):
         """ Unschedule and remove a job
         """
-        if APSCHEDULE_IS_3X:
-            if job:
-                try:
-                    job.remove()
-                except JobLookupError:
-                    pass
-        else:
-            try:
-                self._scheduler.unschedule_job(job)
-            except KeyError:
-                pass
+        self._scheduler.unschedule(job)
+
+    def get_scheduler_stats(self):
+        """ Return execution statistics of scheduled jobs, by job name
+
+            See bleemeo_agent.scheduler.Scheduler.stats
+        """
+        return self._scheduler.stats()
+
+    def _get_scheduler_metrics(self, timestamp):
+        """ Return points about jobs run since the previous call: number of
+            runs, skipped runs and errors, average and maximum duration and
+            maximum lateness. The job name is the item.
+        """
+        points = []
+        for (name, stats) in self._scheduler.pop_stats().items():
+            values = [
+                ('agent_job_runs', stats['runs']),
+                ('agent_job_skipped_runs', stats['skipped']),
+                ('agent_job_errors', stats['errors']),
+                ('agent_job_duration_avg', stats['avg_duration']),
+                ('agent_job_duration_max', stats['max_duration']),
+                ('agent_job_lateness_max', stats['max_lateness']),
+            ]
+            points.extend(
+                bleemeo_agent.type.MetricPoint(
+                    label=label,
+                    labels={'item': name},
+                    time=timestamp,
+                    value=float(value),
+                )
+                for (label, value) in values
+                if value is not None
+            )
+        return points
 
     def update_thresholds(self, state_threshold):
         """ Update threshold definition
@@ -1529,6 +2007,7 @@ class Core:
                 if self.influx_connector is not None:
                     self.influx_connector.join()
             self.cache.save()
+            self.state.close()
 
     def setup_signal(self):
         """ Make kill (SIGKILL) send a KeyboardInterrupt
@@ -1635,6 +2114,7 @@ class Core:
         # pylint: disable=too-many-locals
         docker_containers = {}
         docker_containers_by_name = {}
+        docker_containers_hash = {}
         docker_networks = {}
         docker_containers_ignored = {}
 
@@ -1670,6 +2150,15 @@ class Core:
             name = inspect['Name'].lstrip('/')
             docker_containers[docker_id] = inspect
             docker_containers_by_name[name] = inspect
+            if (docker_id in self.docker_containers_hash
+                    and self.docker_containers.get(docker_id) == inspect):
+                docker_containers_hash[docker_id] = (
+                    self.docker_containers_hash[docker_id]
+                )
+            else:
+                docker_containers_hash[docker_id] = (
+                    bleemeo_agent.util.docker_inspect_hash(inspect)
+                )
 
         if (hasattr(docker_client, 'networks') and
                 hasattr(docker_client, 'inspect_network')):
@@ -1693,6 +2182,7 @@ class Core:
 
         self.docker_containers = docker_containers
         self.docker_containers_by_name = docker_containers_by_name
+        self.docker_containers_hash = docker_containers_hash
         self.docker_networks = docker_networks
         self.docker_containers_ignored = docker_containers_ignored
 
@@ -1843,7 +2333,7 @@ class Core:
 
         if self.graphite_server.metrics_source != 'telegraf':
             self.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='uptime',
                     time=now,
                     value=uptime_seconds,
@@ -1852,16 +2342,22 @@ class Core:
 
         if self.bleemeo_connector and self.bleemeo_connector.connected:
             self.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='agent_status',
                     time=now,
                     value=0.0,  # status ok
                 )
             )
+        if self.bleemeo_connector:
+            for metric_point in self.bleemeo_connector.get_internal_metrics(
+                    now):
+                self.emit_metric(metric_point)
+        for metric_point in self._get_scheduler_metrics(now):
+            self.emit_metric(metric_point)
 
         if os.name == 'nt':
             self.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='mem_total',
                     time=now,
                     value=float(self.total_memory_size),
@@ -1870,7 +2366,7 @@ class Core:
             if self.last_facts.get('swap_present', False):
                 self.total_swap_size = psutil.swap_memory().total
                 self.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                    bleemeo_agent.type.MetricPoint(
                         label='swap_total',
                         time=now,
                         value=float(self.total_swap_size),
@@ -1918,7 +2414,7 @@ class Core:
         )
         if pending_update is not None:
             self.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='system_pending_updates',
                     time=now,
                     value=float(pending_update),
@@ -1926,7 +2422,7 @@ class Core:
             )
         if pending_security_update is not None:
             self.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='system_pending_security_updates',
                     time=now,
                     value=float(pending_security_update),
@@ -1944,6 +2440,11 @@ class Core:
             return  # most probably container was removed
 
         name = result['Name'].lstrip('/')
+        if (container_id not in self.docker_containers_hash
+                or self.docker_containers.get(container_id) != result):
+            self.docker_containers_hash[container_id] = (
+                bleemeo_agent.util.docker_inspect_hash(result)
+            )
         self.docker_containers[container_id] = result
         self.docker_containers_by_name[name] = result
         if 'Health' not in result['State']:
@@ -1990,7 +2491,7 @@ class Core:
             if problem_origin is None:
                 problem_origin = ''
 
-        metric_point = bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+        metric_point = bleemeo_agent.type.MetricPoint(
             label='docker_container_health_status',
             labels={
                 'item': name,
@@ -2018,15 +2519,7 @@ class Core:
         now = time.time()
         cutoff = now - 60 * 6
 
-        if deleted_metrics is None:
-            deleted_metrics = []
-
-        # XXX: concurrent access with emit_metric.
-        self.last_metrics = {
-            key: metric_point
-            for (key, metric_point) in self.last_metrics.items()
-            if metric_point.time >= cutoff and key not in deleted_metrics
-        }
+        self.last_metrics.purge(cutoff, deleted_metrics)
 
     def fire_triggers(
             self, updates_count=False, discovery=False, facts=False,
@@ -2678,6 +3171,9 @@ class Core:
         """ Update facts """
         self.last_facts = bleemeo_agent.facts.get_facts(self)
         self.last_facts_update = bleemeo_agent.util.get_clock()
+        if self.graphite_server is not None:
+            # Telegraf decoding depends on facts (e.g. swap_present)
+            self.graphite_server.invalidate_decode_cache()
 
     def send_top_info(self):
         self.top_info = bleemeo_agent.util.get_top_info(self)
@@ -2690,6 +3186,8 @@ class Core:
         (self.config, errors, warnings) = (
             bleemeo_agent.config.load_config_with_default()
         )
+        # softstatus period are read from configuration
+        self._compiled_thresholds = {}
         metric_prometheus = self.config['metric.prometheus']
         for name in list(metric_prometheus):
             if 'url' not in metric_prometheus[name]:
@@ -2766,9 +3264,7 @@ class Core:
     def _store_last_value(self, metric_point):
         """ Store the metric in self.last_matrics, replacing the previous value
         """
-        item = metric_point.labels.get('item', '')
-        measurement = metric_point.label
-        self.last_metrics[(measurement, item)] = metric_point
+        self.last_metrics.set(metric_point)
 
     def emit_metric(self, metric_point, no_emit=False):
         """ Sent a metric to all configured output
@@ -2792,6 +3288,51 @@ class Core:
     def registration_at(self):
         return self.bleemeo_connector.registration_at
 
+    @property
+    def thresholds(self):
+        return self._thresholds
+
+    @thresholds.setter
+    def thresholds(self, value):
+        self._thresholds = value
+        self._compiled_thresholds = {}
+
+    @property
+    def metrics_unit(self):
+        return self._metrics_unit
+
+    @metrics_unit.setter
+    def metrics_unit(self, value):
+        self._metrics_unit = value
+        self._compiled_thresholds = {}
+
+    def get_compiled_threshold(self, metric_name, item=''):
+        """ Return the CompiledThreshold for given metric
+
+            Return None if no threshold is defined. The result is cached
+            until thresholds, units or configuration change.
+        """
+        compiled_thresholds = self._compiled_thresholds
+        key = (metric_name, item)
+        try:
+            return compiled_thresholds[key]
+        except KeyError:
+            pass
+
+        threshold = self.get_threshold(metric_name, item)
+        if threshold is None:
+            compiled = None
+        else:
+            (unit, unit_text) = self.metrics_unit.get(key, (None, None))
+            compiled = CompiledThreshold(
+                threshold,
+                self._get_softstatus_period(metric_name),
+                unit,
+                unit_text,
+            )
+        compiled_thresholds[key] = compiled
+        return compiled
+
     def get_threshold(self, metric_name, item='', thresholds=None):
         """ Get threshold definition for given metric
 
@@ -2821,9 +3362,6 @@ class Core:
         return threshold
 
     def check_threshold(self, metric_point):
-        # pylint: disable=too-many-branches
-        # pylint: disable=too-many-locals
-        # pylint: disable=too-many-statements
         """ Check if threshold is defined for given metric. If yes, check
             it and add a "status" tag.
 
@@ -2831,93 +3369,39 @@ class Core:
             of this metrics is 0, 1, 2 or 3 for ok, warning, critical
             and unknown respectively.
         """
-        threshold = self.get_threshold(
+        value = metric_point.value
+        if value is None:
+            return metric_point
+
+        threshold = self.get_compiled_threshold(
             metric_point.label, metric_point.labels.get('item', ''),
         )
 
         if threshold is None:
             return metric_point
 
-        value = metric_point.value
-        if value is None:
-            return metric_point
-
         # there is a "soft" status (name taken from Nagios), which is a kind
         # of instant status. As soon as the value cross a threshold, its
         # soft-status change. But its status only change if soft-status stay
         # in error for a period of time (5 minutes by default).
         # Note: as soon as soft-status is OK, status is OK, there is no period
         # to wait in this case.
-
-        if (threshold.get('low_critical') is not None
-                and value < threshold.get('low_critical')):
-            soft_status = 'critical'
-        elif (threshold.get('low_warning') is not None
-              and value < threshold.get('low_warning')):
-            soft_status = 'warning'
-        elif (threshold.get('high_critical') is not None
-              and value > threshold.get('high_critical')):
-            soft_status = 'critical'
-        elif (threshold.get('high_warning') is not None
-              and value > threshold.get('high_warning')):
-            soft_status = 'warning'
-        else:
-            soft_status = 'ok'
-
-        period = self._get_softstatus_period(metric_point.label)
         status = self._check_soft_status(
             metric_point,
-            soft_status,
-            period,
+            threshold.soft_status(value),
+            threshold.period,
         )
 
         if status == 'ok':
             status_value = 0.0
-            threshold_value = None
         elif status == 'warning':
-            if (threshold.get('low_warning') is not None
-                    and value < threshold.get('low_warning')):
-                threshold_value = threshold.get('low_warning')
-            else:
-                threshold_value = threshold.get('high_warning')
             status_value = 1.0
         else:
-            if (threshold.get('low_critical') is not None
-                    and value < threshold.get('low_critical')):
-                threshold_value = threshold.get('low_critical')
-            else:
-                threshold_value = threshold.get('high_critical')
-
             status_value = 2.0
 
-        (unit, unit_text) = self.metrics_unit.get(
-            (metric_point.label, metric_point.labels.get('item', '')),
-            (None, None),
-        )
-
-        text = 'Current value: %s' % format_value(
-            metric_point.value, unit, unit_text
-        )
-
-        if status != 'ok':
-            if period:
-                text += (
-                    ' threshold (%s) exceeded'
-                    ' over last %s' % (
-                        format_value(threshold_value, unit, unit_text),
-                        format_duration(period),
-                    )
-                )
-            else:
-                text += (
-                    ' threshold (%s) exceeded' % (
-                        format_value(threshold_value, unit, unit_text),
-                    )
-                )
-
         metric_point = metric_point._replace(
             status_code=bleemeo_agent.type.STATUS_NAME_TO_CODE[status],
-            problem_origin=text
+            problem_origin=threshold.problem_text(value, status),
         )
 
         metric_status = metric_point._replace(
@@ -19,6 +19,7 @@
 import logging
 import os
 import re
+import selectors
 import shlex
 import socket
 import threading
@@ -36,16 +37,48 @@ def graphite_split_line(line):
         >>> graphite_split_line(b'metric.name 42 1000')
         ('metric.name', 42.0, 1000.0)
     """
-    line = line.decode('utf-8')
+    return _split_text_line(line.decode('utf-8'))
 
+
+def graphite_split_lines(data):
+    """ Split a chunk of complete "graphite" lines.
+
+        data is a bytes-like object (bytes, bytearray or memoryview) which
+        is decoded once for all lines. Returns a list of
+        (timestamp, metric, value). Empty lines and lines with a
+        non-printable metric name are skipped.
+
+        >>> graphite_split_lines(b'metric.a 42 1000\\n\\nmetric.b 1 1010')
+        [(1000.0, 'metric.a', 42.0), (1010.0, 'metric.b', 1.0)]
+    """
+    result = []
+    for line in str(data, 'utf-8').split('\n'):
+        if not line:
+            continue
+
+        (metric, value, timestamp) = _split_text_line(line)
+        if not metric.isprintable():
+            continue
+
+        result.append((timestamp, metric, value))
+
+    return result
+
+
+def _split_text_line(line):
     # graphite line looks like "METRIC VALUE TIMESTAMP"
     # Usually metric, value and timestamp do not contains space (see tests case
     # for example with space).
-    # Use faster method when they don't contain space
+    # Use faster method when they don't contain space. shlex is only needed
+    # when the line use quoting, else splitting on whitespace gives the same
+    # result.
     if line.count(' ') == 2:
         (metric, value, timestamp) = line.split(' ')
     else:
-        part = shlex.split(line)
+        if '"' in line or "'" in line or '\\' in line:
+            part = shlex.split(line)
+        else:
+            part = line.split()
         timestamp = part[-1]
         value = part[-2]
         metric = ' '.join(part[0:-2])
@@ -95,6 +128,17 @@ class GraphiteServer(threading.Thread):
         self.telegraf_last_diagnostic = None
         self.initialization_done = threading.Event()
 
+        # Decoders cache how metric names are decoded. Incrementing this
+        # version tells them their cache is outdated.
+        self.decode_version = 0
+
+        self.service_index = bleemeo_agent.telegraf.ServiceIndex({})
+        self.container_tags_resolver = (
+            bleemeo_agent.telegraf.ContainerTagsResolver({})
+        )
+        self._es_node_ids_lock = threading.Lock()
+        self._es_node_ids_requested_at = None
+
     @property
     def metrics_source(self):
         """ Return the current metrics source (currently only telegraf
@@ -108,6 +152,21 @@ class GraphiteServer(threading.Thread):
         """
         return self.core.config['jmx.enabled']
 
+    @property
+    def listener_mode(self):
+        """ Return how client connections are served.
+
+            "selector" serves all connections from one I/O loop (the
+            default), "thread" starts one GraphiteClient thread per connection.
+        """
+        return self.core.config['graphite.listener.mode']
+
+    @property
+    def read_size(self):
+        """ Size of the buffer used to receive data from clients
+        """
+        return self.core.config['graphite.listener.read_size']
+
     def health_check(self):
         clock_now = bleemeo_agent.util.get_clock()
         no_data = (
@@ -180,10 +239,22 @@ class GraphiteServer(threading.Thread):
             return
 
         sock_server.listen(5)
-        sock_server.settimeout(1)
         self.listener_up = True
         self.initialization_done.set()
 
+        try:
+            if self.listener_mode == 'thread':
+                self._run_threads(sock_server)
+            else:
+                self._run_selector(sock_server)
+        finally:
+            sock_server.close()
+
+    def _run_threads(self, sock_server):
+        """ Serve each client connection from its own GraphiteClient thread
+        """
+        sock_server.settimeout(1)
+
         clients = []
         while not self.core.is_terminating.is_set():
             try:
@@ -195,20 +266,156 @@ class GraphiteServer(threading.Thread):
             except socket.timeout:
                 pass
 
-        sock_server.close()
-
         for client in clients:
             client.join()
 
+    def _run_selector(self, sock_server):
+        """ Serve all client connections from a single selector loop
+        """
+        sock_server.setblocking(False)
+        selector = selectors.DefaultSelector()
+        # All connections are read from this thread, they can share the same
+        # receive buffer.
+        read_buffer = bytearray(self.read_size)
+        selector.register(sock_server, selectors.EVENT_READ)
+
+        try:
+            next_idle_check = 0
+            while not self.core.is_terminating.is_set():
+                for (key, _) in selector.select(timeout=1):
+                    if key.fileobj is sock_server:
+                        self._selector_accept(selector, sock_server)
+                    else:
+                        self._selector_read(
+                            selector, key.fileobj, key.data, read_buffer,
+                        )
+
+                # Same as GraphiteClient: send pending metrics once the
+                # client stayed silent for one second.
+                clock_now = bleemeo_agent.util.get_clock()
+                if clock_now >= next_idle_check:
+                    next_idle_check = clock_now + 1
+                    for key in list(selector.get_map().values()):
+                        if key.data is not None:
+                            key.data.flush_if_idle(clock_now)
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    self._selector_close(selector, key.fileobj, key.data)
+            selector.close()
+
+    def _selector_accept(self, selector, sock_server):
+        try:
+            (sock_client, addr) = sock_server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error as exc:
+            logging.debug('graphite: failed to accept client: %s', exc)
+            return
+
+        logging.debug('graphite: client connected from %s', addr)
+        sock_client.setblocking(False)
+        connection = GraphiteConnection(self, addr)
+        selector.register(sock_client, selectors.EVENT_READ, connection)
+
+    def _selector_read(self, selector, sock_client, connection, read_buffer):
+        try:
+            count = sock_client.recv_into(read_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error as exc:
+            logging.debug(
+                'graphite: error while reading from %s: %s',
+                connection.addr, exc,
+            )
+            count = 0
+
+        if count == 0:
+            self._selector_close(selector, sock_client, connection)
+            return
+
+        try:
+            connection.feed(memoryview(read_buffer)[:count])
+        except Exception:  # pylint: disable=broad-except
+            # With one thread per client, such error only killed the client
+            # thread. Keep the same behavior and don't stop the I/O loop.
+            logging.warning(
+                'graphite: error while processing data from %s',
+                connection.addr,
+                exc_info=True,
+            )
+            self._selector_close(selector, sock_client, connection)
+
+    @staticmethod
+    def _selector_close(selector, sock_client, connection):
+        selector.unregister(sock_client)
+        sock_client.close()
+        try:
+            connection.close()
+        finally:
+            logging.debug(
+                'graphite: client %s disconnectd', connection.addr,
+            )
+
     def update_discovery(self):
         """ Update configuration after a service discovery was run
         """
+        self.update_service_index()
+        if self.service_index.elasticsearch_missing_node_id:
+            self.request_elasticsearch_node_ids()
+
         if self.metrics_source == 'telegraf':
             bleemeo_agent.telegraf.update_discovery(self.core)
 
         if self.jmx_enabled:
             bleemeo_agent.jmxtrans.update_discovery(self.core)
 
+    def update_service_index(self):
+        """ Rebuild the indexes used by decoders to find services and
+            containers
+        """
+        self.service_index = bleemeo_agent.telegraf.ServiceIndex(
+            self.core.services,
+        )
+        self.container_tags_resolver = (
+            bleemeo_agent.telegraf.ContainerTagsResolver(
+                self.core.docker_containers_by_name,
+            )
+        )
+        self.invalidate_decode_cache()
+
+    def request_elasticsearch_node_ids(self):
+        """ Schedule the fetch of es_node_id for Elasticsearch services
+
+            The fetch does HTTP requests, it's done in a scheduled job and
+            not while processing points. Requests are limited to one per
+            minute.
+        """
+        clock_now = bleemeo_agent.util.get_clock()
+        with self._es_node_ids_lock:
+            if (self._es_node_ids_requested_at is not None and
+                    clock_now - self._es_node_ids_requested_at < 60):
+                return
+            self._es_node_ids_requested_at = clock_now
+
+        self.core.add_scheduled_job(
+            self._update_elasticsearch_node_ids,
+            seconds=0,
+            next_run_in=0,
+        )
+
+    def _update_elasticsearch_node_ids(self):
+        if bleemeo_agent.telegraf.fetch_elasticsearch_node_ids(self.core):
+            self.update_service_index()
+
+    def invalidate_decode_cache(self):
+        """ Invalidate the decoding of metric names cached by decoders
+
+            Must be called when anything used to decode a metric name changed,
+            e.g. services, containers, facts or configuration.
+        """
+        self.decode_version += 1
+
     def get_time_elapsed_since_last_data(self):
         # pylint: disable=invalid-name
         """ Returns a metric "time_elapsed_since_last_data" which
@@ -278,78 +485,78 @@ class GraphiteServer(threading.Thread):
         return _disk_path_rename(path, mount_point, ignored_patterns)
 
 
-class GraphiteClient(threading.Thread):
+class GraphiteConnection:
+    """ Decode the Graphite stream received on one client connection
 
-    def __init__(self, server, client_socket, client_addr):
-        super().__init__()
+        This object does no I/O. Data read from the socket is given to feed()
+        either by a GraphiteClient thread or by the GraphiteServer selector
+        loop.
+    """
 
+    def __init__(self, server, client_addr):
         self.core = server.core
         self.server = server
-        self.socket = client_socket
         self.addr = client_addr
 
         # Decode either Telegraf or jmxtrans input.
         self.client_decoder = None
 
-    def run(self):
-        logging.debug('graphite: client connected from %s', self.addr)
+        # Received data not yet processed. It only contains the start of
+        # a line whose end is not yet received.
+        self._buffer = bytearray()
+        self._pending_metrics = []
+        self._pending_first_time = 0
+        self._last_data_at = bleemeo_agent.util.get_clock()
+
+    def feed(self, data):
+        """ Process data received from the client
 
+            data is a bytes-like object. It's copied, so caller may reuse
+            its receive buffer.
+        """
+        self._last_data_at = bleemeo_agent.util.get_clock()
+
+        self._buffer += data
+        end = self._buffer.rfind(b'\n')
+        if end != -1:
+            # Parse all complete lines in one pass, the incomplete line
+            # (if any) stays in the buffer.
+            with memoryview(self._buffer) as view:
+                metrics = graphite_split_lines(view[:end])
+            del self._buffer[:end + 1]
+
+            if metrics:
+                if not self._pending_metrics:
+                    self._pending_first_time = time.time()
+                self._pending_metrics.extend(metrics)
+
+        if (self._pending_metrics
+                and time.time() > self._pending_first_time + 3):
+            self.flush()
+
+    def flush_if_idle(self, clock_now):
+        """ Flush pending metrics if nothing was received for one second
+        """
+        if self._pending_metrics and clock_now - self._last_data_at >= 1:
+            self.flush()
+
+    def flush(self):
+        """ Send pending metrics to the client decoder
+        """
+        if self._pending_metrics:
+            pending_metrics = self._pending_metrics
+            self._pending_metrics = []
+            self._flush_metrics(pending_metrics)
+
+    def close(self):
+        """ Flush pending metrics and close the client decoder
+        """
         try:
-            self._process_client()
+            self.flush()
         finally:
-            self.socket.close()
-            logging.debug('graphite: client %s disconnectd', self.addr)
             if self.client_decoder is not None:
                 self.client_decoder.close()
 
-    def _process_client(self):
-        remain = b''
-        self.socket.settimeout(1)
-        pending_metrics = []
-        pending_first_time = 0
-        while not self.core.is_terminating.is_set():
-            try:
-                tmp = self.socket.recv(4096)
-            except socket.timeout:
-                if pending_metrics:
-                    self._flush_metrics(pending_metrics)
-                    pending_metrics = []
-                continue
-
-            if tmp == b'':
-                break
-
-            lines = (remain + tmp).split(b'\n')
-            remain = b''
-
-            if lines[-1] != b'':
-                remain = lines[-1]
-
-            # either it's '' or we moved it to remain.
-            del lines[-1]
-
-            for line in lines:
-                if line == b'':
-                    continue
-
-                metric, value, timestamp = graphite_split_line(line)
-                if not metric.isprintable():
-                    continue
-
-                if not pending_metrics:
-                    pending_first_time = time.time()
-                pending_metrics.append(
-                    (timestamp, metric, value),
-                )
-
-            if pending_metrics and time.time() > pending_first_time + 3:
-                self._flush_metrics(pending_metrics)
-                pending_metrics = []
-
-        if pending_metrics:
-            self._flush_metrics(pending_metrics)
-            pending_metrics = []
-
     def _flush_metrics(self, pending_metrics):
         pending_metrics.sort()
         for (timestamp, metric, value) in pending_metrics:
@@ -376,3 +583,44 @@ class GraphiteClient(threading.Thread):
                 return
 
         self.client_decoder.emit_metric(name, timestamp, value)
+
+
+class GraphiteClient(threading.Thread):
+    """ Serve one client connection from a dedicated thread
+
+        Only used when graphite.listener.mode is "thread".
+    """
+
+    def __init__(self, server, client_socket, client_addr):
+        super().__init__()
+
+        self.core = server.core
+        self.server = server
+        self.socket = client_socket
+        self.addr = client_addr
+        self.connection = GraphiteConnection(server, client_addr)
+
+    def run(self):
+        logging.debug('graphite: client connected from %s', self.addr)
+
+        try:
+            self._process_client()
+        finally:
+            self.socket.close()
+            logging.debug('graphite: client %s disconnectd', self.addr)
+            self.connection.close()
+
+    def _process_client(self):
+        read_buffer = bytearray(self.server.read_size)
+        self.socket.settimeout(1)
+        while not self.core.is_terminating.is_set():
+            try:
+                count = self.socket.recv_into(read_buffer)
+            except socket.timeout:
+                self.connection.flush()
+                continue
+
+            if count == 0:
+                break
+
+            self.connection.feed(memoryview(read_buffer)[:count])
@@ -437,10 +437,11 @@ class Jmxtrans:
             labels = {}
             if item:
                 labels['item'] = item
+            labels = bleemeo_agent.type.intern_labels(labels)
 
             if jmx_metric.get('scale'):
                 new_value = new_value * jmx_metric['scale']
-            metric_point = bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+            metric_point = bleemeo_agent.type.MetricPoint(
                 label=new_name,
                 labels=labels,
                 time=timestamp,
@@ -475,7 +476,7 @@ class Jmxtrans:
             labels = {}
             if item:
                 labels['item'] = item
-            metric_point = bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+            metric_point = bleemeo_agent.type.MetricPoint(
                 label=name,
                 labels=labels,
                 time=timestamp,
@@ -515,7 +516,7 @@ class Jmxtrans:
                 labels['item'] = item
 
             if new_value is not None:
-                metric_point = bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                metric_point = bleemeo_agent.type.MetricPoint(
                     label=name,
                     labels=labels,
                     time=timestamp,
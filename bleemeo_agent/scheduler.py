@@ -0,0 +1,469 @@
+#
+#  Copyright 2015-2018 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+""" Job scheduler based on a heap of monotonic deadlines
+
+    Jobs are run by a pool of threads dedicated to their job class, so slow
+    jobs of one class (e.g. service checks) can't delay jobs of another class.
+"""
+
+import bisect
+import collections
+import concurrent.futures
+import heapq
+import logging
+import random
+import threading
+
+import bleemeo_agent.util
+
+
+DEFAULT_WORKERS = {
+    'default': 10,
+    'check': 10,
+}
+
+# Upper bounds (in seconds) of the buckets of job duration histograms
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, float('inf'))
+
+
+def _job_name(func):
+    name = getattr(func, '__qualname__', None)
+    if name is None:
+        name = getattr(func, '__name__', repr(func))
+    return name
+
+
+class JobStats:
+    """ Execution statistics of all jobs with the same name
+
+        Counters are cumulative. Attributes prefixed by "window_" only
+        cover runs since the last Scheduler.pop_stats().
+
+        A run is coalesced when the job was still running when it was due:
+        it's delayed until the end of the current run. A run is skipped when
+        it's not done at all: the job was still running and already had a
+        coalesced run, or the scheduler missed the deadline by more than one
+        interval.
+    """
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        'runs', 'errors', 'coalesced', 'skipped', 'total_duration',
+        'max_duration', 'max_lateness', 'histogram', 'window_runs',
+        'window_errors', 'window_skipped', 'window_duration',
+        'window_max_duration', 'window_max_lateness',
+    )
+
+    def __init__(self):
+        self.runs = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.max_lateness = 0.0
+        self.histogram = [0] * len(DURATION_BUCKETS)
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_runs = 0
+        self.window_errors = 0
+        self.window_skipped = 0
+        self.window_duration = 0.0
+        self.window_max_duration = 0.0
+        self.window_max_lateness = 0.0
+
+    def record_run(self, duration, lateness, failed):
+        self.runs += 1
+        self.window_runs += 1
+        if failed:
+            self.errors += 1
+            self.window_errors += 1
+        self.total_duration += duration
+        self.window_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.window_max_duration = max(self.window_max_duration, duration)
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.window_max_lateness = max(self.window_max_lateness, lateness)
+        self.histogram[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+
+    def record_skipped(self, count):
+        self.skipped += count
+        self.window_skipped += count
+
+    def as_dict(self):
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'coalesced': self.coalesced,
+            'skipped': self.skipped,
+            'total_duration': self.total_duration,
+            'avg_duration': (
+                self.total_duration / self.runs if self.runs else None
+            ),
+            'max_duration': self.max_duration,
+            'max_lateness': self.max_lateness,
+            'histogram': list(zip(DURATION_BUCKETS, self.histogram)),
+        }
+
+    def pop_window(self):
+        result = {
+            'runs': self.window_runs,
+            'errors': self.window_errors,
+            'skipped': self.window_skipped,
+            'avg_duration': (
+                self.window_duration / self.window_runs
+                if self.window_runs else None
+            ),
+            'max_duration': (
+                self.window_max_duration if self.window_runs else None
+            ),
+            'max_lateness': (
+                self.window_max_lateness if self.window_runs else None
+            ),
+        }
+        self._reset_window()
+        return result
+
+
+class Job:
+    """ A job registered in a Scheduler
+
+        interval is None for a job which run only once.
+
+        Runtime statistics are updated after each run: runs, errors,
+        coalesced and skipped (see JobStats), last_duration, max_duration,
+        total_duration and last_lateness (in seconds). Statistics shared by
+        all jobs with the same name are in stats.
+    """
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        'scheduler', 'func', 'args', 'name', 'interval', 'job_class',
+        'deadline', 'base_deadline', 'phase', 'entry', 'running', 'pending',
+        'removed', 'stats', 'runs', 'errors', 'coalesced', 'skipped',
+        'last_duration', 'max_duration', 'total_duration', 'last_lateness',
+    )
+
+    def __init__(self, scheduler, func, args, interval, job_class, phase):
+        # pylint: disable=too-many-arguments
+        self.scheduler = scheduler
+        self.func = func
+        self.args = args
+        self.name = _job_name(func)
+        self.interval = interval
+        self.job_class = job_class
+        self.phase = phase
+        self.deadline = None
+        self.base_deadline = None
+        # sequence number of the heap entry which is still valid
+        self.entry = None
+        self.running = False
+        # deadline of the run coalesced while the job was running
+        self.pending = None
+        self.removed = False
+
+        self.stats = None
+        self.runs = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lateness = None
+
+    def __repr__(self):
+        return '<Job %s interval=%s>' % (self.name, self.interval)
+
+    def remove(self):
+        """ Unschedule this job
+        """
+        self.scheduler.unschedule(self)
+
+    def trigger(self):
+        """ Run this job as soon as possible
+        """
+        self.scheduler.trigger(self)
+
+
+class Scheduler:
+    """ Run jobs at given monotonic deadlines
+
+        Adding, triggering and unscheduling a job are O(log n): the heap
+        entries of a rescheduled or unscheduled job are not removed, they are
+        ignored when popped.
+
+        Interval jobs don't drift: the next deadline is computed from the
+        previous deadline, not from the end of the run. Runs missed (e.g.
+        after the system was suspended) are skipped.
+
+        A job never runs concurrently with itself. If it's due while still
+        running, one more run is done as soon as it finishes.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = DEFAULT_WORKERS
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = 0
+        self._stale_entries = 0
+        self._jobs = set()
+        # job name => JobStats
+        self._stats = {}
+        self._executors = {}
+        self._thread = None
+        self._stopped = False
+
+    def add_job(self, func, interval=None, args=None, next_run_in=None,
+                jitter=0, job_class='default'):
+        # pylint: disable=too-many-arguments
+        """ Add a job and return it
+
+            If interval is 0 or None, the job run only once, next_run_in
+            seconds from now. In this case next_run_in could not be None.
+
+            If next_run_in is None, the first run is one interval from now.
+
+            The first run is delayed by a random delay between 0 and jitter
+            seconds. For interval jobs, the following runs keep this delay,
+            so jobs added at the same time are spread over jitter seconds.
+        """
+        if not interval:
+            interval = None
+            if next_run_in is None:
+                raise ValueError(
+                    'next_run_in could not be None if interval is 0'
+                )
+        if job_class not in self.workers:
+            raise ValueError('unknown job class %r' % job_class)
+        if args is None:
+            args = ()
+
+        phase = random.uniform(0, jitter) if jitter else 0
+        job = Job(self, func, tuple(args), interval, job_class, phase)
+        if next_run_in is None:
+            next_run_in = interval
+
+        with self._cond:
+            if job.name not in self._stats:
+                self._stats[job.name] = JobStats()
+            job.stats = self._stats[job.name]
+            job.base_deadline = (
+                bleemeo_agent.util.get_clock() + next_run_in + phase
+            )
+            self._jobs.add(job)
+            self._push(job, job.base_deadline)
+        return job
+
+    def trigger(self, job):
+        """ Run job as soon as possible
+
+            For interval jobs, the following runs are one interval after this
+            run.
+        """
+        with self._cond:
+            if job is None or job.removed:
+                return
+            job.base_deadline = bleemeo_agent.util.get_clock()
+            self._push(job, job.base_deadline)
+
+    def unschedule(self, job):
+        """ Remove job. A run in progress is not interrupted
+
+            Does nothing if job is None or was already removed.
+        """
+        with self._cond:
+            if job is None or job.removed:
+                return
+            self._remove(job)
+
+    def jobs(self):
+        """ Return the list of scheduled jobs
+        """
+        with self._cond:
+            return list(self._jobs)
+
+    def stats(self):
+        """ Return cumulative statistics of jobs, grouped by job name
+
+            Return a dict job name => dict of statistics (see JobStats).
+        """
+        with self._cond:
+            scheduled = collections.Counter(job.name for job in self._jobs)
+            result = {}
+            for (name, stats) in self._stats.items():
+                result[name] = stats.as_dict()
+                result[name]['scheduled'] = scheduled[name]
+            return result
+
+    def pop_stats(self):
+        """ Return statistics of jobs since the last call, grouped by job name
+
+            Return a dict job name => dict with runs, errors, skipped,
+            avg_duration, max_duration and max_lateness. The last three are
+            None if the job didn't run.
+        """
+        with self._cond:
+            return {
+                name: stats.pop_window()
+                for (name, stats) in self._stats.items()
+            }
+
+    def start(self):
+        with self._cond:
+            self._stopped = False
+            for (job_class, max_workers) in self.workers.items():
+                self._executors[job_class] = (
+                    concurrent.futures.ThreadPoolExecutor(max_workers)
+                )
+        self._thread = threading.Thread(target=self._run, name='scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self, wait=True):
+        """ Stop running jobs. Wait for running jobs if wait is True
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+        self._executors = {}
+
+    def _push(self, job, deadline):
+        """ Add a heap entry for job, invalidating the previous one
+
+            Must be called with self._cond held.
+        """
+        if job.entry is not None:
+            self._stale_entries += 1
+        self._sequence += 1
+        job.entry = self._sequence
+        job.deadline = deadline
+        heapq.heappush(self._heap, (deadline, self._sequence, job))
+
+        if self._stale_entries > 64 and self._stale_entries > len(self._jobs):
+            self._heap = [
+                entry for entry in self._heap if entry[1] == entry[2].entry
+            ]
+            heapq.heapify(self._heap)
+            self._stale_entries = 0
+
+        if self._heap[0][2] is job:
+            self._cond.notify()
+
+    def _remove(self, job):
+        job.removed = True
+        job.deadline = None
+        if job.entry is not None:
+            job.entry = None
+            self._stale_entries += 1
+        self._jobs.discard(job)
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                (deadline, sequence, job) = self._heap[0]
+                if sequence != job.entry:
+                    heapq.heappop(self._heap)
+                    self._stale_entries -= 1
+                    continue
+
+                clock_now = bleemeo_agent.util.get_clock()
+                if deadline > clock_now:
+                    self._cond.wait(deadline - clock_now)
+                    continue
+
+                heapq.heappop(self._heap)
+                job.entry = None
+                if job.interval is None:
+                    self._remove(job)
+                else:
+                    self._schedule_next(job, clock_now)
+                self._dispatch(job, deadline)
+
+    def _schedule_next(self, job, clock_now):
+        base_deadline = job.base_deadline + job.interval
+        if base_deadline <= clock_now:
+            missed = int((clock_now - base_deadline) // job.interval) + 1
+            base_deadline += missed * job.interval
+            job.skipped += missed
+            job.stats.record_skipped(missed)
+        job.base_deadline = base_deadline
+        self._push(job, base_deadline)
+
+    def _dispatch(self, job, deadline):
+        """ Submit job to its executor, or mark it pending if it's running
+
+            Must be called with self._cond held.
+        """
+        if job.running:
+            if job.pending is None:
+                job.pending = deadline
+                job.coalesced += 1
+                job.stats.coalesced += 1
+            else:
+                job.skipped += 1
+                job.stats.record_skipped(1)
+            return
+
+        job.running = True
+        try:
+            self._executors[job.job_class].submit(self._run_job, job, deadline)
+        except RuntimeError:
+            # executor is shutting down
+            job.running = False
+
+    def _run_job(self, job, deadline):
+        start = bleemeo_agent.util.get_clock()
+        lateness = max(0.0, start - deadline)
+        failed = False
+        try:
+            job.func(*job.args)
+        except Exception:  # pylint: disable=broad-except
+            failed = True
+            logging.error(
+                'Job %s raised an exception', job.name, exc_info=True,
+            )
+        duration = bleemeo_agent.util.get_clock() - start
+
+        with self._cond:
+            job.runs += 1
+            if failed:
+                job.errors += 1
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.total_duration += duration
+            job.last_lateness = lateness
+            job.stats.record_run(duration, lateness, failed)
+            job.running = False
+            if job.pending is not None:
+                deadline = job.pending
+                job.pending = None
+                if not self._stopped and not job.removed:
+                    self._dispatch(job, deadline)
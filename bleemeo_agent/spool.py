@@ -0,0 +1,350 @@
+#
+#  Copyright 2015-2018 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+""" On-disk spool for metric points which could not be sent
+
+    Points are appended to segment files in a directory. Each record is
+    prefixed by its length and its CRC32, so a truncated or corrupted record
+    (e.g. after a crash) is detected and skipped.
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+import bleemeo_agent.util
+
+
+# length and CRC32 of the record
+RECORD_HEADER = struct.Struct('<II')
+
+SEGMENT_SUFFIX = '.seg'
+POSITION_FILE = 'position'
+
+
+class SegmentSpool:
+    """ Bounded, append-only FIFO of records stored in segment files
+
+        Records are bytes. Writes are fsync'ed at most every fsync_interval
+        seconds. When the spool is larger than max_size, the oldest segments
+        are dropped.
+
+        The read position is stored in the directory, so records not yet
+        read are kept across restarts.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, directory, max_size, segment_size=1024 * 1024,
+                 fsync_interval=5):
+        # pylint: disable=too-many-arguments
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        self._write_file = None
+        self._last_fsync = bleemeo_agent.util.get_clock()
+        self.dropped_bytes = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # segment number => size in bytes
+        self._segments = {}
+        for filename in os.listdir(directory):
+            if not filename.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                number = int(filename[:-len(SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            self._segments[number] = os.path.getsize(
+                self._segment_path(number)
+            )
+
+        (self._read_segment, self._read_offset) = self._load_position()
+
+        # Never append to an existing segment: it may ends with a record
+        # partially written before a crash.
+        self._open_segment()
+
+    def _segment_path(self, number):
+        return os.path.join(
+            self.directory, '%012d%s' % (number, SEGMENT_SUFFIX),
+        )
+
+    def _load_position(self):
+        first_segment = min(self._segments) if self._segments else 1
+        try:
+            with open(os.path.join(self.directory, POSITION_FILE)) as fileobj:
+                position = json.load(fileobj)
+            segment = int(position['segment'])
+            offset = int(position['offset'])
+        except (OSError, IOError, ValueError, KeyError, TypeError):
+            return (first_segment, 0)
+
+        if segment not in self._segments:
+            return (first_segment, 0)
+        return (segment, offset)
+
+    def _save_position(self):
+        path = os.path.join(self.directory, POSITION_FILE)
+        with open(path + '.tmp', 'w') as fileobj:
+            json.dump(
+                {'segment': self._read_segment, 'offset': self._read_offset},
+                fileobj,
+            )
+        os.replace(path + '.tmp', path)
+
+    def _open_segment(self):
+        if self._write_file is not None:
+            self._sync()
+            self._write_file.close()
+
+        number = max(self._segments) + 1 if self._segments else 1
+        self._write_file = open(self._segment_path(number), 'ab')
+        self._segments[number] = 0
+        if self._read_segment not in self._segments:
+            (self._read_segment, self._read_offset) = (number, 0)
+
+    @property
+    def _write_segment(self):
+        return max(self._segments)
+
+    def _sync(self):
+        self._write_file.flush()
+        os.fsync(self._write_file.fileno())
+        self._last_fsync = bleemeo_agent.util.get_clock()
+
+    def size(self):
+        """ Size in bytes of records not yet read
+        """
+        with self._lock:
+            return sum(self._segments.values()) - self._read_offset
+
+    def append(self, records):
+        """ Append records (a list of bytes) at the end of the spool
+        """
+        if not records:
+            return
+
+        data = b''.join(
+            RECORD_HEADER.pack(len(record), zlib.crc32(record)) + record
+            for record in records
+        )
+
+        with self._lock:
+            if self._segments[self._write_segment] >= self.segment_size:
+                self._open_segment()
+            self._write_file.write(data)
+            self._segments[self._write_segment] += len(data)
+            self._enforce_max_size()
+
+            clock_now = bleemeo_agent.util.get_clock()
+            if clock_now - self._last_fsync >= self.fsync_interval:
+                self._sync()
+
+    def _enforce_max_size(self):
+        while (sum(self._segments.values()) > self.max_size
+               and len(self._segments) > 1):
+            oldest = min(self._segments)
+            size = self._segments.pop(oldest)
+            if oldest == self._read_segment:
+                size -= self._read_offset
+                (self._read_segment, self._read_offset) = (
+                    min(self._segments), 0,
+                )
+            self.dropped_bytes += size
+            logging.warning(
+                'Spool in %s is full, dropped %d bytes of oldest points',
+                self.directory,
+                size,
+            )
+            os.remove(self._segment_path(oldest))
+
+    def peek(self, max_records):
+        """ Return up to max_records records, the oldest first, and the
+            position after them
+
+            Records are kept in the spool until commit() is called with the
+            returned position.
+        """
+        with self._lock:
+            self._write_file.flush()
+            records = []
+            (segment, offset) = (self._read_segment, self._read_offset)
+            while len(records) < max_records:
+                (offset, end_reached) = self._read_records(
+                    segment, offset, records, max_records,
+                )
+                if not end_reached or segment == self._write_segment:
+                    break
+                segment = min(
+                    number for number in self._segments if number > segment
+                )
+                offset = 0
+
+            return (records, (segment, offset))
+
+    def commit(self, position):
+        """ Remove records before position, as returned by peek()
+        """
+        with self._lock:
+            if position <= (self._read_segment, self._read_offset):
+                # Nothing new was read, or the records were already dropped
+                # by _enforce_max_size
+                return
+            (segment, offset) = position
+            for number in sorted(self._segments):
+                if number >= segment:
+                    break
+                os.remove(self._segment_path(number))
+                del self._segments[number]
+            (self._read_segment, self._read_offset) = (segment, offset)
+            self._save_position()
+
+    def read(self, max_records):
+        """ Return up to max_records records, the oldest first
+
+            Records are removed from the spool.
+        """
+        (records, position) = self.peek(max_records)
+        self.commit(position)
+        return records
+
+    def _read_records(self, segment, offset, records, max_records):
+        """ Read records of segment, starting at offset
+
+            Return the offset after the last record read and True if the end
+            of the segment was reached
+        """
+        path = self._segment_path(segment)
+        with open(path, 'rb') as fileobj:
+            fileobj.seek(offset)
+            while len(records) < max_records:
+                header = fileobj.read(RECORD_HEADER.size)
+                if not header:
+                    return (offset, True)
+                if len(header) == RECORD_HEADER.size:
+                    (length, crc) = RECORD_HEADER.unpack(header)
+                    record = fileobj.read(length)
+                    if len(record) == length and zlib.crc32(record) == crc:
+                        records.append(record)
+                        offset += RECORD_HEADER.size + length
+                        continue
+
+                if segment == self._write_segment:
+                    # Should not happen, we flushed our writes
+                    return (offset, False)
+
+                logging.warning(
+                    'Spool segment %s is corrupted, skipping its end', path,
+                )
+                return (self._segments[segment], True)
+
+        return (offset, False)
+
+    def close(self):
+        """ Flush written records to disk and close the spool
+        """
+        with self._lock:
+            if self._write_file is not None:
+                self._sync()
+                self._write_file.close()
+                self._write_file = None
+
+
+class MetricSpool:
+    """ Spool of points, as sent to Bleemeo Cloud platform
+
+        Points whose measurement is in priority_labels are stored in their
+        own spool, which is drained first. Points are returned in the order
+        they were added, so the first N points returned by peek() are the
+        ones returned by peek(N).
+    """
+
+    def __init__(self, directory, max_size, priority_labels):
+        self.priority_labels = priority_labels
+        self._priority = SegmentSpool(
+            os.path.join(directory, 'priority'), max_size // 4,
+        )
+        self._normal = SegmentSpool(
+            os.path.join(directory, 'normal'), max_size - max_size // 4,
+        )
+
+    def __bool__(self):
+        return bool(self._priority.size() or self._normal.size())
+
+    def put(self, bleemeo_metrics):
+        """ Add points (dict as sent to Bleemeo Cloud platform) to the spool
+        """
+        priority = []
+        normal = []
+        for bleemeo_metric in bleemeo_metrics:
+            record = json.dumps(bleemeo_metric).encode('utf-8')
+            if bleemeo_metric['measurement'] in self.priority_labels:
+                priority.append(record)
+            else:
+                normal.append(record)
+        self._priority.append(priority)
+        self._normal.append(normal)
+
+    def peek(self, max_points):
+        """ Return up to max_points points and the position after them
+
+            Points are kept in the spool until commit() is called with the
+            returned position.
+        """
+        (records, priority_position) = self._priority.peek(max_points)
+        normal_position = None
+        if len(records) < max_points:
+            (normal_records, normal_position) = self._normal.peek(
+                max_points - len(records),
+            )
+            records.extend(normal_records)
+
+        points = []
+        for record in records:
+            try:
+                points.append(json.loads(record.decode('utf-8')))
+            except ValueError:
+                continue
+        return (points, (priority_position, normal_position))
+
+    def commit(self, position):
+        """ Remove points before position, as returned by peek()
+        """
+        (priority_position, normal_position) = position
+        self._priority.commit(priority_position)
+        if normal_position is not None:
+            self._normal.commit(normal_position)
+
+    def get(self, max_points):
+        """ Return up to max_points points, removing them from the spool
+        """
+        (points, position) = self.peek(max_points)
+        self.commit(position)
+        return points
+
+    def close(self):
+        self._priority.close()
+        self._normal.close()
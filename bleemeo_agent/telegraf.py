@@ -17,6 +17,7 @@
 #
 # pylint: disable=too-many-lines
 
+import collections
 import distutils.version  # pylint: disable=import-error,no-name-in-module
 import logging
 import os
@@ -164,6 +165,52 @@ class MissingMetric(Exception):
     """
 
 
+# Number of metric names whose decoding is cached by each Telegraf decoder
+DECODE_CACHE_SIZE = 20000
+
+# Returned by Telegraf._decode_name when the metric is dropped but the
+# decision must not be cached.
+NOT_CACHEABLE = object()
+
+DecodedMetric = collections.namedtuple('DecodedMetric', (
+    'label',
+    'labels',
+    'service',
+    'instance',
+    'container_name',
+    # If True, the value is a counter and the derivate is emitted
+    'derive',
+    'no_emit',
+    # Function applied to the value (before derivate), or None
+    'value_func',
+    # (name, item, instance) of computed metrics to mark as pending
+    'pending',
+    # Telegraf methods called with (decoded, timestamp, value) to emit
+    # additional metrics
+    'extra_emits',
+))
+
+
+def _percent_complement(value):
+    return 100 - value
+
+
+def _bytes_to_bits(value):
+    return value * 8
+
+
+def _megabytes_to_bytes(value):
+    return value * 1024 * 1024
+
+
+def _nanoseconds_to_percent(value):
+    return value / 1000000000 * 100
+
+
+def _per_10_seconds_to_per_second(value):
+    return value / 10
+
+
 def compare_version(current_version, wanted_version):
     """ Return True if current_version is greater or equal to wanted_version
     """
@@ -282,276 +329,1569 @@ def diagnostic(core):
             logging.info("The other listenners are: %s", names)
 
 
-class Telegraf:
+class ServiceIndex:
+    """ Index of core.services used to find the service instance of metrics
 
-    def __init__(self, graphite_client):
-        self.core = graphite_client.core
-        self.graphite_client = graphite_client
-        self.graphite_server = graphite_client.server
+        It's built on each service discovery, so processing a point don't
+        need to iterate over all services.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, services):
+        # (service_name, address, port) => instance
+        self.by_address = {}
+        # (host, port) of HAProxy stats_url => instance
+        self.haproxy_by_stats_url = {}
+        # es_node_id => instance of Elasticsearch
+        self.elasticsearch_by_node_id = {}
+        # True if an Elasticsearch service don't yet known its es_node_id
+        self.elasticsearch_missing_node_id = False
+
+        # When multiple services match, the first one wins like when
+        # services were iterated for each point.
+        for (key, service_info) in services.items():
+            (service_name, instance) = key
+            address = service_info.get('address')
+            self.by_address.setdefault(
+                (service_name, address, service_info.get('port')),
+                instance,
+            )
+            if service_name == 'rabbitmq':
+                # RabbitMQ use mgmt port
+                self.by_address.setdefault(
+                    (
+                        service_name,
+                        address,
+                        service_info.get('mgmt_port', 15672),
+                    ),
+                    instance,
+                )
 
-        # used to compute derivated values
-        self._raw_value = {}
+            if service_name == 'haproxy' and 'stats_url' in service_info:
+                tmp = urllib_parse.urlparse(service_info['stats_url'])
+                try:
+                    self.haproxy_by_stats_url.setdefault(
+                        (tmp.hostname, tmp.port), instance,
+                    )
+                except ValueError:
+                    # Invalid port in stats_url
+                    pass
 
-        self.computed_metrics_pending = set()
+            if (service_name == 'elasticsearch'
+                    and _elasticsearch_reachable(service_info)):
+                if 'es_node_id' in service_info:
+                    self.elasticsearch_by_node_id.setdefault(
+                        service_info['es_node_id'], instance,
+                    )
+                else:
+                    self.elasticsearch_missing_node_id = True
 
-        self.last_timestamp = 0
-        self.last_depecated_telgraf_warning = 0
 
-        self.core.add_scheduled_job(
-            self._purge_metrics,
-            seconds=5 * 60,
+def _elasticsearch_reachable(service_info):
+    return (
+        service_info.get('active', True)
+        and service_info.get('address') is not None
+        and service_info.get('port') is not None
+    )
+
+
+def fetch_elasticsearch_node_ids(core):
+    """ Fill es_node_id of Elasticsearch services which don't have it
+
+        Return True if at least one es_node_id was added.
+    """
+    updated = False
+    for (key, service_info) in list(core.services.items()):
+        (service_name, _) = key
+        if service_name != 'elasticsearch':
+            continue
+        if not _elasticsearch_reachable(service_info):
+            continue
+        if 'es_node_id' in service_info:
+            continue
+        try:
+            response = requests.get(
+                'http://%(address)s:%(port)s/_nodes/_local/' % service_info,
+                headers={'User-Agent': core.http_user_agent},
+                timeout=10.0,
+            )
+            data = response.json()
+            this_node_id = list(data['nodes'].keys())[0]
+        except (requests.RequestException, ValueError, KeyError, IndexError):
+            logging.debug('Error while fetching es_node_id', exc_info=True)
+            continue
+
+        service_info['es_node_id'] = this_node_id
+        updated = True
+    return updated
+
+
+# Properties of docker_container_* metrics added by Telegraf, in the order
+# they were added.
+DOCKER_BASE_PROPERTIES = [
+    # Added in Telegraf <1.1.0
+    "prefix",
+    "host",
+    "container_image",
+    "container_name",
+    "container_version",
+    # Added in Telegraf 1.1.0
+    "engine_host",
+    # Added in Telegraf 1.7.0
+    "server_version",
+    # Added in Telegraf 1.8.0
+    "container_status",
+]
+
+ContainerLayout = collections.namedtuple('ContainerLayout', (
+    # Position in core.docker_containers_by_name, the first container
+    # matching a metric wins.
+    'order',
+    'name',
+    # Container labels which are sent by Telegraf as tags
+    'user_keys',
+    # Index of the container name in the graphite metric name
+    'position',
+))
+
+
+class ContainerTagsResolver:
+    """ Find the tags of docker_container_* metrics sent without
+        graphite_tag_support (see Telegraf.docker_container_tags)
+
+        Containers are indexed by their name as mangled by Telegraf. It's
+        built on each service discovery from core.docker_containers_by_name.
+    """
+
+    def __init__(self, docker_containers_by_name):
+        # This works by:
+        # * Counting the number of element in the graphite line
+        # * Using Docker inspect, removing user-label
+        # * This allow to find the Telegraf version (since we known the number
+        #   of properties of any given version of Telegraf)
+        # * From there we have the name of properties & user labels, we can
+        #   revert the line.
+
+        # mangled container name => list of ContainerLayout
+        self._by_mangled_name = {}
+        # (order, base_properties_count, extra_properties) => sorted keys
+        self._keys_cache = {}
+
+        for (order, (name, inspect)) in enumerate(
+                docker_containers_by_name.items()):
+            labels = inspect.get('Config', {}).get('Labels', {})
+            if labels is None:
+                labels = {}
+
+            user_keys = tuple(
+                key for (key, value) in labels.items()
+                if value != ''
+            )
+            label_keys_before = [
+                key for key in user_keys
+                if key < "container_name"
+            ]
+
+            # Docker only allow "_", "." and "-" as special char in
+            # container_name. Of those, only "." is replaced by "_"
+            mangled_name = name.replace('.', '_')
+            self._by_mangled_name.setdefault(mangled_name, []).append(
+                ContainerLayout(
+                    order=order,
+                    name=name,
+                    user_keys=user_keys,
+                    position=3 + len(label_keys_before),
+                )
+            )
+
+    def _base_properties_count(self, layout, part, extra_properties):
+        # pylint: disable=no-self-use
+        # part always ends with 2 element which are the plugin name and
+        # the measurement name. Ignore both of them.
+        properties_count = len(part) - len(layout.user_keys) - 2
+        return properties_count - len(extra_properties)
+
+    def _sorted_keys(self, layout, base_properties_count, extra_properties):
+        cache_key = (
+            layout.order, base_properties_count, tuple(extra_properties),
         )
+        try:
+            return self._keys_cache[cache_key]
+        except KeyError:
+            pass
 
-    def _purge_metrics(self):
-        """ Remove old metrics from self._raw_value
+        properties = (
+            DOCKER_BASE_PROPERTIES[:base_properties_count] + extra_properties
+        )
+        # We don't care about host or prefix metrics
+        properties.remove("host")
+        properties.remove("prefix")
+        all_keys = properties + list(layout.user_keys)
+        all_keys.sort()
+        self._keys_cache[cache_key] = all_keys
+        return all_keys
+
+    def resolve(self, part, extra_properties):
+        """ Return a mapping of tags for the graphite metric name split
+            in part, or None if no container match
         """
-        now = time.time()
-        cutoff = now - 60 * 6
+        best = None
+        best_count = None
+        for position in range(3, len(part)):
+            for layout in self._by_mangled_name.get(part[position], ()):
+                if layout.position != position:
+                    continue
+                if best is not None and layout.order > best.order:
+                    continue
+                count = self._base_properties_count(
+                    layout, part, extra_properties,
+                )
+                if count < 5 or count > len(DOCKER_BASE_PROPERTIES):
+                    continue
+                best = layout
+                best_count = count
 
-        # XXX: concurrent access with emit_metric
-        self._raw_value = {
-            key: (timestamp, value)
-            for key, (timestamp, value) in self._raw_value.items()
-            if timestamp >= cutoff
-        }
+        if best is None:
+            return None
 
-    def get_derivate(self, name, item, timestamp, value):
-        """ Return derivate of a COUNTER (e.g. something that only goes upward)
-        """
-        (old_timestamp, old_value) = self._raw_value.get(
-            (name, item), (None, None)
+        result = {}
+        all_keys = self._sorted_keys(best, best_count, extra_properties)
+        for (index, key) in enumerate(all_keys):
+            result[key] = part[index + 2]  # +2 due to host and prefix
+        # use de-mangled name
+        result['container_name'] = best.name
+        return result
+
+
+def _emit_cpu_used(telegraf, _decoded, timestamp, value):
+    telegraf.core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='cpu_used',
+            time=timestamp,
+            value=100 - value,
         )
-        self._raw_value[(name, item)] = (timestamp, value)
-        if old_timestamp is None:
-            return None
+    )
 
-        delta = value - old_value
-        delta_time = timestamp - old_timestamp
 
-        if delta_time == 0:
-            return None
+def _emit_io_utilization(telegraf, decoded, timestamp, value):
+    telegraf.core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='io_utilization',
+            labels=decoded.labels,
+            time=timestamp,
+            # io_time is a number of ms spent doing IO(per seconds)
+            # utilization is 100% when we spent 1000ms during one
+            # second
+            value=value / 1000. * 100.,
+        )
+    )
 
-        if delta < 0:
-            return None
 
-        return delta / delta_time
+def _emit_io_time(telegraf, decoded, timestamp, value):
+    telegraf.core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='io_time',
+            labels=decoded.labels,
+            time=timestamp,
+            # io_time is a number of ms spent doing IO(per seconds)
+            # utilization is 100% when we spent 1000ms during one
+            # second
+            value=value * 1000. / 100.,
+        )
+    )
 
-    def _get_service_instance(self, service, address, port):
-        for (key, service_info) in self.core.services.items():
-            (service_name, instance) = key
-            if (service_name == service
-                    and service_info.get('address') == address
-                    and service_info.get('port') == port):
-                return instance
-            # RabbitMQ use mgmt port
-            if (service_name == service
-                    and service_name == 'rabbitmq'
-                    and service_info.get('address') == address
-                    and service_info.get('mgmt_port', 15672) == port):
-                return instance
-
-        raise KeyError('service not found')
 
-    def _get_haproxy_instance(self, hostport):
-        if ':' in hostport:
-            host, port = hostport.split(':')
-            port = int(port)
-        else:
-            host = hostport
-            port = None
+def _emit_win_mem_used(telegraf, _decoded, timestamp, value):
+    core = telegraf.core
+    core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='mem_available_perc',
+            time=timestamp,
+            value=value * 100. / core.total_memory_size,
+        )
+    )
+    mem_used = core.total_memory_size - value
+    core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='mem_used',
+            time=timestamp,
+            value=mem_used,
+        )
+    )
+    core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='mem_used_perc',
+            time=timestamp,
+            value=mem_used * 100. / core.total_memory_size,
+        )
+    )
 
-        for (key, service_info) in self.core.services.items():
-            (service_name, instance) = key
-            if service_name != 'haproxy':
-                continue
-            if 'stats_url' in service_info:
-                tmp = urllib_parse.urlparse(service_info['stats_url'])
-                if host == tmp.hostname and port == tmp.port:
-                    return instance
 
-        raise KeyError('service not found')
+def _emit_win_swap_used(telegraf, _decoded, timestamp, value):
+    core = telegraf.core
+    if value == 0:
+        swap_used = 0.0
+    else:
+        swap_used = core.total_swap_size / (value / 100.)
+    core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='swap_used',
+            time=timestamp,
+            value=swap_used,
+        )
+    )
+    core.emit_metric(
+        bleemeo_agent.type.MetricPoint(
+            label='swap_free',
+            time=timestamp,
+            value=core.total_swap_size - swap_used,
+        )
+    )
 
-    def _get_elasticsearch_instance(self, node_id):
-        for (key, service_info) in self.core.services.items():
-            (service_name, instance) = key
-            if service_name != 'elasticsearch':
-                continue
-            if not service_info.get('active', True):
-                continue
-            if service_info.get('address') is None:
-                continue
-            if service_info.get('port') is None:
-                continue
-            if 'es_node_id' not in service_info:
-                try:
-                    response = requests.get(
-                        'http://%(address)s:%(port)s/_nodes/_local/'
-                        % service_info,
-                        headers={'User-Agent': self.core.http_user_agent},
-                        timeout=10.0,
-                    )
-                    data = response.json()
-                    this_node_id = list(data['nodes'].keys())[0]
-                except (requests.RequestException, ValueError):
-                    logging.debug(
-                        'Error while fetching es_node_is', exc_info=True
-                    )
-                    continue
 
-                service_info['es_node_id'] = this_node_id
+MetricRule = collections.namedtuple('MetricRule', (
+    # Name of the emitted metric. None means the metric is dropped
+    'name',
+    'derive',
+    'no_emit',
+    'value_func',
+    # Names of computed metrics to mark as pending
+    'pending',
+    # Functions called with (telegraf, decoded, timestamp, value)
+    'extra_emits',
+))
+
+
+def _rule(name, derive=False, no_emit=False, value_func=None,
+          pending=(), extra_emits=()):
+    # pylint: disable=too-many-arguments
+    return MetricRule(
+        name, derive, no_emit, value_func, tuple(pending), tuple(extra_emits),
+    )
 
-            if service_info.get('es_node_id') == node_id:
-                return instance
 
-        raise KeyError('service not found')
+# Rule of metrics which are dropped
+DROP = _rule(None)
 
-    def get_prometheus_exporter_name(self, metric_name, part):
-        """ Return the config of the Prometheus exporter
+
+class _Decoding:
+    """ State of a metric name being decoded by a PluginDecoder
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, service):
+        self.service = service
+        self.instance = ''
+        self.labels = {}
+        # Set to False when the metric is dropped because of a condition
+        # that may change later (e.g. the service is not yet known)
+        self.cacheable = True
+
+    def build(self, rule, pending_item, pending_instance):
+        """ Return the DecodedMetric for given rule
         """
-        prometheus_configs = self.core.config['metric.prometheus']
-        for name, config in prometheus_configs.items():
-            url_mangled = telegraf_replace(config['url'])
-            if (metric_name.startswith('%s_' % name)
-                    and url_mangled in part):
-                return name
-        raise KeyError('prometheus config not found')
+        labels = self.labels
+        service = self.service
+        instance = self.instance
 
-    def docker_container_tags(self, part, extra_properties=None):
-        # pylint: disable=too-many-locals
-        """ Return a mapping of metrics tag from Telegraf
+        if 'item' not in labels and service and instance:
+            labels['item'] = instance
 
-            For docker container, Telegraf mix a fixed list of properties
-            with user tags. This list is a list of key-value but when wrote on
-            graphite it result in a list of value separated by "."
+        if service is None:
+            service = ''
+            instance = ''
 
-            For example:
+        return DecodedMetric(
+            label=rule.name,
+            labels=bleemeo_agent.type.intern_labels(labels),
+            service=service,
+            instance=instance,
+            container_name='',
+            derive=rule.derive,
+            no_emit=rule.no_emit,
+            value_func=rule.value_func,
+            pending=tuple(
+                (name, pending_item, pending_instance)
+                for name in rule.pending
+            ),
+            extra_emits=rule.extra_emits,
+        )
 
-            prefix=telegraf,host=xenial,a_custom_label=my_value,
-                container_image=redis,container_name=my_redis,
-                container_status=running,container_version=unknown,
-                engine_host=xenial
 
-            Result in:
+class PluginDecoder:
+    """ Convert metrics of one Telegraf plugin to Bleemeo metrics
 
-            telegraf.xenial.my_value.redis.my_redis.running.unkonwn.xenial
+        The conversion is described by class attributes:
 
-            This method transform the graphite line in a mapping.
+        * service: name of the service the plugin monitor, if any
+        * prefix: added to the Telegraf metric name to get the key of rules
+        * rules: map a prefixed metric name to a MetricRule
+        * unknown_rule: MetricRule (without name) used for prefixed metric
+          name absent from rules. If None, such metrics are dropped.
+
+        Subclasses override resolve() to find labels and service instance
+        from Telegraf tags and default_rule() when metrics absent from rules
+        need more than unknown_rule.
+    """
+    service = None
+    prefix = ''
+    rules = {}
+    unknown_rule = None
+
+    def match(self, part):
+        # pylint: disable=no-self-use,unused-argument
+        """ Return False if metric is not for this decoder after all
         """
-        # This method works by:
-        # * Counting the number of element in the graphite line
-        # * Using Docker inspect, removing user-label
-        # * This allow to find the Telegraf version (since we known the number
-        #   of properties of any given version of Telegraf)
-        # * From there we have the name of properties & user labels, we can
-        #   revert the line.
+        return True
 
-        if extra_properties is None:
-            extra_properties = []
+    def resolve(self, telegraf, part, decoding):
+        # pylint: disable=no-self-use,unused-argument
+        """ Fill decoding from part. Return False to drop the metric
+        """
+        return True
 
-        for name, inspect in self.core.docker_containers_by_name.items():
-            labels = inspect.get('Config', {}).get('Labels', {})
-            if labels is None:
-                labels = {}
+    def metric_name(self, part):
+        return self.prefix + part['metric_name']
 
-            user_keys = [
-                key for (key, value) in labels.items()
-                if value != ''
-            ]
+    def default_rule(self, name):
+        if self.unknown_rule is None:
+            return None
+        return self.unknown_rule._replace(name=name)
 
-            # part always ends with 2 element which are the plugin name and
-            # the measurement name. Ignore both of them.
-            properties_count = len(part) - len(user_keys) - 2
-            base_properties_count = properties_count - len(extra_properties)
-
-            base_properties = [
-                # Added in Telegraf <1.1.0
-                "prefix",
-                "host",
-                "container_image",
-                "container_name",
-                "container_version",
-                # Added in Telegraf 1.1.0
-                "engine_host",
-                # Added in Telegraf 1.7.0
-                "server_version",
-                # Added in Telegraf 1.8.0
-                "container_status",
-            ]
+    def pending_key(self, decoding):
+        # pylint: disable=no-self-use,unused-argument
+        """ Return (item, instance) of computed metrics marked as pending
+        """
+        return ('', '')
 
-            if base_properties_count < 5:
-                continue
-            if base_properties_count > len(base_properties):
-                continue
+    def decode(self, telegraf, part):
+        """ Return the DecodedMetric for part, None if the metric is dropped
+            or NOT_CACHEABLE
+        """
+        decoding = _Decoding(self.service)
+        if not self.resolve(telegraf, part, decoding):
+            if decoding.cacheable:
+                return None
+            return NOT_CACHEABLE
+
+        name = self.metric_name(part)
+        rule = self.rules.get(name)
+        if rule is None:
+            rule = self.default_rule(name)
+        if rule is None or rule.name is None:
+            return None
 
-            properties = (
-                base_properties[:base_properties_count] + extra_properties
-            )
+        (pending_item, pending_instance) = self.pending_key(decoding)
+        return decoding.build(rule, pending_item, pending_instance)
 
-            label_keys_before = [
-                key for (key, value) in labels.items()
-                if key < "container_name" and value != ''
-            ]
-            position = 3 + len(label_keys_before)
 
-            # Docker only allow "_", "." and "-" as special char in
-            # container_name. Of those, only "." is replaced by "_"
-            tmp = name.replace('.', '_')
+class ServiceDecoder(PluginDecoder):
+    """ Decoder for a plugin monitoring a service found by its address
+        and port
+    """
 
-            if len(part) <= position or part[position] != tmp:
-                continue
+    def server_address(self, part):
+        """ Return (address, port) of the monitored service, or None
+        """
+        raise NotImplementedError()
 
-            result = {}
-            # We don't care about host or prefix metrics
-            properties.remove("host")
-            properties.remove("prefix")
-            all_keys = properties + user_keys
-            all_keys.sort()
-            for (index, key) in enumerate(all_keys):
-                result[key] = part[index + 2]  # +2 due to host and prefix
-                if key == 'container_name':
-                    # use de-mangled name
-                    result[key] = name
-            return result
+    def resolve(self, telegraf, part, decoding):
+        address_port = self.server_address(part)
+        if address_port is None:
+            return False
+        (server_address, server_port) = address_port
+        try:
+            # pylint: disable=protected-access
+            decoding.instance = telegraf._get_service_instance(
+                self.service, server_address, server_port
+            )
+        except KeyError:
+            return False
+        return True
 
-        return None
+    def pending_key(self, decoding):
+        return (decoding.instance, decoding.instance)
 
-    def _telegraf_compatibility(self, name):
-        # pylint: disable=too-many-branches
-        # pylint: disable=too-many-statements
-        """ Parse old telegraf format without graphite_tag_support
-        """
-        if self.last_depecated_telgraf_warning < time.time() - 900:
-            self.last_depecated_telgraf_warning = time.time()
-            installation_format = self.core.last_facts.get(
-                'installation_format', ''
-            )
-            if 'Package' in installation_format:
-                logging.warning(
-                    'Telegraf configuration is using depreacted option.'
-                    ' Please upgrade package "telegraf" '
-                    'and "bleemeo-agent-telegraf".'
-                )
-            else:
-                logging.warning(
-                    'Telegraf configuration is using depreacted option.'
-                    ' Please upgrade Telegraf and its configuration.'
-                )
-            logging.warning(
-                'See https://docs.bleemeo.com/agent/upgrade-agent/'
-            )
-        # name looks like
-        # telegraf.HOSTNAME.(ITEM_INFO)*.PLUGIN.METRIC
-        # example:
-        # telegraf.xps-pierref.ext4./home.disk.total
-        # telegraf.xps-pierref.mem.used
-        # telegraf.xps-pierref.cpu-total.cpu.usage_steal
-        part = name.split('.')
-        part_dict = {
-            'telegraf_plugin': part[-2],
-            'metric_name': part[-1],
-        }
 
-        if part[-2] == 'cpu':
+class ServerPortDecoder(ServiceDecoder):
+    """ Service address is in tags "server" and "port"
+    """
+
+    def server_address(self, part):
+        return (part['server'].replace('_', '.'), int(part['port']))
+
+
+class HostPortDecoder(ServiceDecoder):
+    """ Service address is in one tag, as "address:port"
+    """
+    address_tag = 'server'
+
+    def server_address(self, part):
+        (server_address, server_port) = part[self.address_tag].split(':')
+        return (server_address.replace('_', '.'), int(server_port))
+
+
+class CpuDecoder(PluginDecoder):
+    rules = {
+        'cpu_idle': _rule('cpu_idle', extra_emits=[_emit_cpu_used]),
+        'cpu_irq': _rule('cpu_interrupt'),
+        'cpu_iowait': _rule('cpu_wait'),
+        'cpu_used': _rule('cpu_used', pending=['cpu_other']),
+        'cpu_user': _rule('cpu_user', pending=['cpu_other']),
+        'cpu_system': _rule('cpu_system', pending=['cpu_other']),
+    }
+    unknown_rule = _rule(None)
+
+    def resolve(self, telegraf, part, decoding):
+        return part['cpu'] == 'cpu-total'
+
+    def metric_name(self, part):
+        return part['metric_name'].replace('usage_', 'cpu_')
+
+
+class WinCpuDecoder(PluginDecoder):
+    rules = {
+        'Percent_Idle_Time': _rule(
+            'cpu_idle',
+            pending=['system_load1'],
+            extra_emits=[_emit_cpu_used],
+        ),
+        'Percent_Interrupt_Time': _rule('cpu_interrupt'),
+        'Percent_User_Time': _rule('cpu_user', pending=['cpu_other']),
+        'Percent_Privileged_Time': _rule('cpu_system', pending=['cpu_other']),
+        'Percent_DPC_Time': _rule('cpu_softirq'),
+    }
+
+    def resolve(self, telegraf, part, decoding):
+        return part['instance'] == '_Total'
+
+
+class DiskDecoder(PluginDecoder):
+    prefix = 'disk_'
+    rules = {
+        'disk_used_percent': _rule('disk_used_perc'),
+    }
+    unknown_rule = _rule(None)
+
+    def resolve(self, telegraf, part, decoding):
+        # Ignore fstype=rootfs. mountpoint for / is duplicated (at least on
+        # old Linux - like wheezy). One time as fstype=rootfs and one time
+        # with correct fstype.
+        if part['fstype'] == 'rootfs':
+            return False
+        decoding.labels['fstype'] = part['fstype']
+        path = part['path'].replace('-', '/')
+        path = telegraf.graphite_server.disk_path_rename(path)
+        if path is None:
+            return False
+        decoding.labels['item'] = path
+        return True
+
+
+class WinDiskDecoder(PluginDecoder):
+    rules = {
+        'Percent_Free_Space': _rule(
+            'disk_used_perc',
+            value_func=_percent_complement,
+            # when disk_total is processed, disk_used is also emitted
+            pending=['disk_total'],
+        ),
+        'Free_Megabytes': _rule(
+            'disk_free',
+            value_func=_megabytes_to_bytes,
+            pending=['disk_total'],
+        ),
+    }
+
+    def resolve(self, telegraf, part, decoding):
+        item = part['instance']
+        decoding.labels['item'] = item
+        if item == '_Total':
+            return False
+
+        # For Windows, assimilate disk (which are also named "C:", "D:"...
+        # and (mounted) partition like C:
+        return not telegraf.graphite_server.ignored_disk(item)
+
+    def pending_key(self, decoding):
+        return (decoding.labels['item'], None)
+
+
+class DiskioDecoder(PluginDecoder):
+    rules = {
+        'io_weighted_io_time': DROP,
+        'io_iops_in_progress': _rule('io_in_progress'),
+        'io_time': _rule(
+            'io_time', derive=True, extra_emits=[_emit_io_utilization],
+        ),
+    }
+    unknown_rule = _rule(None, derive=True)
+
+    def resolve(self, telegraf, part, decoding):
+        decoding.labels['item'] = part['_name']
+        return not telegraf.graphite_server.ignored_disk(part['_name'])
+
+    def metric_name(self, part):
+        name = part['metric_name']
+        if not name.startswith('io_'):
+            name = 'io_' + name
+        return name
+
+
+class WinDiskioDecoder(PluginDecoder):
+    rules = {
+        'Disk_Read_Bytes_persec': _rule('io_read_bytes'),
+        'Disk_Write_Bytes_persec': _rule('io_write_bytes'),
+        'Current_Disk_Queue_Length': _rule('io_in_progress'),
+        'Disk_Reads_persec': _rule('io_reads'),
+        'Disk_Writes_persec': _rule('io_writes'),
+        'Percent_Idle_Time': _rule(
+            'io_utilization',
+            value_func=_percent_complement,
+            extra_emits=[_emit_io_time],
+        ),
+    }
+
+    def resolve(self, telegraf, part, decoding):
+        item = part['instance']
+        if item == '_Total':
+            return False
+
+        # Item looks like "0_C:", "1_D:" or "0_C:_D:" (multiple partition
+        # on one disk). Remove the number_ from item and take the smaller
+        # letter.
+        if '_' in item:
+            item_part = item.split('_')
+            number = item_part[0]
+            try:
+                int(number)
+                item = sorted(item_part[1:])[0]
+            except ValueError:
+                pass
+
+        decoding.labels['item'] = item
+        return not telegraf.graphite_server.ignored_disk(item)
+
+
+class MemDecoder(PluginDecoder):
+    prefix = 'mem_'
+    rules = {
+        # We don't use mem_used of telegraf (which is mem_total - mem_free)
+        # We prefere the "collectd one" (which is
+        # mem_total - (mem_free + mem_cached + mem_buffered + mem_slab)
+        # mem_used will be computed as mem_total - mem_available
+        'mem_used': DROP,
+        'mem_used_percent': DROP,
+        'mem_available_percent': _rule('mem_available_perc'),
+        'mem_buffered': _rule('mem_buffered'),
+        'mem_cached': _rule('mem_cached'),
+        'mem_free': _rule('mem_free'),
+        'mem_total': _rule('mem_total', pending=['mem_used']),
+        'mem_available': _rule('mem_available', pending=['mem_used']),
+    }
+
+
+class WinMemDecoder(PluginDecoder):
+    rules = {
+        'Available_Bytes': _rule(
+            'mem_available',
+            pending=['mem_free'],
+            extra_emits=[_emit_win_mem_used],
+        ),
+        'Standby_Cache_Reserve_Bytes': _rule(
+            'Standby_Cache_Reserve_Bytes',
+            no_emit=True,
+            pending=['mem_cached'],
+        ),
+        'Standby_Cache_Normal_Priority_Bytes': _rule(
+            'Standby_Cache_Normal_Priority_Bytes',
+            no_emit=True,
+            pending=['mem_cached'],
+        ),
+        'Standby_Cache_Core_Bytes': _rule(
+            'Standby_Cache_Core_Bytes',
+            no_emit=True,
+            pending=['mem_cached'],
+        ),
+    }
+
+
+class NetDecoder(PluginDecoder):
+    prefix = 'net_'
+    rules = {
+        'net_bytes_recv': _rule(
+            'net_bits_recv', derive=True, value_func=_bytes_to_bits,
+        ),
+        'net_bytes_sent': _rule(
+            'net_bits_sent', derive=True, value_func=_bytes_to_bits,
+        ),
+    }
+    unknown_rule = _rule(None, derive=True)
+
+    def match(self, part):
+        # interface "all" contains network protocol stats (tcp_*, udp_*...)
+        return part['interface'] != 'all'
+
+    def resolve(self, telegraf, part, decoding):
+        interface = part['interface']
+        if telegraf.graphite_server.network_interface_blacklist(interface):
+            return False
+        decoding.labels['item'] = interface
+        return True
+
+
+class WinNetDecoder(PluginDecoder):
+    rules = {
+        'Bytes_Sent_persec': _rule(
+            'net_bits_sent', value_func=_bytes_to_bits,
+        ),
+        'Bytes_Received_persec': _rule(
+            'net_bits_recv', value_func=_bytes_to_bits,
+        ),
+        'Packets_Sent_persec': _rule('net_packets_sent'),
+        'Packets_Received_persec': _rule('net_packets_recv'),
+        'Packets_Received_Discarded': _rule('net_drop_in', derive=True),
+        'Packets_Outbound_Discarded': _rule('net_drop_out', derive=True),
+        'Packets_Received_Errors': _rule('net_err_in', derive=True),
+        'Packets_Outbound_Errors': _rule('net_err_out', derive=True),
+    }
+
+    def resolve(self, telegraf, part, decoding):
+        item = part['instance']
+        if telegraf.graphite_server.network_interface_blacklist(item):
+            return False
+        decoding.labels['item'] = item
+        return True
+
+
+class SwapDecoder(PluginDecoder):
+    rules = {
+        'swap_in': _rule('swap_in', derive=True),
+        'swap_out': _rule('swap_out', derive=True),
+    }
+    unknown_rule = _rule(None)
+
+    def resolve(self, telegraf, part, decoding):
+        return telegraf.core.last_facts.get('swap_present', False)
+
+    def metric_name(self, part):
+        name = 'swap_' + part['metric_name']
+        if name.endswith('_percent'):
+            name = name.replace('_percent', '_perc')
+        return name
+
+
+class WinSwapDecoder(PluginDecoder):
+    rules = {
+        'Percent_Usage': _rule(
+            'swap_used_perc', extra_emits=[_emit_win_swap_used],
+        ),
+    }
+    unknown_rule = _rule(None)
+
+    def resolve(self, telegraf, part, decoding):
+        return telegraf.core.last_facts.get('swap_present', False)
+
+
+class SystemDecoder(PluginDecoder):
+    prefix = 'system_'
+    rules = {
+        'system_uptime': _rule('uptime'),
+        'system_n_users': _rule('users_logged'),
+        'system_load1': _rule('system_load1'),
+        'system_load5': _rule('system_load5'),
+        'system_load15': _rule('system_load15'),
+    }
+
+
+class WinSystemDecoder(PluginDecoder):
+    rules = {
+        'System_Up_Time': _rule('uptime'),
+        'Processor_Queue_Length': _rule(
+            'Processor_Queue_Length',
+            no_emit=True,
+            pending=['system_load1'],
+        ),
+    }
+
+
+class ProcessesDecoder(PluginDecoder):
+    rules = {
+        'blocked': _rule('process_status_blocked'),
+        'running': _rule('process_status_running'),
+        'sleeping': _rule('process_status_sleeping'),
+        'stopped': _rule('process_status_stopped'),
+        'zombies': _rule('process_status_zombies'),
+        'paging': _rule('process_status_paging'),
+        'total': _rule('process_total'),
+    }
+
+
+class ApacheDecoder(ServerPortDecoder):
+    service = 'apache'
+    prefix = 'apache_'
+    rules = {
+        'apache_IdleWorkers': _rule('apache_idle_workers'),
+        'apache_TotalAccesses': _rule('apache_requests', derive=True),
+        'apache_TotalkBytes': _rule('apache_bytes', derive=True),
+        'apache_ConnsTotal': _rule('apache_connections'),
+        'apache_Uptime': _rule('apache_uptime'),
+    }
+
+    def default_rule(self, name):
+        if 'scboard' not in name:
+            return None
+        name = name.replace('scboard', 'scoreboard')
+        if name.startswith('apache_scoreboard_'):
+            return _rule(name, pending=['apache_max_workers'])
+        return _rule(name)
+
+
+class HaproxyDecoder(PluginDecoder):
+    service = 'haproxy'
+    prefix = 'haproxy_'
+    rules = dict(
+        [
+            (name, _rule(name, derive=True))
+            for name in (
+                'haproxy_stot', 'haproxy_bin', 'haproxy_bout',
+                'haproxy_dreq', 'haproxy_dresp', 'haproxy_ereq',
+                'haproxy_econ', 'haproxy_eresp', 'haproxy_req_tot',
+            )
+        ] + [
+            (name, _rule(name))
+            for name in (
+                'haproxy_qcur', 'haproxy_scur', 'haproxy_qtime',
+                'haproxy_ctime', 'haproxy_rtime', 'haproxy_ttime',
+            )
+        ] + [
+            ('haproxy_active_servers', _rule('haproxy_act')),
+        ]
+    )
+
+    def resolve(self, telegraf, part, decoding):
+        proxy_name = part['proxy']
+        if part['sv'] not in ('BACKEND', 'FRONTEND'):
+            return False
+        hostport = part['server'].replace('_', '.')
+        try:
+            # pylint: disable=protected-access
+            instance = telegraf._get_haproxy_instance(hostport)
+        except KeyError:
+            return False
+
+        decoding.instance = instance
+        if not instance:
+            decoding.labels['item'] = proxy_name
+        else:
+            decoding.labels['item'] = instance + '_' + proxy_name
+        return True
+
+
+class MemcachedDecoder(HostPortDecoder):
+    service = 'memcached'
+    prefix = 'memcached_'
+    rules = {
+        'memcached_curr_connections': _rule('memcached_connections_current'),
+        'memcached_curr_items': _rule('memcached_items_current'),
+        'memcached_bytes_read': _rule('memcached_octets_rx', derive=True),
+        'memcached_bytes_written': _rule('memcached_octets_tx', derive=True),
+        'memcached_evictions': _rule('memcached_ops_evictions', derive=True),
+        'memcached_threads': _rule('memcached_ps_count_threads'),
+        'memcached_get_misses': _rule('memcached_ops_misses', derive=True),
+        'memcached_get_hits': _rule('memcached_ops_hits', derive=True),
+        'memcached_uptime': _rule('memcached_uptime'),
+    }
+
+    def default_rule(self, name):
+        if '_cmd_' in name:
+            return _rule(name.replace('_cmd_', '_command_'), derive=True)
+        if name.endswith('_misses') or name.endswith('_hits'):
+            return _rule(
+                name.replace('memcached_', 'memcached_ops_'), derive=True,
+            )
+        return None
+
+
+class MysqlDecoder(HostPortDecoder):
+    service = 'mysql'
+    rules = {
+        'mysql_qcache_lowmem_prunes': _rule(
+            'mysql_cache_result_qcache_prunes', derive=True,
+        ),
+        'mysql_qcache_queries_in_cache': _rule('mysql_cache_size_qcache'),
+        'mysql_qcache_total_blocks': _rule('mysql_cache_blocksize_qcache'),
+        'mysql_qcache_free_blocks': _rule('mysql_cache_free_blocks'),
+        'mysql_qcache_free_memory': _rule('mysql_cache_free_memory'),
+        'mysql_bytes_received': _rule('mysql_octets_rx', derive=True),
+        'mysql_bytes_sent': _rule('mysql_octets_tx', derive=True),
+        'mysql_threads_created': _rule(
+            'mysql_total_threads_created', derive=True,
+        ),
+        'mysql_queries': _rule('mysql_queries', derive=True),
+        'mysql_slow_queries': _rule('mysql_slow_queries', derive=True),
+        'mysql_innodb_row_lock_current_waits': _rule(
+            'mysql_innodb_locked_transaction',
+        ),
+        'mysql_innodb_trx_rseg_history_len': _rule(
+            'mysql_innodb_history_list_len',
+        ),
+    }
+
+    def metric_name(self, part):
+        # Used for both mysql and mysql_innodb plugins
+        return part['telegraf_plugin'] + '_' + part['metric_name']
+
+    def default_rule(self, name):
+        if name.startswith('mysql_qcache_'):
+            return _rule(
+                name.replace('qcache', 'cache_result_qcache'), derive=True,
+            )
+        if name.startswith('mysql_table_locks_'):
+            return _rule(
+                name.replace('mysql_table_locks_', 'mysql_locks_'),
+                derive=True,
+            )
+        if name.startswith('mysql_threads_'):
+            # Other mysql_threads_* name are fine. Accept them unchanged
+            return _rule(name)
+        if (name.startswith('mysql_commands_')
+                or name.startswith('mysql_handler_')):
+            # mysql_commands_* and mysql_handler_* name are fine. Accept
+            # them unchanged
+            return _rule(name, derive=True)
+        return None
+
+
+class NginxDecoder(ServerPortDecoder):
+    service = 'nginx'
+    prefix = 'nginx_connections_'
+    rules = {
+        'nginx_connections_requests': _rule('nginx_requests', derive=True),
+        'nginx_connections_accepts': _rule(
+            'nginx_connections_accepted', derive=True,
+        ),
+        'nginx_connections_handled': _rule(
+            'nginx_connections_handled', derive=True,
+        ),
+    }
+    unknown_rule = _rule(None)
+
+
+class PostgresqlDecoder(ServiceDecoder):
+    service = 'postgresql'
+    prefix = 'postgresql_'
+    rules = dict(
+        [
+            (
+                'postgresql_xact_commit',
+                _rule('postgresql_commit', derive=True),
+            ),
+            (
+                'postgresql_xact_rollback',
+                _rule('postgresql_rollback', derive=True),
+            ),
+        ] + [
+            ('postgresql_' + name, _rule('postgresql_' + name, derive=True))
+            for name in (
+                'blks_read', 'blks_hit', 'tup_returned', 'tup_fetched',
+                'tup_inserted', 'tup_updated', 'tup_deleted', 'temp_files',
+                'temp_bytes', 'blk_read_time', 'blk_write_time',
+            )
+        ]
+    )
+
+    def server_address(self, part):
+        # connect string look like:
+        # "host=172_17_0_4_port=5432_user=bleemeo_user_dbname=postgres"
+        match = re.match(
+            r'^host=(.*)_port=(.*)_user=.*$',
+            part['server'],
+        )
+        if not match:
+            return None
+        return (match.group(1).replace('_', '.'), int(match.group(2)))
+
+    def resolve(self, telegraf, part, decoding):
+        dbname = part['db']
+        if dbname in ('template0', 'template1'):
+            return False
+
+        if not super().resolve(telegraf, part, decoding):
+            return False
+
+        if not decoding.instance:
+            decoding.labels['item'] = dbname
+        else:
+            decoding.labels['item'] = decoding.instance + '_' + dbname
+            decoding.labels['dbname'] = dbname
+        return True
+
+
+class RedisDecoder(ServerPortDecoder):
+    service = 'redis'
+    prefix = 'redis_'
+    rules = {
+        'redis_clients': _rule('redis_current_connections_clients'),
+        'redis_connected_slaves': _rule('redis_current_connections_slaves'),
+        'redis_total_connections_received': _rule(
+            'redis_total_connections', derive=True,
+        ),
+        'redis_total_commands_processed': _rule(
+            'redis_total_operations', derive=True,
+        ),
+        'redis_rdb_changes_since_last_save': _rule('redis_volatile_changes'),
+        'redis_evicted_keys': _rule('redis_evicted_keys', derive=True),
+        'redis_keyspace_hits': _rule('redis_keyspace_hits', derive=True),
+        'redis_keyspace_misses': _rule('redis_keyspace_misses', derive=True),
+        'redis_expired_keys': _rule('redis_expired_keys', derive=True),
+        'redis_uptime': _rule('redis_uptime'),
+        'redis_pubsub_patterns': _rule('redis_pubsub_patterns'),
+        'redis_pubsub_channels': _rule('redis_pubsub_channels'),
+        'redis_keyspace_hitrate': _rule('redis_keyspace_hitrate'),
+    }
+
+    def default_rule(self, name):
+        if name.startswith('redis_used_memory'):
+            return _rule(name.replace('redis_used_memory', 'redis_memory'))
+        return None
+
+
+class ZookeeperDecoder(ServerPortDecoder):
+    service = 'zookeeper'
+    prefix = 'zookeeper_'
+    rules = {
+        'zookeeper_ephemerals_count': _rule('zookeeper_ephemerals_count'),
+        'zookeeper_watch_count': _rule('zookeeper_watch_count'),
+        'zookeeper_znode_count': _rule('zookeeper_znode_count'),
+        'zookeeper_num_alive_connections': _rule('zookeeper_connections'),
+    }
+
+    def default_rule(self, name):
+        if name.startswith('zookeeper_packets_'):
+            return _rule(name, derive=True)
+        return None
+
+
+class MongodbDecoder(HostPortDecoder):
+    service = 'mongodb'
+    prefix = 'mongodb_'
+    address_tag = 'hostname'
+    rules = {
+        'mongodb_open_connections': _rule('mongodb_open_connections'),
+        'mongodb_queued_reads': _rule('mongodb_queued_reads'),
+        'mongodb_queued_writes': _rule('mongodb_queued_writes'),
+        'mongodb_active_reads': _rule('mongodb_active_reads'),
+        'mongodb_active_writes': _rule('mongodb_active_writes'),
+        'mongodb_queries_per_sec': _rule('mongodb_queries'),
+        'mongodb_net_out_bytes': _rule('mongodb_net_out_bytes', derive=True),
+        'mongodb_net_in_bytes': _rule('mongodb_net_in_bytes', derive=True),
+    }
+
+
+class ElasticsearchDecoder(PluginDecoder):
+    """ Decoder for elasticsearch_* plugins. Without rules, it's used for
+        plugins whose metrics are all dropped.
+    """
+    service = 'elasticsearch'
+
+    def resolve(self, telegraf, part, decoding):
+        # It can't rely only on part['node_host'], because this is the
+        # host as think by ES (usually the "public" IP of the node). But
+        # Agent use "127.0.0.1" for localhost.
+        try:
+            # pylint: disable=protected-access
+            decoding.instance = telegraf._get_elasticsearch_instance(
+                part['node_id']
+            )
+        except KeyError:
+            # The node ID may not yet be known, retry on next point.
+            decoding.cacheable = False
+            return False
+        return True
+
+    def pending_key(self, decoding):
+        return (decoding.instance, decoding.instance)
+
+
+class ElasticsearchIndicesDecoder(ElasticsearchDecoder):
+    rules = {
+        'docs_count': _rule('elasticsearch_docs_count'),
+        'store_size_in_bytes': _rule('elasticsearch_size'),
+        'search_query_total': _rule(
+            'elasticsearch_search',
+            derive=True,
+            pending=['elasticsearch_search_time'],
+        ),
+        'search_query_time_in_millis': _rule(
+            'elasticsearch_search_time_total',
+            derive=True,
+            no_emit=True,
+            pending=['elasticsearch_search_time'],
+        ),
+    }
+
+
+class ElasticsearchJvmDecoder(ElasticsearchDecoder):
+    rules = {
+        'mem_heap_used_in_bytes': _rule('elasticsearch_jvm_heap_used'),
+        'mem_non_heap_used_in_bytes': _rule(
+            'elasticsearch_jvm_non_heap_used',
+        ),
+        'gc_collectors_old_collection_count': _rule(
+            'elasticsearch_jvm_gc_old',
+            derive=True,
+            no_emit=True,
+            pending=['elasticsearch_jvm_gc'],
+        ),
+        'gc_collectors_young_collection_count': _rule(
+            'elasticsearch_jvm_gc_young',
+            derive=True,
+            no_emit=True,
+            pending=['elasticsearch_jvm_gc'],
+        ),
+        'gc_collectors_old_collection_time_in_millis': _rule(
+            'elasticsearch_jvm_gc_time_old',
+            derive=True,
+            no_emit=True,
+            pending=['elasticsearch_jvm_gc_time'],
+        ),
+        'gc_collectors_young_collection_time_in_millis': _rule(
+            'elasticsearch_jvm_gc_time_young',
+            derive=True,
+            no_emit=True,
+            pending=['elasticsearch_jvm_gc_time'],
+        ),
+    }
+
+
+class RabbitmqOverviewDecoder(ServiceDecoder):
+    service = 'rabbitmq'
+    rules = {
+        'messages': _rule('rabbitmq_messages_count'),
+        'consumers': _rule('rabbitmq_consumers'),
+        'connections': _rule('rabbitmq_connections'),
+        'queues': _rule('rabbitmq_queues'),
+        'messages_published': _rule(
+            'rabbitmq_messages_published', derive=True,
+        ),
+        'messages_delivered': _rule(
+            'rabbitmq_messages_delivered', derive=True,
+        ),
+        'messages_acked': _rule('rabbitmq_messages_acked', derive=True),
+        'messages_unacked': _rule('rabbitmq_messages_unacked_count'),
+    }
+
+    def server_address(self, part):
+        tmp = part['url']
+        if not tmp.startswith('http:--'):
+            return None  # unknown format
+        tmp = tmp[len('http:--'):]
+        (server_address, server_port) = tmp.split(':')
+        return (server_address.replace('_', '.'), int(server_port))
+
+
+class DockerDecoder(PluginDecoder):
+    rules = {
+        'n_containers': _rule('docker_containers'),
+    }
+
+
+class DockerContainerDecoder(PluginDecoder):
+    """ Decoder for docker_container_* plugins
+
+        total_tag is the tag which must be "total" (aggregated value for all
+        CPU, network interface or device)
+    """
+    total_tag = None
+    total_value = 'total'
+
+    def resolve(self, telegraf, part, decoding):
+        item = part['container_name']
+        decoding.labels['item'] = item
+        if item not in telegraf.core.docker_containers_by_name:
+            return False
+        if self.total_tag is None:
+            return True
+        return part.get(self.total_tag) == self.total_value
+
+
+class DockerContainerCpuDecoder(DockerContainerDecoder):
+    total_tag = 'cpu'
+    total_value = 'cpu-total'
+    rules = {
+        # Docker sends time in nanosecond. Convert it to seconds
+        # and return a percentage
+        'usage_total': _rule(
+            'docker_container_cpu_used',
+            derive=True,
+            value_func=_nanoseconds_to_percent,
+        ),
+    }
+
+
+class DockerContainerMemDecoder(DockerContainerDecoder):
+    rules = {
+        'usage_percent': _rule('docker_container_mem_used_perc'),
+        'usage': _rule('docker_container_mem_used'),
+    }
+
+
+class DockerContainerNetDecoder(DockerContainerDecoder):
+    total_tag = 'network'
+    rules = {
+        'rx_bytes': _rule(
+            'docker_container_net_bits_recv',
+            derive=True,
+            value_func=_bytes_to_bits,
+        ),
+        'tx_bytes': _rule(
+            'docker_container_net_bits_sent',
+            derive=True,
+            value_func=_bytes_to_bits,
+        ),
+    }
+
+
+class DockerContainerBlkioDecoder(DockerContainerDecoder):
+    total_tag = 'device'
+    rules = {
+        'io_service_bytes_recursive_read': _rule(
+            'docker_container_io_read_bytes', derive=True,
+        ),
+        'io_service_bytes_recursive_write': _rule(
+            'docker_container_io_write_bytes', derive=True,
+        ),
+    }
+
+
+class PrometheusDecoder(PluginDecoder):
+    """ Decoder for prometheus_* plugins. The plugin name contains the
+        metric name and metric_name contains the Prometheus type.
+    """
+
+    def decode(self, telegraf, part):
+        name = part['telegraf_plugin'][len('prometheus_'):]
+        decoding = _Decoding(self.service)
+        labels = decoding.labels
+
+        item_part = []
+        for (k, v) in sorted(part.items()):  # pylint: disable=invalid-name
+            if k in ['telegraf_plugin', 'metric_name', 'url', 'host']:
+                continue
+            if not v:
+                continue
+            item_part.append(v)
+            labels[k] = v
+        if item_part:
+            labels['item'] = '-'.join(item_part)
+
+        metric_type = part['metric_name']
+        if metric_type == 'counter':
+            if name.endswith('_total'):
+                # Agent don't send a total, but a derivate.
+                name = name[:-len('_total')]
+            rule = _rule(name, derive=True)
+        elif metric_type == 'gauge':
+            rule = _rule(name)
+        elif metric_type in ('sum', 'count'):
+            rule = _rule(
+                name + '_' + metric_type,
+                derive=True,
+                no_emit=True,
+                pending=['prometheus_' + name],
+            )
+        elif metric_type in ('5', '0', '1'):
+            # This is used by quantile and histogram. (0 is in
+            # fact 0.1, 0.25...)
+            # Agent don't process them on use only sum and count.
+            return None
+        else:
+            logging.debug(
+                'Unknown Prometheus metric: %s_%s',
+                name,
+                metric_type,
+            )
+            return None
+
+        return decoding.build(rule, labels.get('item', ''), None)
+
+
+class PhpfpmDecoder(PluginDecoder):
+    service = 'phpfpm'
+    prefix = 'phpfpm_'
+    rules = {
+        'phpfpm_accepted_conn': _rule('phpfpm_accepted_conn', derive=True),
+        'phpfpm_slow_requests': _rule('phpfpm_slow_requests', derive=True),
+    }
+    unknown_rule = _rule(None)
+
+    def resolve(self, telegraf, part, decoding):
+        if ('instance' in part
+                and ('phpfpm', part['instance']) in telegraf.core.services):
+            decoding.instance = part['instance']
+        return True
+
+
+class StatsdDecoder(PluginDecoder):
+    """ Decoder for statsd metrics. They don't have a plugin name, the
+        telegraf_plugin is the statsd metric name.
+    """
+
+    def decode(self, telegraf, part):
+        metric_type = part.get('metric_type', '')
+        if metric_type not in ('counter', 'gauge', 'set', 'timing'):
+            return None
+        if not telegraf.core.config['telegraf.statsd.enabled']:
+            return None
+        name = 'statsd_' + part['telegraf_plugin']
+        if metric_type == 'counter':
+            rule = _rule(name, derive=True)
+        elif metric_type == 'timing':
+            name = name + '_' + part['metric_name']
+            if part['metric_name'] == 'count':
+                # count for timing are number of item per 10 seconds.
+                # We want a count per second.
+                rule = _rule(name, value_func=_per_10_seconds_to_per_second)
+            else:
+                rule = _rule(name)
+        else:
+            # gauge and set
+            rule = _rule(name)
+        return _Decoding(self.service).build(rule, '', '')
+
+
+# Decoder for each Telegraf plugin name
+PLUGIN_DECODERS = {
+    'cpu': CpuDecoder(),
+    'win_cpu': WinCpuDecoder(),
+    'disk': DiskDecoder(),
+    'win_disk': WinDiskDecoder(),
+    'diskio': DiskioDecoder(),
+    'win_diskio': WinDiskioDecoder(),
+    'mem': MemDecoder(),
+    'win_mem': WinMemDecoder(),
+    'net': NetDecoder(),
+    'win_net': WinNetDecoder(),
+    'swap': SwapDecoder(),
+    'win_swap': WinSwapDecoder(),
+    'system': SystemDecoder(),
+    'win_system': WinSystemDecoder(),
+    'processes': ProcessesDecoder(),
+    'apache': ApacheDecoder(),
+    'haproxy': HaproxyDecoder(),
+    'memcached': MemcachedDecoder(),
+    'mysql': MysqlDecoder(),
+    'mysql_innodb': MysqlDecoder(),
+    'nginx': NginxDecoder(),
+    'postgresql': PostgresqlDecoder(),
+    'redis': RedisDecoder(),
+    'zookeeper': ZookeeperDecoder(),
+    'mongodb': MongodbDecoder(),
+    'elasticsearch_indices': ElasticsearchIndicesDecoder(),
+    'elasticsearch_jvm': ElasticsearchJvmDecoder(),
+    'rabbitmq_overview': RabbitmqOverviewDecoder(),
+    'docker': DockerDecoder(),
+    'docker_container_cpu': DockerContainerCpuDecoder(),
+    'docker_container_mem': DockerContainerMemDecoder(),
+    'docker_container_net': DockerContainerNetDecoder(),
+    'docker_container_blkio': DockerContainerBlkioDecoder(),
+    'phpfpm': PhpfpmDecoder(),
+}
+
+# Decoder for Telegraf plugin name starting with given prefix, used when
+# the plugin isn't in PLUGIN_DECODERS
+PREFIX_DECODERS = (
+    ('elasticsearch_', ElasticsearchDecoder()),
+    ('prometheus_', PrometheusDecoder()),
+)
+
+# Decoder used for metric not handled by any plugin decoder
+STATSD_DECODER = StatsdDecoder()
+
+
+def get_plugin_decoder(part):
+    """ Return the PluginDecoder for a parsed Telegraf metric name
+    """
+    plugin = part['telegraf_plugin']
+    decoder = PLUGIN_DECODERS.get(plugin)
+    if decoder is None:
+        for (prefix, prefix_decoder) in PREFIX_DECODERS:
+            if plugin.startswith(prefix):
+                decoder = prefix_decoder
+                break
+    if decoder is None or not decoder.match(part):
+        return STATSD_DECODER
+    return decoder
+
+
+class Telegraf:
+
+    def __init__(self, graphite_client):
+        self.core = graphite_client.core
+        self.graphite_client = graphite_client
+        self.graphite_server = graphite_client.server
+
+        # used to compute derivated values
+        self._raw_value = {}
+
+        self.computed_metrics_pending = set()
+
+        self.last_timestamp = 0
+        self.last_depecated_telgraf_warning = 0
+
+        # Map a metric name to its DecodedMetric (or None if dropped). It's
+        # cleared when graphite_server.decode_version change.
+        self._decode_cache = collections.OrderedDict()
+        self._decode_cache_version = self.graphite_server.decode_version
+        self.decode_cache_hits = 0
+        self.decode_cache_misses = 0
+
+        self.core.add_scheduled_job(
+            self._purge_metrics,
+            seconds=5 * 60,
+        )
+
+    def _purge_metrics(self):
+        """ Remove old metrics from self._raw_value
+        """
+        now = time.time()
+        cutoff = now - 60 * 6
+
+        # XXX: concurrent access with emit_metric
+        self._raw_value = {
+            key: (timestamp, value)
+            for key, (timestamp, value) in self._raw_value.items()
+            if timestamp >= cutoff
+        }
+
+    def get_derivate(self, name, item, timestamp, value):
+        """ Return derivate of a COUNTER (e.g. something that only goes upward)
+        """
+        (old_timestamp, old_value) = self._raw_value.get(
+            (name, item), (None, None)
+        )
+        self._raw_value[(name, item)] = (timestamp, value)
+        if old_timestamp is None:
+            return None
+
+        delta = value - old_value
+        delta_time = timestamp - old_timestamp
+
+        if delta_time == 0:
+            return None
+
+        if delta < 0:
+            return None
+
+        return delta / delta_time
+
+    def _get_service_instance(self, service, address, port):
+        index = self.graphite_server.service_index
+        try:
+            return index.by_address[(service, address, port)]
+        except KeyError:
+            raise KeyError('service not found')
+
+    def _get_haproxy_instance(self, hostport):
+        if ':' in hostport:
+            host, port = hostport.split(':')
+            port = int(port)
+        else:
+            host = hostport
+            port = None
+
+        index = self.graphite_server.service_index
+        try:
+            return index.haproxy_by_stats_url[(host, port)]
+        except KeyError:
+            raise KeyError('service not found')
+
+    def _get_elasticsearch_instance(self, node_id):
+        index = self.graphite_server.service_index
+        try:
+            return index.elasticsearch_by_node_id[node_id]
+        except KeyError:
+            if index.elasticsearch_missing_node_id:
+                # es_node_id are fetched outside of metrics processing
+                self.graphite_server.request_elasticsearch_node_ids()
+            raise KeyError('service not found')
+
+    def get_prometheus_exporter_name(self, metric_name, part):
+        """ Return the config of the Prometheus exporter
+        """
+        prometheus_configs = self.core.config['metric.prometheus']
+        for name, config in prometheus_configs.items():
+            url_mangled = telegraf_replace(config['url'])
+            if (metric_name.startswith('%s_' % name)
+                    and url_mangled in part):
+                return name
+        raise KeyError('prometheus config not found')
+
+    def docker_container_tags(self, part, extra_properties=None):
+        """ Return a mapping of metrics tag from Telegraf
+
+            For docker container, Telegraf mix a fixed list of properties
+            with user tags. This list is a list of key-value but when wrote on
+            graphite it result in a list of value separated by "."
+
+            For example:
+
+            prefix=telegraf,host=xenial,a_custom_label=my_value,
+                container_image=redis,container_name=my_redis,
+                container_status=running,container_version=unknown,
+                engine_host=xenial
+
+            Result in:
+
+            telegraf.xenial.my_value.redis.my_redis.running.unkonwn.xenial
+
+            This method transform the graphite line in a mapping.
+        """
+        if extra_properties is None:
+            extra_properties = []
+
+        return self.graphite_server.container_tags_resolver.resolve(
+            part, extra_properties,
+        )
+
+    def _telegraf_compatibility(self, name):
+        # pylint: disable=too-many-branches
+        # pylint: disable=too-many-statements
+        """ Parse old telegraf format without graphite_tag_support
+        """
+        if self.last_depecated_telgraf_warning < time.time() - 900:
+            self.last_depecated_telgraf_warning = time.time()
+            installation_format = self.core.last_facts.get(
+                'installation_format', ''
+            )
+            if 'Package' in installation_format:
+                logging.warning(
+                    'Telegraf configuration is using depreacted option.'
+                    ' Please upgrade package "telegraf" '
+                    'and "bleemeo-agent-telegraf".'
+                )
+            else:
+                logging.warning(
+                    'Telegraf configuration is using depreacted option.'
+                    ' Please upgrade Telegraf and its configuration.'
+                )
+            logging.warning(
+                'See https://docs.bleemeo.com/agent/upgrade-agent/'
+            )
+        # name looks like
+        # telegraf.HOSTNAME.(ITEM_INFO)*.PLUGIN.METRIC
+        # example:
+        # telegraf.xps-pierref.ext4./home.disk.total
+        # telegraf.xps-pierref.mem.used
+        # telegraf.xps-pierref.cpu-total.cpu.usage_steal
+        part = name.split('.')
+        part_dict = {
+            'telegraf_plugin': part[-2],
+            'metric_name': part[-1],
+        }
+
+        if part[-2] == 'cpu':
             part_dict['cpu'] = part[-3]
         elif part[-2] == 'disk':
             part_dict['fstype'] = part[3]
@@ -673,10 +2013,6 @@ class Telegraf:
         self._check_computed_metrics()
 
     def emit_metric(self, name, timestamp, value):
-        # pylint: disable=too-many-statements
-        # pylint: disable=too-many-branches
-        # pylint: disable=too-many-return-statements
-        # pylint: disable=too-many-locals
         """ Rename a metric and pass it to core
 
             If the metric is used to compute a derrived metric, add it to
@@ -691,19 +2027,72 @@ class Telegraf:
             self._check_computed_metrics()
         self.last_timestamp = timestamp
 
-        labels = {}
-        service = None
-        instance = ''
-        container_name = ''
-        derive = False
-        no_emit = False
+        if self._decode_cache_version != self.graphite_server.decode_version:
+            self._decode_cache.clear()
+            self._decode_cache_version = self.graphite_server.decode_version
+
+        try:
+            decoded = self._decode_cache[name]
+            self._decode_cache.move_to_end(name)
+            self.decode_cache_hits += 1
+        except KeyError:
+            self.decode_cache_misses += 1
+            decoded = self._decode_name(name)
+            if decoded is NOT_CACHEABLE:
+                return
+            self._decode_cache[name] = decoded
+            if len(self._decode_cache) > DECODE_CACHE_SIZE:
+                self._decode_cache.popitem(last=False)
+
+        if decoded is None:
+            return
+
+        if decoded.value_func is not None:
+            value = decoded.value_func(value)
+
+        for (pending_name, item, instance) in decoded.pending:
+            self.computed_metrics_pending.add(
+                (pending_name, item, instance, timestamp)
+            )
+
+        if decoded.derive:
+            value = self.get_derivate(
+                decoded.label,
+                decoded.labels.get('item', ''),
+                timestamp,
+                value,
+            )
+            if value is None:
+                return
+
+        for func in decoded.extra_emits:
+            func(self, decoded, timestamp, value)
+
+        self.core.emit_metric(
+            bleemeo_agent.type.MetricPoint(
+                label=decoded.label,
+                labels=decoded.labels,
+                time=timestamp,
+                value=value,
+                service_label=decoded.service,
+                service_instance=decoded.instance,
+                container_name=decoded.container_name,
+            ),
+            no_emit=decoded.no_emit
+        )
+
+    def _decode_name(self, name):
+        """ Resolve how points of the Telegraf metric name are emitted
 
+            Only the name is used, so the result is cached by emit_metric.
+            Returns None if the metric must be dropped.
+        """
         if ';' not in name:
             # Compatibility with older version Telegraf/Telegraf config which
             # don't include graphite_tag_support = true
             part = self._telegraf_compatibility(name)
             if not part:
-                return
+                return None
         else:
             # name looks like
             # telegraf.plugin.metric;label=value;label2=value2
@@ -726,985 +2115,14 @@ class Telegraf:
                     'metric_name': '',
                 }
             else:
-                return
+                return None
             for label in tmp[1:]:
                 if '=' not in label:
-                    return
+                    return None
                 label = label.split('=', 1)
                 part[label[0]] = label[1]
 
-        if part['telegraf_plugin'] == 'cpu':
-            if part['cpu'] != 'cpu-total':
-                return
-
-            name = part['metric_name'].replace('usage_', 'cpu_')
-            if name == 'cpu_irq':
-                name = 'cpu_interrupt'
-            elif name == 'cpu_iowait':
-                name = 'cpu_wait'
-
-            if name == 'cpu_idle':
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='cpu_used',
-                        time=timestamp,
-                        value=100 - value,
-                    )
-                )
-            if name in ('cpu_used', 'cpu_user', 'cpu_system'):
-                self.computed_metrics_pending.add(
-                    ('cpu_other', '', '', timestamp)
-                )
-        elif part['telegraf_plugin'] == 'win_cpu':
-            if part['instance'] != '_Total':
-                return
-
-            name = part['metric_name']
-            if name == 'Percent_Idle_Time':
-                name = 'cpu_idle'
-            elif name == 'Percent_Interrupt_Time':
-                name = 'cpu_interrupt'
-            elif name == 'Percent_User_Time':
-                name = 'cpu_user'
-            elif name == 'Percent_Privileged_Time':
-                name = 'cpu_system'
-            elif name == 'Percent_DPC_Time':
-                name = 'cpu_softirq'
-            else:
-                return
-
-            if name == 'cpu_idle':
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='cpu_used',
-                        time=timestamp,
-                        value=100 - value,
-                    )
-                )
-                self.computed_metrics_pending.add(
-                    ('system_load1', '', '', timestamp)
-                )
-            if name in ('cpu_used', 'cpu_user', 'cpu_system'):
-                self.computed_metrics_pending.add(
-                    ('cpu_other', '', '', timestamp)
-                )
-        elif part['telegraf_plugin'] == 'disk':
-            # Ignore fstype=rootfs. mountpoint for / is duplicated (at least on
-            # old Linux - like wheezy). One time as fstype=rootfs and one time
-            # with correct fstype.
-            if part['fstype'] == 'rootfs':
-                return
-            labels['fstype'] = part['fstype']
-            path = part['path'].replace('-', '/')
-            path = self.graphite_server.disk_path_rename(path)
-            if path is None:
-                return
-            labels['item'] = path
-
-            name = 'disk_' + part['metric_name']
-            if name == 'disk_used_percent':
-                name = 'disk_used_perc'
-        elif part['telegraf_plugin'] == 'win_disk':
-            labels['item'] = part['instance']
-            name = part['metric_name']
-            if labels['item'] == '_Total':
-                return
-
-            # For Windows, assimilate disk (which are also named "C:", "D:"...
-            # and (mounted) partition like C:
-            if self.graphite_server.ignored_disk(labels['item']):
-                return
-
-            if name == 'Percent_Free_Space':
-                name = 'disk_used_perc'
-                value = 100 - value
-
-                # when disk_total is processed, disk_used is also emitted
-                self.computed_metrics_pending.add(
-                    ('disk_total', labels['item'], None, timestamp)
-                )
-            elif name == 'Free_Megabytes':
-                name = 'disk_free'
-                value = value * 1024 * 1024
-                self.computed_metrics_pending.add(
-                    ('disk_total', labels['item'], None, timestamp)
-                )
-            else:
-                return
-        elif part['telegraf_plugin'] == 'diskio':
-            labels['item'] = part['_name']
-            name = part['metric_name']
-            if not name.startswith('io_'):
-                name = 'io_' + name
-            if self.graphite_server.ignored_disk(labels['item']):
-                return
-            if name == 'io_weighted_io_time':
-                return
-
-            if name == 'io_iops_in_progress':
-                name = 'io_in_progress'
-            else:
-                value = self.get_derivate(
-                    name, labels['item'], timestamp, value
-                )
-                if value is None:
-                    return
-
-            if name == 'io_time':
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='io_utilization',
-                        labels=labels,
-                        time=timestamp,
-                        # io_time is a number of ms spent doing IO(per seconds)
-                        # utilization is 100% when we spent 1000ms during one
-                        # second
-                        value=value / 1000. * 100.,
-                    )
-                )
-        elif part['telegraf_plugin'] == 'win_diskio':
-            labels['item'] = part['instance']
-            name = part['metric_name']
-            if labels['item'] == '_Total':
-                return
-
-            # Item looks like "0_C:", "1_D:" or "0_C:_D:" (multiple partition
-            # on one disk). Remove the number_ from item and take the smaller
-            # letter.
-            if '_' in labels['item']:
-                item_part = labels['item'].split('_')
-                number = item_part[0]
-                try:
-                    int(number)
-                    labels['item'] = sorted(item_part[1:])[0]
-                except ValueError:
-                    pass
-
-            if self.graphite_server.ignored_disk(labels['item']):
-                return
-
-            if name == 'Disk_Read_Bytes_persec':
-                name = 'io_read_bytes'
-            elif name == 'Disk_Write_Bytes_persec':
-                name = 'io_write_bytes'
-            elif name == 'Current_Disk_Queue_Length':
-                name = 'io_in_progress'
-            elif name == 'Disk_Reads_persec':
-                name = 'io_reads'
-            elif name == 'Disk_Writes_persec':
-                name = 'io_writes'
-            elif name == 'Percent_Idle_Time':
-                name = 'io_utilization'
-                value = 100 - value
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='io_time',
-                        labels=labels,
-                        time=timestamp,
-                        # io_time is a number of ms spent doing IO(per seconds)
-                        # utilization is 100% when we spent 1000ms during one
-                        # second
-                        value=value * 1000. / 100.,
-                    )
-                )
-            else:
-                return
-        elif part['telegraf_plugin'] == 'mem':
-            name = 'mem_' + part['metric_name']
-            if name in ('mem_used', 'mem_used_percent'):
-                # We don't use mem_used of telegraf (which is
-                # mem_total - mem_free)
-                # We prefere the "collectd one" (which is
-                # mem_total - (mem_free + mem_cached + mem_buffered + mem_slab)
-
-                # mem_used will be computed as mem_total - mem_available
-                return  # We don't use mem_used of telegraf.
-            if name == 'mem_available_percent':
-                name = 'mem_available_perc'
-            elif name in ('mem_buffered', 'mem_cached', 'mem_free'):
-                pass
-            elif name in ('mem_total', 'mem_available'):
-                self.computed_metrics_pending.add(
-                    ('mem_used', '', '', timestamp)
-                )
-            else:
-                return
-        elif part['telegraf_plugin'] == 'win_mem':
-            name = part['metric_name']
-            if name == 'Available_Bytes':
-                name = 'mem_available'
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='mem_available_perc',
-                        time=timestamp,
-                        value=value * 100. / self.core.total_memory_size,
-                    )
-                )
-                mem_used = self.core.total_memory_size - value
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='mem_used',
-                        time=timestamp,
-                        value=mem_used,
-                    )
-                )
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='mem_used_perc',
-                        time=timestamp,
-                        value=mem_used * 100. / self.core.total_memory_size,
-                    )
-                )
-                self.computed_metrics_pending.add(
-                    ('mem_free', '', '', timestamp)
-                )
-            elif name in (
-                    'Standby_Cache_Reserve_Bytes',
-                    'Standby_Cache_Normal_Priority_Bytes',
-                    'Standby_Cache_Core_Bytes'):
-                no_emit = True
-                self.computed_metrics_pending.add(
-                    ('mem_cached', '', '', timestamp)
-                )
-            else:
-                return
-        elif part['telegraf_plugin'] == 'net' and part['interface'] != 'all':
-            interface = part['interface']
-            if self.graphite_server.network_interface_blacklist(interface):
-                return
-            labels['item'] = interface
-
-            name = 'net_' + part['metric_name']
-            if name in ('net_bytes_recv', 'net_bytes_sent'):
-                name = name.replace('bytes', 'bits')
-                value = value * 8
-
-            derive = True
-        elif part['telegraf_plugin'] == 'win_net':
-            item = part['instance']
-            if self.graphite_server.network_interface_blacklist(item):
-                return
-            labels['item'] = item
-            name = part['metric_name']
-
-            if name == 'Bytes_Sent_persec':
-                name = 'net_bits_sent'
-                value = value * 8
-            elif name == 'Bytes_Received_persec':
-                name = 'net_bits_recv'
-                value = value * 8
-            elif name == 'Packets_Sent_persec':
-                name = 'net_packets_sent'
-            elif name == 'Packets_Received_persec':
-                name = 'net_packets_recv'
-            elif name == 'Packets_Received_Discarded':
-                derive = True
-                name = 'net_drop_in'
-            elif name == 'Packets_Outbound_Discarded':
-                derive = True
-                name = 'net_drop_out'
-            elif name == 'Packets_Received_Errors':
-                derive = True
-                name = 'net_err_in'
-            elif name == 'Packets_Outbound_Errors':
-                derive = True
-                name = 'net_err_out'
-            else:
-                return
-        elif part['telegraf_plugin'] == 'swap':
-            if not self.core.last_facts.get('swap_present', False):
-                return
-            name = 'swap_' + part['metric_name']
-            if name.endswith('_percent'):
-                name = name.replace('_percent', '_perc')
-            if name in ('swap_in', 'swap_out'):
-                derive = True
-        elif part['telegraf_plugin'] == 'win_swap':
-            if not self.core.last_facts.get('swap_present', False):
-                return
-
-            name = part['metric_name']
-            if name == 'Percent_Usage':
-                name = 'swap_used_perc'
-                if value == 0:
-                    swap_used = 0.0
-                else:
-                    swap_used = self.core.total_swap_size / (value / 100.)
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='swap_used',
-                        time=timestamp,
-                        value=swap_used,
-                    )
-                )
-                self.core.emit_metric(
-                    bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                        label='swap_free',
-                        time=timestamp,
-                        value=self.core.total_swap_size - swap_used,
-                    )
-                )
-        elif part['telegraf_plugin'] == 'system':
-            name = 'system_' + part['metric_name']
-            if name == 'system_uptime':
-                name = 'uptime'
-            elif name == 'system_n_users':
-                name = 'users_logged'
-            elif name not in ('system_load1', 'system_load5', 'system_load15'):
-                return
-        elif part['telegraf_plugin'] == 'win_system':
-            name = part['metric_name']
-            if name == 'System_Up_Time':
-                name = 'uptime'
-            elif name == 'Processor_Queue_Length':
-                no_emit = True
-                self.computed_metrics_pending.add(
-                    ('system_load1', '', '', timestamp)
-                )
-            else:
-                return
-        elif part['telegraf_plugin'] == 'processes':
-            if part['metric_name'] in ['blocked', 'running', 'sleeping',
-                                       'stopped', 'zombies', 'paging']:
-                name = 'process_status_%s' % part['metric_name']
-            elif part['metric_name'] == 'total':
-                name = 'process_total'
-            else:
-                return
-        elif part['telegraf_plugin'] == 'apache':
-            service = 'apache'
-            server_address = part['server'].replace('_', '.')
-            server_port = int(part['port'])
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = 'apache_' + part['metric_name']
-            if name == 'apache_IdleWorkers':
-                name = 'apache_idle_workers'
-            elif name == 'apache_TotalAccesses':
-                name = 'apache_requests'
-                derive = True
-            elif name == 'apache_TotalkBytes':
-                name = 'apache_bytes'
-                derive = True
-            elif name == 'apache_ConnsTotal':
-                name = 'apache_connections'
-            elif name == 'apache_Uptime':
-                name = 'apache_uptime'
-            elif 'scboard' in name:
-                name = name.replace('scboard', 'scoreboard')
-            else:
-                return
-            if name.startswith('apache_scoreboard_'):
-                self.computed_metrics_pending.add(
-                    ('apache_max_workers', instance, instance, timestamp)
-                )
-        elif part['telegraf_plugin'] == 'haproxy':
-            service = 'haproxy'
-            proxy_name = part['proxy']
-            if part['sv'] not in ('BACKEND', 'FRONTEND'):
-                return
-            hostport = part['server'].replace('_', '.')
-            try:
-                instance = self._get_haproxy_instance(hostport)
-            except KeyError:
-                return
-
-            if (part['metric_name'] in ('stot', 'bin', 'bout', 'dreq', 'dresp',
-                                        'ereq', 'econ', 'eresp', 'req_tot')):
-                derive = True
-                name = 'haproxy_' + part['metric_name']
-            elif (part['metric_name'] in ('qcur', 'scur', 'qtime', 'ctime',
-                                          'rtime', 'ttime')):
-                name = 'haproxy_' + part['metric_name']
-            elif part['metric_name'] == 'active_servers':
-                name = 'haproxy_act'
-            else:
-                return
-
-            if not instance:
-                labels['item'] = proxy_name
-            else:
-                labels['item'] = instance + '_' + proxy_name
-        elif part['telegraf_plugin'] == 'memcached':
-            service = 'memcached'
-            (server_address, server_port) = part['server'].split(':')
-            server_address = server_address.replace('_', '.')
-            server_port = int(server_port)
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = 'memcached_' + part['metric_name']
-            if '_cmd_' in name:
-                name = name.replace('_cmd_', '_command_')
-                derive = True
-            elif name == 'memcached_curr_connections':
-                name = 'memcached_connections_current'
-            elif name == 'memcached_curr_items':
-                name = 'memcached_items_current'
-            elif name == 'memcached_bytes_read':
-                name = 'memcached_octets_rx'
-                derive = True
-            elif name == 'memcached_bytes_written':
-                name = 'memcached_octets_tx'
-                derive = True
-            elif name == 'memcached_evictions':
-                name = 'memcached_ops_evictions'
-                derive = True
-            elif name == 'memcached_threads':
-                name = 'memcached_ps_count_threads'
-            elif name in ('memcached_get_misses', 'memcached_get_hits'):
-                name = name.replace('_get_', '_ops_')
-                derive = True
-            elif name.endswith('_misses') or name.endswith('_hits'):
-                name = name.replace('memcached_', 'memcached_ops_')
-                derive = True
-            elif name != 'memcached_uptime':
-                return
-        elif part['telegraf_plugin'] in ('mysql', 'mysql_innodb'):
-            service = 'mysql'
-            (server_address, server_port) = part['server'].split(':')
-            server_address = server_address.replace('_', '.')
-            server_port = int(server_port)
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = part['telegraf_plugin'] + '_' + part['metric_name']
-            derive = True
-            if name.startswith('mysql_qcache_'):
-                name = name.replace('qcache', 'cache_result_qcache')
-                if name == 'mysql_cache_result_qcache_lowmem_prunes':
-                    name = 'mysql_cache_result_qcache_prunes'
-                elif name == 'mysql_cache_result_qcache_queries_in_cache':
-                    name = 'mysql_cache_size_qcache'
-                    derive = False
-                elif name == 'mysql_cache_result_qcache_total_blocks':
-                    name = 'mysql_cache_blocksize_qcache'
-                    derive = False
-                elif name in ('mysql_cache_result_qcache_free_blocks',
-                              'mysql_cache_result_qcache_free_memory'):
-                    name = name.replace(
-                        'mysql_cache_result_qcache_', 'mysql_cache_')
-                    derive = False
-            elif name.startswith('mysql_table_locks_'):
-                name = name.replace('mysql_table_locks_', 'mysql_locks_')
-            elif name == 'mysql_bytes_received':
-                name = 'mysql_octets_rx'
-            elif name == 'mysql_bytes_sent':
-                name = 'mysql_octets_tx'
-            elif name == 'mysql_threads_created':
-                name = 'mysql_total_threads_created'
-            elif name.startswith('mysql_threads_'):
-                # Other mysql_threads_* name are fine. Accept them unchanged
-                derive = False
-            elif name.startswith('mysql_commands_'):
-                # mysql_commands_* name are fine. Accept them unchanged
-                pass
-            elif name.startswith('mysql_handler_'):
-                # mysql_handler_* name are fine. Accept them unchanged
-                pass
-            elif name in ('mysql_queries', 'mysql_slow_queries'):
-                pass
-            elif name == 'mysql_innodb_row_lock_current_waits':
-                derive = False
-                name = 'mysql_innodb_locked_transaction'
-            elif name == 'mysql_innodb_trx_rseg_history_len':
-                derive = False
-                name = 'mysql_innodb_history_list_len'
-            else:
-                return
-        elif part['telegraf_plugin'] == 'nginx':
-            service = 'nginx'
-            server_address = part['server'].replace('_', '.')
-            server_port = int(part['port'])
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = 'nginx_connections_' + part['metric_name']
-            if name == 'nginx_connections_requests':
-                name = 'nginx_requests'
-                derive = True
-            elif name == 'nginx_connections_accepts':
-                name = 'nginx_connections_accepted'
-                derive = True
-            elif name == 'nginx_connections_handled':
-                derive = True
-        elif part['telegraf_plugin'] == 'postgresql':
-            service = 'postgresql'
-            dbname = part['db']
-
-            if dbname in ('template0', 'template1'):
-                return
-
-            connect_string = part['server']
-            # connect string look like:
-            # "host=172_17_0_4_port=5432_user=bleemeo_user_dbname=postgres"
-            match = re.match(
-                r'^host=(.*)_port=(.*)_user=.*$',
-                connect_string,
-            )
-            if not match:
-                return
-
-            server_address = match.group(1).replace('_', '.')
-            server_port = int(match.group(2))
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            derive = True
-            if part['metric_name'] == 'xact_commit':
-                name = 'postgresql_commit'
-            elif part['metric_name'] == 'xact_rollback':
-                name = 'postgresql_rollback'
-            elif (part['metric_name'] in ('blks_read', 'blks_hit',
-                                          'tup_returned', 'tup_fetched',
-                                          'tup_inserted', 'tup_updated',
-                                          'tup_deleted', 'temp_files',
-                                          'temp_bytes', 'blk_read_time',
-                                          'blk_write_time')):
-                name = 'postgresql_' + part['metric_name']
-            else:
-                return
-
-            if not instance:
-                labels['item'] = dbname
-            else:
-                labels['item'] = instance + '_' + dbname
-                labels['dbname'] = dbname
-        elif part['telegraf_plugin'] == 'redis':
-            service = 'redis'
-            server_address = part['server'].replace('_', '.')
-            server_port = int(part['port'])
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = 'redis_' + part['metric_name']
-
-            if name == 'redis_clients':
-                name = 'redis_current_connections_clients'
-            elif name == 'redis_connected_slaves':
-                name = 'redis_current_connections_slaves'
-            elif name.startswith('redis_used_memory'):
-                name = name.replace('redis_used_memory', 'redis_memory')
-            elif name == 'redis_total_connections_received':
-                name = 'redis_total_connections'
-                derive = True
-            elif name == 'redis_total_commands_processed':
-                name = 'redis_total_operations'
-                derive = True
-            elif name == 'redis_rdb_changes_since_last_save':
-                name = 'redis_volatile_changes'
-            elif name in ('redis_evicted_keys', 'redis_keyspace_hits',
-                          'redis_keyspace_misses', 'redis_expired_keys'):
-                derive = True
-            elif name in ('redis_uptime', 'redis_pubsub_patterns',
-                          'redis_pubsub_channels', 'redis_keyspace_hitrate'):
-                pass
-            else:
-                return
-        elif part['telegraf_plugin'] == 'zookeeper':
-            service = 'zookeeper'
-
-            # Telegraf 1.0.0 added "state" in tag. Which change position of
-            # server_address and server_port.
-
-            # Telegraf <1.0.0, output was:
-            # telegraf.$HOSTNAME.$PORT.$SERVER.zookeeper.$METRIC
-            # Telegraf 1.0.0+, output is:
-            # telegraf.$HOSTNAME.$PORT.$SERVER.$STATE.zookeeper.$METRIC
-            server_address = part['server'].replace('_', '.')
-            server_port = int(part['port'])
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = 'zookeeper_' + part['metric_name']
-            if name.startswith('zookeeper_packets_'):
-                derive = True
-            elif name in ('zookeeper_ephemerals_count',
-                          'zookeeper_watch_count', 'zookeeper_znode_count'):
-                pass
-            elif name == 'zookeeper_num_alive_connections':
-                name = 'zookeeper_connections'
-            else:
-                return
-        elif part['telegraf_plugin'] == 'mongodb':
-            service = 'mongodb'
-            (server_address, server_port) = part['hostname'].split(':')
-            server_address = server_address.replace('_', '.')
-            server_port = int(server_port)
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            name = 'mongodb_' + part['metric_name']
-            if name in ('mongodb_open_connections', 'mongodb_queued_reads',
-                        'mongodb_queued_writes', 'mongodb_active_reads',
-                        'mongodb_active_writes'):
-                pass
-            elif name == 'mongodb_queries_per_sec':
-                name = 'mongodb_queries'
-            elif name in ('mongodb_net_out_bytes', 'mongodb_net_in_bytes'):
-                derive = True
-            else:
-                return
-        elif part['telegraf_plugin'].startswith('elasticsearch_'):
-            service = 'elasticsearch'
-            # It can't rely only on part['node_host'], because this is the
-            # host as think by ES (usually the "public" IP of the node). But
-            # Agent use "127.0.0.1" for localhost.
-            # server_address = part['node_host'].replace('_', '.')
-
-            node_id = part['node_id']
-            try:
-                instance = self._get_elasticsearch_instance(node_id)
-            except KeyError:
-                return
-
-            name = None
-            if part['telegraf_plugin'] == 'elasticsearch_indices':
-                if part['metric_name'] == 'docs_count':
-                    name = 'elasticsearch_docs_count'
-                elif part['metric_name'] == 'store_size_in_bytes':
-                    name = 'elasticsearch_size'
-                elif part['metric_name'] == 'search_query_total':
-                    name = 'elasticsearch_search'
-                    derive = True
-                    self.computed_metrics_pending.add(
-                        (
-                            'elasticsearch_search_time',
-                            instance,
-                            instance,
-                            timestamp
-                        )
-                    )
-                elif part['metric_name'] == 'search_query_time_in_millis':
-                    name = 'elasticsearch_search_time_total'
-                    derive = True
-                    no_emit = True
-                    self.computed_metrics_pending.add(
-                        (
-                            'elasticsearch_search_time',
-                            instance,
-                            instance,
-                            timestamp
-                        )
-                    )
-            elif part['telegraf_plugin'] == 'elasticsearch_jvm':
-                if part['metric_name'] == 'mem_heap_used_in_bytes':
-                    name = 'elasticsearch_jvm_heap_used'
-                elif part['metric_name'] == 'mem_non_heap_used_in_bytes':
-                    name = 'elasticsearch_jvm_non_heap_used'
-                elif part['metric_name'] == (
-                        'gc_collectors_old_collection_count'):
-                    name = 'elasticsearch_jvm_gc_old'
-                    no_emit = True
-                    derive = True
-                    self.computed_metrics_pending.add(
-                        (
-                            'elasticsearch_jvm_gc',
-                            instance,
-                            instance,
-                            timestamp
-                        )
-                    )
-                elif part['metric_name'] == (
-                        'gc_collectors_young_collection_count'):
-                    name = 'elasticsearch_jvm_gc_young'
-                    no_emit = True
-                    derive = True
-                    self.computed_metrics_pending.add(
-                        (
-                            'elasticsearch_jvm_gc',
-                            instance,
-                            instance,
-                            timestamp
-                        )
-                    )
-                elif part['metric_name'] == (
-                        'gc_collectors_old_collection_time_in_millis'):
-                    name = 'elasticsearch_jvm_gc_time_old'
-                    no_emit = True
-                    derive = True
-                    self.computed_metrics_pending.add(
-                        (
-                            'elasticsearch_jvm_gc_time',
-                            instance,
-                            instance,
-                            timestamp
-                        )
-                    )
-                elif part['metric_name'] == (
-                        'gc_collectors_young_collection_time_in_millis'):
-                    name = 'elasticsearch_jvm_gc_time_young'
-                    no_emit = True
-                    derive = True
-                    self.computed_metrics_pending.add(
-                        (
-                            'elasticsearch_jvm_gc_time',
-                            instance,
-                            instance,
-                            timestamp
-                        )
-                    )
-        elif part['telegraf_plugin'] == 'rabbitmq_overview':
-            service = 'rabbitmq'
-
-            tmp = part['url']
-            if not tmp.startswith('http:--'):
-                return  # unknown format
-            tmp = tmp[len('http:--'):]
-            (server_address, server_port) = tmp.split(':')
-            server_address = server_address.replace('_', '.')
-            server_port = int(server_port)
-            try:
-                instance = self._get_service_instance(
-                    service, server_address, server_port
-                )
-            except KeyError:
-                return
-
-            if part['metric_name'] == 'messages':
-                name = 'rabbitmq_messages_count'
-            elif part['metric_name'] == 'consumers':
-                name = 'rabbitmq_consumers'
-            elif part['metric_name'] == 'connections':
-                name = 'rabbitmq_connections'
-            elif part['metric_name'] == 'queues':
-                name = 'rabbitmq_queues'
-            elif part['metric_name'] == 'messages_published':
-                derive = True
-                name = 'rabbitmq_messages_published'
-            elif part['metric_name'] == 'messages_delivered':
-                derive = True
-                name = 'rabbitmq_messages_delivered'
-            elif part['metric_name'] == 'messages_acked':
-                derive = True
-                name = 'rabbitmq_messages_acked'
-            elif part['metric_name'] == 'messages_unacked':
-                name = 'rabbitmq_messages_unacked_count'
-            else:
-                return
-        elif part['telegraf_plugin'] == 'docker':
-            if part['metric_name'] == 'n_containers':
-                name = 'docker_containers'
-            else:
-                return
-        elif part['telegraf_plugin'] == 'docker_container_cpu':
-            if part['metric_name'] == 'usage_total':
-                name = 'docker_container_cpu_used'
-                # Docker sends time in nanosecond. Convert it to seconds
-                value = value / 1000000000
-
-                # And return a percentage
-                derive = True
-                value = value * 100
-            else:
-                return
-            labels['item'] = part['container_name']
-            if labels['item'] not in self.core.docker_containers_by_name:
-                return
-
-            if part.get('cpu') != 'cpu-total':
-                return
-        elif part['telegraf_plugin'] == 'docker_container_mem':
-            if part['metric_name'] == 'usage_percent':
-                name = 'docker_container_mem_used_perc'
-            elif part['metric_name'] == 'usage':
-                name = 'docker_container_mem_used'
-            else:
-                return
-
-            labels['item'] = part['container_name']
-            if labels['item'] not in self.core.docker_containers_by_name:
-                return
-        elif part['telegraf_plugin'] == 'docker_container_net':
-            if part['metric_name'] == 'rx_bytes':
-                name = 'docker_container_net_bits_recv'
-                value = value * 8  # Convert bytes => bits
-                derive = True
-            elif part['metric_name'] == 'tx_bytes':
-                name = 'docker_container_net_bits_sent'
-                value = value * 8  # Convert bytes => bits
-                derive = True
-            else:
-                return
-
-            labels['item'] = part['container_name']
-            if labels['item'] not in self.core.docker_containers_by_name:
-                return
-
-            if part.get("network") != 'total':
-                return
-        elif part['telegraf_plugin'] == 'docker_container_blkio':
-            if part['metric_name'] == 'io_service_bytes_recursive_read':
-                name = 'docker_container_io_read_bytes'
-                derive = True
-            elif part['metric_name'] == 'io_service_bytes_recursive_write':
-                name = 'docker_container_io_write_bytes'
-                derive = True
-            else:
-                return
-
-            labels['item'] = part['container_name']
-            if labels['item'] not in self.core.docker_containers_by_name:
-                return
-
-            if part.get("device") != 'total':
-                return
-        elif part['telegraf_plugin'].startswith('prometheus_'):
-            name = part['telegraf_plugin'][len('prometheus_'):]
-
-            item_part = []
-            for (k, v) in sorted(part.items()):  # pylint: disable=invalid-name
-                if k in ['telegraf_plugin', 'metric_name', 'url', 'host']:
-                    continue
-                if not v:
-                    continue
-                item_part.append(v)
-                labels[k] = v
-            if item_part:
-                labels['item'] = '-'.join(item_part)
-            if part['metric_name'] == 'counter':
-                if name.endswith('_total'):
-                    # Agent don't send a total, but a derivate.
-                    name = name[:-len('_total')]
-                derive = True
-            elif part['metric_name'] == 'gauge':
-                pass
-            elif part['metric_name'] == 'sum':
-                derive = True
-                no_emit = True
-                self.computed_metrics_pending.add(
-                    (
-                        'prometheus_' + name,
-                        labels.get('item', ''),
-                        None,
-                        timestamp
-                    )
-                )
-                name = name + '_sum'
-            elif part['metric_name'] == 'count':
-                derive = True
-                no_emit = True
-                self.computed_metrics_pending.add(
-                    (
-                        'prometheus_' + name,
-                        labels.get('item', ''),
-                        None,
-                        timestamp
-                    )
-                )
-                name = name + '_count'
-            elif part['metric_name'] in ('5', '0', '1'):
-                # This is used by quantile and histogram. (0 is in
-                # fact 0.1, 0.25...)
-                # Agent don't process them on use only sum and count.
-                return
-            else:
-                logging.debug(
-                    'Unknown Prometheus metric: %s_%s',
-                    name,
-                    part['metric_name'],
-                )
-                return
-        elif part['telegraf_plugin'] == 'phpfpm':
-            service = 'phpfpm'
-            if ('instance' in part
-                    and ('phpfpm', part['instance']) in self.core.services):
-                instance = part['instance']
-
-            name = 'phpfpm_' + part['metric_name']
-
-            if name in {'phpfpm_accepted_conn', 'phpfpm_slow_requests'}:
-                derive = True
-        elif (part.get('metric_type', '') == 'counter'
-              and self.core.config['telegraf.statsd.enabled']):
-            # statsd counter
-            derive = True
-            name = 'statsd_' + part['telegraf_plugin']
-        elif (part.get('metric_type', '') == 'gauge'
-              and self.core.config['telegraf.statsd.enabled']):
-            # statsd gauge
-            name = 'statsd_' + part['telegraf_plugin']
-        elif (part.get('metric_type', '') == 'set'
-              and self.core.config['telegraf.statsd.enabled']):
-            # statsd set
-            name = 'statsd_' + part['telegraf_plugin']
-        elif (part.get('metric_type', '') == 'timing'
-              and self.core.config['telegraf.statsd.enabled']):
-            # statsd timing
-            name = (
-                'statsd_' + part['telegraf_plugin'] + '_' + part['metric_name']
-            )
-            if part['metric_name'] == 'count':
-                # count for timing are number of item per 10 seconds.
-                # We want a count per second.
-                value = value / 10
-        else:
-            return
-
-        if name is None:
-            return
-
-        if 'item' not in labels and service and instance:
-            labels['item'] = instance
-
-        if derive:
-            value = self.get_derivate(
-                name, labels.get('item', ''), timestamp, value,
-            )
-            if value is None:
-                return
-
-        if service is None:
-            service = ''
-            instance = ''
-
-        if container_name is None:
-            container_name = ''
-        self.core.emit_metric(
-            bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
-                label=name,
-                labels=labels,
-                time=timestamp,
-                value=value,
-                service_label=service,
-                service_instance=instance,
-                container_name=container_name,
-            ),
-            no_emit=no_emit
-        )
+        return get_plugin_decoder(part).decode(self, part)
 
     def packet_finish(self):
         """ Called when graphite_client finished processing one TCP packet
@@ -1781,7 +2199,7 @@ class Telegraf:
             disk_used = disk_total * (used_perc / 100.0)
             value = disk_total
             self.core.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='disk_used',
                     labels={
                         'item': item,
@@ -1812,7 +2230,7 @@ class Telegraf:
             total = get_metric('mem_total', '')
             value = total - get_metric('mem_available', '')
             self.core.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='mem_used_perc',
                     time=timestamp,
                     value=value / total * 100,
@@ -1859,7 +2277,7 @@ class Telegraf:
             else:
                 labels['item'] = item
             self.core.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='elasticsearch_jvm_gc_utilization',
                     labels=labels,
                     time=timestamp,
@@ -1880,7 +2298,7 @@ class Telegraf:
             else:
                 labels['item'] = item
             self.core.emit_metric(
-                bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+                bleemeo_agent.type.MetricPoint(
                     label='apache_busy_workers_perc',
                     labels=labels,
                     time=timestamp,
@@ -1929,7 +2347,7 @@ class Telegraf:
             service = ''
             instance = ''
         self.core.emit_metric(
-            bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+            bleemeo_agent.type.MetricPoint(
                 label=name,
                 labels=labels,
                 time=timestamp,
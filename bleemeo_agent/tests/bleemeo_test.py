@@ -0,0 +1,736 @@
+#
+#  Copyright 2015-2018 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import http.server
+import json
+import socketserver
+import threading
+import time
+import uuid
+import zlib
+
+import pytest
+import requests
+from six.moves import urllib_parse
+
+import bleemeo_agent.bleemeo
+import bleemeo_agent.config
+import bleemeo_agent.spool
+import bleemeo_agent.type
+import bleemeo_agent.util
+
+
+DATA_POINTS = [
+    {
+        'uuid': '6b0ab1b2-8ae1-4b4d-9a3c-7cc8ea4d0bd1',
+        'measurement': 'cpu_used',
+        'time': 1500000000.0,
+        'value': 12.5,
+    },
+    {
+        'uuid': '0ea8d3e4-5c6a-4f3a-8b44-5c24ef5e5f2a',
+        'measurement': 'disk_used_perc',
+        'item': '/home',
+        'time': 1500000000.0,
+        'value': 95.0,
+        'status': 'critical',
+        'check_output': 'Current value: 95.00',
+    },
+    {
+        'uuid': '6b0ab1b2-8ae1-4b4d-9a3c-7cc8ea4d0bd1',
+        'measurement': 'cpu_used',
+        'time': 1500000010.0,
+        'value': 13.5,
+    },
+]
+
+
+def test_data_payload_json():
+    payload = bleemeo_agent.bleemeo.DataPayload()
+    for point in DATA_POINTS:
+        payload.add(point)
+
+    assert len(payload) == 3
+    assert payload.topic('uuid') == 'v1/agent/uuid/data'
+    assert payload.encode() == json.dumps(DATA_POINTS)
+    assert payload.size == len(payload.encode())
+
+
+def test_data_payload_compact():
+    payload = bleemeo_agent.bleemeo.DataPayload(compact=True)
+    for point in DATA_POINTS:
+        payload.add(point)
+
+    assert len(payload) == 3
+    assert payload.topic('uuid') == 'v1/agent/uuid/data_compact'
+    message = payload.encode()
+    content = json.loads(zlib.decompress(message).decode('utf8'))
+    assert content == {
+        'metrics': [
+            ['6b0ab1b2-8ae1-4b4d-9a3c-7cc8ea4d0bd1', 'cpu_used', None],
+            [
+                '0ea8d3e4-5c6a-4f3a-8b44-5c24ef5e5f2a',
+                'disk_used_perc',
+                '/home',
+            ],
+        ],
+        'metric': [0, 1, 0],
+        'time': [1500000000.0, 1500000000.0, 1500000010.0],
+        'value': [12.5, 95.0, 13.5],
+        'status': {'1': 'critical'},
+        'check_output': {'1': 'Current value: 95.00'},
+    }
+    assert len(message) < len(json.dumps(DATA_POINTS))
+
+
+class FakeMessageInfo:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, mid):
+        self.mid = mid
+
+
+class FakeMqttClient:
+
+    def __init__(self):
+        self.published = []
+        self.ack_on_publish = False
+        self.publisher = None
+
+    def publish(self, topic, message, qos):
+        mid = len(self.published) + 1
+        self.published.append((topic, message, qos))
+        if self.ack_on_publish:
+            # PUBACK received before publish() returned
+            self.publisher.on_publish(mid)
+        return FakeMessageInfo(mid)
+
+
+def test_mqtt_publisher():
+    client = FakeMqttClient()
+    publisher = bleemeo_agent.bleemeo.MqttPublisher(
+        client, max_messages=2, max_bytes=1000,
+    )
+    client.publisher = publisher
+
+    assert publisher.publish('topic', 'a' * 10)
+    assert publisher.publish('topic', 'b' * 20)
+    assert publisher.in_flight == 2
+    assert publisher.in_flight_bytes == 30
+    assert publisher.is_full()
+    assert not publisher.wait_for_capacity(timeout=0)
+
+    # Full: message are dropped, unless forced
+    assert not publisher.publish('topic', 'c')
+    assert publisher.publish('topic', 'd', force=True)
+    assert len(client.published) == 3
+
+    publisher.on_publish(1)
+    publisher.on_publish(3)
+    assert publisher.in_flight == 1
+    assert publisher.in_flight_bytes == 20
+    assert publisher.wait_for_capacity(timeout=0)
+
+    client.ack_on_publish = True
+    assert publisher.publish('topic', 'e')
+    assert publisher.in_flight == 1
+
+    stats = publisher.pop_stats()
+    assert stats['in_flight'] == 1
+    assert stats['dropped'] == 1
+    assert stats['latency_avg'] is not None
+    assert publisher.pop_stats()['dropped'] == 0
+    assert publisher.dropped_total == 1
+
+
+def test_adaptive_batching():
+    batching = bleemeo_agent.bleemeo.AdaptiveBatching(256 * 1024)
+    # Without measure, send large batches at the maximum interval
+    assert batching.batch_size == 256 * 1024
+    assert batching.flush_interval == batching.MAX_FLUSH_INTERVAL
+
+    batching.latency = 0.1
+    assert batching.flush_interval == batching.MIN_FLUSH_INTERVAL
+    batching.latency = 1.5
+    assert batching.flush_interval == 3
+    batching.latency = 60
+    assert batching.flush_interval == batching.MAX_FLUSH_INTERVAL
+
+    batching.latency = 1.5
+    batching.rate = 100
+    assert batching.batch_size == batching.MIN_BATCH_SIZE
+    batching.rate = 10000
+    assert batching.batch_size == 30000
+    batching.rate = 1e6
+    assert batching.batch_size == 256 * 1024
+
+    batching.record_flush(1000, 0.5)
+    assert batching.latency == 0.5
+    assert batching.rate > 0
+    batching.record_flush(1000, None)
+    assert batching.latency == 0.5
+
+
+def test_unregistered_points():
+    now = time.time()
+    points = bleemeo_agent.bleemeo.UnregisteredPoints(
+        max_points_per_key=3, max_points=5,
+    )
+    for i in range(4):
+        point = bleemeo_agent.type.MetricPoint(
+            label='cpu_used', labels={}, time=now + i, value=i,
+        )
+        assert points.put(('cpu_used', ''), point)
+    # The ring of cpu_used only keep 3 points
+    assert len(points) == 3
+
+    old_point = bleemeo_agent.type.MetricPoint(
+        label='mem_used', labels={}, time=now - 8000, value=1,
+    )
+    assert points.put(('mem_used', ''), old_point)
+    assert points.put(('disk_used', '/'), old_point)
+    assert not points.put(('io_time', 'sda'), old_point)
+    assert len(points) == 5
+
+    points.expire({('cpu_used', ''): None, ('disk_used', '/'): None})
+    assert len(points) == 3
+    assert points.keys() == [('cpu_used', '')]
+
+    assert [x.value for x in points.pop(('cpu_used', ''))] == [1, 2, 3]
+    assert points.pop(('cpu_used', '')) == []
+    assert len(points) == 0
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # http.server.ThreadingHTTPServer only exists since Python 3.7
+    daemon_threads = True
+
+
+class FakeApiHandler(http.server.BaseHTTPRequestHandler):
+    """ Stand-in for the metric endpoint of Bleemeo API
+
+        Each registration takes 50ms. A list of metrics is accepted only if
+        server.support_bulk is True. Listing returns server.metrics.
+    """
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers['Content-Length'])
+        payload = json.loads(self.rfile.read(length).decode('utf-8'))
+        if self.path.startswith('/v1/jwt-auth/'):
+            self._reply(200, {'token': 'token'})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+        time.sleep(0.05)
+        with server.lock:
+            server.running -= 1
+
+        if isinstance(payload, list) and not server.support_bulk:
+            self._reply(400, {'label': ['This field is required.']})
+            return
+        if isinstance(payload, list):
+            self._reply(201, [self._metric(x) for x in payload])
+        else:
+            self._reply(201, self._metric(payload))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        url = urllib_parse.urlparse(self.path)
+        params = dict(urllib_parse.parse_qsl(url.query))
+        with server.lock:
+            server.list_params.append(params)
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+        time.sleep(server.list_delay)
+        with server.lock:
+            server.running -= 1
+
+        metrics = [
+            metric for metric in server.metrics
+            if metric['updated_at'] >= params.get('updated_at__gte', '')
+        ]
+        page = int(params.get('page', 1))
+        page_size = int(params['page_size'])
+        next_url = None
+        if page * page_size < len(metrics):
+            params['page'] = page + 1
+            next_url = 'http://%s:%d%s?%s' % (
+                server.server_address[0],
+                server.server_address[1],
+                url.path,
+                urllib_parse.urlencode(params),
+            )
+        self._reply(200, {
+            'count': len(metrics),
+            'next': next_url,
+            'results': metrics[(page - 1) * page_size:page * page_size],
+        })
+
+    def _metric(self, payload):
+        metric = dict.fromkeys((
+            'service', 'container', 'status_of', 'threshold_low_warning',
+            'threshold_low_critical', 'threshold_high_warning',
+            'threshold_high_critical', 'unit', 'unit_text', 'deactivated_at',
+        ))
+        metric.update(payload)
+        metric['id'] = str(uuid.uuid4())
+        with self.server.lock:
+            self.server.registered.append(payload)
+        return metric
+
+
+class FakeCore:
+    def __init__(self):
+        self.config = bleemeo_agent.config._load_default_config()
+        self.state = {'agent_uuid': str(uuid.uuid4())}
+        self.services = {}
+        self.docker_containers = {}
+        self.docker_containers_hash = {}
+        self.started_at = bleemeo_agent.util.get_clock()
+
+        self.thresholds = {}
+        self.metrics_unit = {}
+
+    def purge_metrics(self, deleted_metrics):
+        pass
+
+    def update_thresholds(self, thresholds):
+        self.thresholds = thresholds
+
+
+def _start_fake_api(support_bulk=False):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.running = 0
+    server.max_running = 0
+    server.registered = []
+    server.metrics = []
+    server.list_params = []
+    server.list_delay = 0
+    server.support_bulk = support_bulk
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+
+    bleemeo_api = bleemeo_agent.bleemeo.BleemeoAPI(
+        'http://127.0.0.1:%d/' % server.server_address[1],
+        ('user', 'password'),
+        'bleemeo-agent-test',
+        True,
+    )
+    return (server, thread, bleemeo_api)
+
+
+def _stop_fake_api(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _register_metrics(config):
+    (server, thread, bleemeo_api) = _start_fake_api(
+        config.pop('support_bulk', False),
+    )
+
+    core = FakeCore()
+    for (key, value) in config.items():
+        core.config[key] = value
+    connector = bleemeo_agent.bleemeo.BleemeoConnector(core)
+    cache = bleemeo_agent.bleemeo.BleemeoCache(None, skip_load=True)
+    registrations = [
+        (
+            bleemeo_agent.bleemeo.MetricRegistrationReq(
+                'disk_used_status', {'item': 'sda%d' % i}, None, '', '',
+                'disk_used', None, '', 0,
+            ),
+            'sda%d' % i,
+        )
+        for i in range(20)
+    ] + [
+        (
+            bleemeo_agent.bleemeo.MetricRegistrationReq(
+                'disk_used', {'item': 'sda%d' % i}, None, '', '', None,
+                None, '', 0,
+            ),
+            'sda%d' % i,
+        )
+        for i in range(20)
+    ]
+
+    start = time.time()
+    try:
+        last_error = connector._sync_register_metrics(
+            cache, bleemeo_api, registrations, {}, {},
+        )
+    finally:
+        _stop_fake_api(server, thread)
+
+    assert last_error is None
+    assert len(cache.metrics_by_labelitem) == 40
+    # Status metrics are registered after the metric they refer to
+    status_of = cache.metrics_by_labelitem[('disk_used_status', 'sda3')]
+    assert (
+        status_of.status_of
+        == cache.metrics_by_labelitem[('disk_used', 'sda3')].uuid
+    )
+    return (server, time.time() - start)
+
+
+def test_sync_register_metrics():
+    (server, sequential) = _register_metrics({
+        'bleemeo.metric_registration.workers': 1,
+        'bleemeo.metric_registration.rate_limit': 0,
+    })
+    assert server.requests == 40
+    assert server.max_running == 1
+
+    (server, concurrent) = _register_metrics({
+        'bleemeo.metric_registration.workers': 8,
+        'bleemeo.metric_registration.rate_limit': 0,
+    })
+    assert server.requests == 40
+    assert server.max_running > 1
+    assert concurrent < sequential
+
+    (server, _) = _register_metrics({
+        'bleemeo.metric_registration.bulk': True,
+        'bleemeo.metric_registration.rate_limit': 0,
+        'support_bulk': True,
+    })
+    # One request for disk_used, one for disk_used_status
+    assert server.requests == 2
+
+    (server, _) = _register_metrics({
+        'bleemeo.metric_registration.workers': 8,
+        'bleemeo.metric_registration.bulk': True,
+        'bleemeo.metric_registration.rate_limit': 0,
+    })
+    # First bulk request is refused, then metrics are registered one by one
+    assert server.requests == 41
+
+
+def test_rate_limiter():
+    limiter = bleemeo_agent.bleemeo.RateLimiter(100, burst=1)
+    start = time.time()
+    for _ in range(11):
+        limiter.acquire()
+    assert time.time() - start >= 0.09
+
+
+def _api_metric(label, updated_at, threshold=None):
+    return {
+        'id': 'uuid-%s' % label,
+        'label': label,
+        'labels': {},
+        'item': '',
+        'service': None,
+        'container': None,
+        'status_of': None,
+        'threshold_low_warning': None,
+        'threshold_low_critical': None,
+        'threshold_high_warning': threshold,
+        'threshold_high_critical': None,
+        'unit': 0,
+        'unit_text': '',
+        'deactivated_at': None,
+        'updated_at': updated_at,
+    }
+
+
+def test_sync_metrics_delta():
+    (server, thread, bleemeo_api) = _start_fake_api()
+    server.metrics = [
+        _api_metric('agent_status', '2018-06-08T09:00:00.000000Z'),
+        _api_metric('cpu_used', '2018-06-08T10:00:00.000000Z'),
+    ]
+    connector = bleemeo_agent.bleemeo.BleemeoConnector(FakeCore())
+    cache = bleemeo_agent.bleemeo.BleemeoCache(None, skip_load=True)
+
+    try:
+        # First synchronization is a full one
+        connector._sync_metrics(cache, bleemeo_api, set(), True)
+        assert 'updated_at__gte' not in server.list_params[-1]
+        assert cache.metrics_updated_at == '2018-06-08T10:00:00.000000Z'
+        assert cache.metrics_full_sync_at is not None
+        assert len(cache.metrics) == 2
+
+        server.metrics[1] = _api_metric(
+            'cpu_used', '2018-06-08T11:00:00.000000Z', threshold=90,
+        )
+        connector._sync_metrics(cache, bleemeo_api, set(), True)
+        assert (
+            server.list_params[-1]['updated_at__gte']
+            == '2018-06-08T10:00:00.000000Z'
+        )
+        assert cache.metrics_updated_at == '2018-06-08T11:00:00.000000Z'
+        metric = cache.metrics_by_labelitem[('cpu_used', '')]
+        assert metric.thresholds.high_warning == 90
+        assert len(cache.metrics) == 2
+
+        # A metric deleted on API is removed by a delta synchronization
+        del server.metrics[0]
+        connector._sync_metrics(cache, bleemeo_api, set(), True)
+        assert server.list_params[-2]['fields'] == 'id'
+        assert 'updated_at__gte' in server.list_params[-1]
+        assert list(cache.metrics_by_labelitem) == [('cpu_used', '')]
+
+        # A full synchronization is still done regularly
+        cache.metrics_full_sync_at = time.time() - 7 * 3600
+        connector._sync_metrics(cache, bleemeo_api, set(), True)
+        assert 'updated_at__gte' not in server.list_params[-1]
+    finally:
+        _stop_fake_api(server, thread)
+
+
+def test_api_iterator():
+    (server, thread, bleemeo_api) = _start_fake_api()
+    server.metrics = [
+        _api_metric('metric%d' % i, '2018-06-08T09:00:00.000000Z')
+        for i in range(45)
+    ]
+    server.list_delay = 0.05
+    expected = ['metric%d' % i for i in range(45)]
+
+    try:
+        labels = [
+            x['label']
+            for x in bleemeo_api.api_iterator('v1/metric/', {'page_size': 10})
+        ]
+        assert labels == expected
+        assert len(server.list_params) == 5
+        assert server.max_running > 1
+
+        server.max_running = 0
+        bleemeo_api.max_prefetch = 0
+        labels = [
+            x['label']
+            for x in bleemeo_api.api_iterator('v1/metric/', {'page_size': 10})
+        ]
+        assert labels == expected
+        assert server.max_running == 1
+
+        # Stopping the iteration early is fine
+        bleemeo_api.max_prefetch = 4
+        iterator = bleemeo_api.api_iterator('v1/metric/', {'page_size': 10})
+        assert next(iterator)['label'] == 'metric0'
+        iterator.close()
+    finally:
+        _stop_fake_api(server, thread)
+
+
+def test_bleemeo_cache_snapshot():
+    cache = bleemeo_agent.bleemeo.BleemeoCache(None, skip_load=True)
+    metric = bleemeo_agent.bleemeo._api_metric_to_internal(
+        _api_metric('cpu_used', '2018-06-08T09:00:00.000000Z'),
+    )
+    cache.metrics[metric.uuid] = metric
+    cache.containers['uuid-web'] = bleemeo_agent.bleemeo.Container(
+        'uuid-web', 'web', 'docker-id', 'hash',
+    )
+    cache.update_lookup_map('metrics')
+    assert ('cpu_used', '') in cache.metrics_by_labelitem
+    assert cache.containers_by_name == {}
+
+    cache.update_lookup_map()
+    snapshot = cache.copy()
+    assert snapshot.metrics_by_labelitem == cache.metrics_by_labelitem
+    assert 'web' in snapshot.containers_by_name
+
+    # Later changes of the cache are not visible in the snapshot
+    del cache.metrics[metric.uuid]
+    cache.update_lookup_map('metrics')
+    assert cache.metrics_by_labelitem == {}
+    assert ('cpu_used', '') in snapshot.metrics_by_labelitem
+    assert metric.uuid in snapshot.metrics
+
+
+class FakeDeleteApi:
+    """ Stand-in for BleemeoAPI which accepts all deletions
+    """
+    def __init__(self):
+        self.deleted = []
+
+    def api_call(self, url, method='get', **kwargs):
+        # pylint: disable=unused-argument
+        assert method == 'delete'
+        self.deleted.append(url)
+        return FakeResponse(204)
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeTimeoutApi:
+    """ Stand-in for BleemeoAPI which creates the metric on registration
+        but raises error instead of returning the response
+    """
+    def __init__(self, error):
+        self.error = error
+        self.metrics = []
+        self.posts = 0
+
+    def api_call(self, url, method='get', data=None, **kwargs):
+        # pylint: disable=unused-argument
+        assert method == 'post'
+        self.posts += 1
+        payload = json.loads(data)
+        self.metrics.append(_api_metric(payload['label'], None))
+        raise self.error
+
+    def api_iterator(self, url, params=None):
+        # pylint: disable=unused-argument
+        return [
+            metric for metric in self.metrics
+            if metric['label'] == params['label']
+            and metric['item'] == params['item']
+        ]
+
+
+def test_register_metric_with_retry():
+    connector = bleemeo_agent.bleemeo.BleemeoConnector(FakeCore())
+    payload = {'agent': 'agent-uuid', 'label': 'cpu_used', 'labels': {}}
+
+    # After a read timeout, the metric created by the request is used
+    bleemeo_api = FakeTimeoutApi(requests.exceptions.ReadTimeout())
+    metric = connector._register_metric_with_retry(bleemeo_api, payload)
+    assert metric.uuid == 'uuid-cpu_used'
+    assert bleemeo_api.posts == 1
+
+    # Other errors may have reached the server, they are not retried
+    bleemeo_api = FakeTimeoutApi(
+        requests.exceptions.ChunkedEncodingError(),
+    )
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        connector._register_metric_with_retry(bleemeo_api, payload)
+    assert bleemeo_api.posts == 1
+
+
+def test_sync_containers_deleted_metrics():
+    connector = bleemeo_agent.bleemeo.BleemeoConnector(FakeCore())
+    cache = bleemeo_agent.bleemeo.BleemeoCache(None, skip_load=True)
+    cache.containers['uuid-web'] = bleemeo_agent.bleemeo.Container(
+        'uuid-web', 'web', 'docker-id', 'hash',
+    )
+    api_metric = _api_metric('docker_container_mem_used', None)
+    api_metric['container'] = 'uuid-web'
+    metric = bleemeo_agent.bleemeo._api_metric_to_internal(api_metric)
+    cache.metrics[metric.uuid] = metric
+    cache.update_lookup_map()
+
+    # The container no longer exists locally
+    api = FakeDeleteApi()
+    connector._sync_containers(cache, api, full=False)
+    assert api.deleted == ['v1/container/uuid-web/']
+    assert cache.metrics == {}
+
+    snapshot = cache.copy()
+    assert snapshot.metrics_by_labelitem == {}
+
+
+def test_drain_spool(tmpdir):
+    connector = bleemeo_agent.bleemeo.BleemeoConnector(FakeCore())
+    client = FakeMqttClient()
+    connector._publisher = bleemeo_agent.bleemeo.MqttPublisher(client)
+    client.publisher = connector._publisher
+    connector._spool = bleemeo_agent.spool.MetricSpool(
+        str(tmpdir), 100000, frozenset(),
+    )
+    connector.connected = True
+    connector._spool.put(DATA_POINTS)
+    # _drain_spool sends up to drain_rate points per elapsed second
+
+    connector._spool_drained_at -= 10
+    connector._drain_spool()
+    assert len(client.published) == 1
+    # Points stay in the spool until acknowledged
+    assert connector._spool
+    connector._spool_drained_at -= 10
+    connector._drain_spool()
+    assert len(client.published) == 1
+
+    connector._publisher.on_publish(1)
+    assert not connector._spool
+
+    # Points are kept when the publisher is full
+    connector._spool.put(DATA_POINTS)
+    connector._publisher.max_messages = 0
+    connector._spool_drained_at -= 10
+    connector._drain_spool()
+    assert len(client.published) == 1
+    assert connector._spool
+
+    # Only the points of the published message are removed from the spool
+    connector.core.config['bleemeo.mqtt.data_max_size'] = 1
+    connector._publisher.max_messages = 2
+    connector._spool_drained_at -= 10
+    connector._drain_spool()
+    assert len(client.published) == 3
+    connector._publisher.on_publish(2)
+    connector._publisher.on_publish(3)
+    assert connector._spool_drain.done
+    (points, _) = connector._spool.peek(10)
+    assert points == DATA_POINTS[2:]
+    connector._spool.close()
+
+
+def test_spool_queued_points(tmpdir):
+    connector = bleemeo_agent.bleemeo.BleemeoConnector(FakeCore())
+    connector._spool = bleemeo_agent.spool.MetricSpool(
+        str(tmpdir), 100000, frozenset(),
+    )
+    connector._bleemeo_cache = bleemeo_agent.bleemeo.BleemeoCache(
+        None, skip_load=True,
+    )
+    metric = bleemeo_agent.bleemeo._api_metric_to_internal(
+        _api_metric('cpu_used', '2018-06-08T10:00:00.000000Z'),
+    )
+    connector._bleemeo_cache.metrics[metric.uuid] = metric
+    connector._bleemeo_cache.update_lookup_map('metrics')
+
+    connector._metric_queue.put(bleemeo_agent.type.MetricPoint(
+        label='cpu_used', labels={}, time=time.time(), value=12.5,
+    ))
+    connector._metric_queue.put(None)
+    # Points still queued on shutdown are kept in the spool
+    connector._spool_queued_points()
+    assert connector._metric_queue.empty()
+    (points, _) = connector._spool.peek(10)
+    assert [(point['uuid'], point['value']) for point in points] == [
+        ('uuid-cpu_used', 12.5),
+    ]
+    connector._spool.close()
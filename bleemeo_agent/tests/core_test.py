@@ -16,7 +16,10 @@
 #   limitations under the License.
 #
 
+import json
+import os
 import socket
+import threading
 import time
 
 import yaml
@@ -714,3 +717,219 @@ rules:
                 instance,
             )
         assert result == expected, fail_msg
+
+
+def test_last_metric_store():
+    store = bleemeo_agent.core.LastMetricStore()
+    base_time = 1500000000
+
+    for item in ('/', '/home'):
+        store.set(bleemeo_agent.type.MetricPoint(
+            label='disk_used_perc',
+            labels={'item': item},
+            time=base_time,
+            value=42.0,
+            status_code=bleemeo_agent.type.STATUS_OK,
+        ))
+    store.set(bleemeo_agent.type.MetricPoint(
+        label='disk_used_perc_status',
+        labels={'item': '/'},
+        time=base_time,
+        value=0.0,
+        status_code=bleemeo_agent.type.STATUS_OK,
+        status_of='disk_used_perc',
+    ))
+    store.set(bleemeo_agent.type.MetricPoint(
+        label='cpu_used', time=base_time - 600, value=1.0,
+    ))
+    store.set(bleemeo_agent.type.MetricPoint(
+        label='cpu_used', time=base_time, value=2.0,
+    ))
+
+    assert len(store) == 4
+    assert store.get(('cpu_used', '')).value == 2.0
+    assert store.get(('cpu_used', 'unknown')) is None
+    assert len(store.get_by_label('disk_used_perc')) == 2
+    assert sorted(
+        point.labels['item'] for point in store.get_with_status()
+    ) == ['/', '/home']
+
+    # A new point without status replace the previous one
+    store.set(bleemeo_agent.type.MetricPoint(
+        label='disk_used_perc',
+        labels={'item': '/home'},
+        time=base_time + 10,
+        value=42.0,
+    ))
+    assert len(store.get_with_status()) == 1
+
+    store.set(bleemeo_agent.type.MetricPoint(
+        label='mem_used', time=base_time - 400, value=1.0,
+    ))
+    store.purge(base_time - 360, [('disk_used_perc', '/')])
+    assert sorted(point.label for point in store.values()) == [
+        'cpu_used', 'disk_used_perc', 'disk_used_perc_status',
+    ]
+    assert store.get_with_status() == []
+
+
+def test_last_metric_store_buckets():
+    store = bleemeo_agent.core.LastMetricStore()
+    base_time = 1500000000
+
+    # 50 metrics updated every minute during 10 hours
+    for minute in range(600):
+        for i in range(50):
+            store.set(bleemeo_agent.type.MetricPoint(
+                label='metric_%d' % i, time=base_time + minute * 60, value=1.0,
+            ))
+        if minute % 5 == 0:
+            store.purge(base_time + minute * 60 - 3600)
+
+    assert len(store) == 50
+    # Only the bucket of the current minute is left
+    for shard in store._shards:  # pylint: disable=protected-access
+        assert len(shard.buckets) <= 1
+
+
+def test_compiled_threshold():
+    threshold = bleemeo_agent.core.CompiledThreshold(
+        {'low_critical': 10, 'high_warning': 80, 'high_critical': 90},
+        300,
+        bleemeo_agent.core.UNIT_UNIT,
+        '%',
+    )
+
+    assert threshold.soft_status(5) == 'critical'
+    assert threshold.soft_status(50) == 'ok'
+    assert threshold.soft_status(85) == 'warning'
+    assert threshold.soft_status(95) == 'critical'
+    assert threshold.threshold_value(5, 'critical') == 10
+    assert threshold.threshold_value(95, 'critical') == 90
+    assert threshold.threshold_value(95, 'warning') == 80
+
+    assert threshold.problem_text(50, 'ok') == 'Current value: 50.00'
+    # Same status: the current value is still formatted on each call
+    assert threshold.problem_text(51, 'ok') == 'Current value: 51.00'
+    assert threshold.problem_text(85, 'warning') == (
+        'Current value: 85.00 threshold (80.00) exceeded over last 5 minutes'
+    )
+    assert threshold.problem_text(87, 'warning') == (
+        'Current value: 87.00 threshold (80.00) exceeded over last 5 minutes'
+    )
+    assert threshold.problem_text(5, 'critical') == (
+        'Current value: 5.00 threshold (10.00) exceeded over last 5 minutes'
+    )
+    assert threshold.problem_text(95, 'critical') == (
+        'Current value: 95.00 threshold (90.00) exceeded over last 5 minutes'
+    )
+
+
+def test_state_journal(tmpdir):
+    filename = str(tmpdir.join('state.json'))
+    with open(filename, 'w') as state_file:
+        # State file written by older version
+        json.dump({'agent_uuid': 'uuid', 'old_key': 1}, state_file)
+
+    state = bleemeo_agent.core.State(filename, coalesce_delay=0)
+    assert state.save()
+    state.set('password', 'secret')
+    state.set('counter', 1)
+    state.set('counter', 2)
+    state.delete('old_key')
+    state.flush()
+    assert os.path.exists(filename + '.journal')
+    with open(filename) as state_file:
+        assert 'password' not in json.load(state_file)
+
+    # A new State (e.g. after a crash) reads the journal
+    other = bleemeo_agent.core.State(filename)
+    assert other.get('password') == 'secret'
+    assert other.get('counter') == 2
+    assert other.get('old_key') is None
+
+    # A partially written entry is ignored
+    with open(filename + '.journal', 'a') as journal_file:
+        journal_file.write('{"key": "counter", "val')
+    other = bleemeo_agent.core.State(filename)
+    assert other.get('counter') == 2
+
+    state.close()
+    assert not os.path.exists(filename + '.journal')
+    with open(filename) as state_file:
+        content = json.load(state_file)
+    assert content['agent_uuid'] == 'uuid'
+    assert content['counter'] == 2
+    assert 'old_key' not in content
+
+    # An outdated journal is ignored
+    with open(filename + '.journal', 'w') as journal_file:
+        journal_file.write('{"generation": 0}\n')
+        journal_file.write('{"key": "counter", "value": 1}\n')
+    other = bleemeo_agent.core.State(filename)
+    assert other.get('counter') == 2
+
+
+def test_state_compaction(tmpdir):
+    filename = str(tmpdir.join('state.json'))
+    state = bleemeo_agent.core.State(filename, coalesce_delay=0)
+    for i in range(200):
+        state.set('key', 'x' * 1000 + str(i))
+        state.flush()
+    # The journal is merged in the state file once larger than it
+    assert os.path.getsize(filename + '.journal') < 70 * 1024
+    other = bleemeo_agent.core.State(filename)
+    assert other.get('key') == 'x' * 1000 + '199'
+    state.close()
+
+
+def test_state_write_failure(tmpdir):
+    # The state file can't be written in a missing directory
+    filename = str(tmpdir.join('missing', 'state.json'))
+    state = bleemeo_agent.core.State(filename, coalesce_delay=0)
+    state.close()
+
+    # Once closed, changes are saved directly. Failed writes put the key
+    # back in the changes to write without deadlock with other threads.
+    def writer():
+        for i in range(50):
+            state.set('key', i)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    for _ in range(50):
+        assert not state.save()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert 'key' in state._dirty
+
+
+def test_state_lazy_load(tmpdir):
+    filename = str(tmpdir.join('state.json'))
+    with open(filename, 'w') as state_file:
+        json.dump({'agent_uuid': 'uuid', 'big': {'a': [1, 2, 3]}}, state_file)
+
+    state = bleemeo_agent.core.State(filename)
+    assert state.get('big') == {'a': [1, 2, 3]}
+    state.set('password', 'secret')
+    state.close()
+
+    # The file is still JSON, with one key per line
+    with open(filename) as state_file:
+        text = state_file.read()
+    assert json.loads(text)['big'] == {'a': [1, 2, 3]}
+    assert text.count('\n') == 6
+
+    state = bleemeo_agent.core.State(filename)
+    # Values are only decoded when used
+    assert 'big' in state._raw
+    assert state.get('agent_uuid') == 'uuid'
+    assert 'big' in state._raw
+    state.delete('big')
+    state.set('password', 'changed')
+    state.close()
+
+    state = bleemeo_agent.core.State(filename)
+    assert state.get('big') is None
+    assert state.get('password') == 'changed'
+    assert state.get('agent_uuid') == 'uuid'
@@ -20,6 +20,25 @@ import bleemeo_agent.graphite
 from bleemeo_agent.graphite import _disk_path_rename
 
 
+class FakeServer:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.core = None
+        self.metrics_source = 'telegraf'
+        self.jmx_enabled = False
+
+
+class RecordingConnection(bleemeo_agent.graphite.GraphiteConnection):
+
+    def __init__(self):
+        super().__init__(FakeServer(), ('127.0.0.1', 4242))
+        self.emitted = []
+
+    def emit_metric(self, name, timestamp, value):
+        self.emitted.append((name, timestamp, value))
+
+
 def test_graphite_split_line():
 
     # Simple metric
@@ -59,6 +78,49 @@ def test_graphite_split_line():
     assert timestamp == 1459257790.0
 
 
+def test_graphite_split_lines():
+    data = (
+        b'telegraf.hostname.ext4./boot.disk.used 119843840 1459257420\n'
+        b'telegraf.hostname.system.uptime_format "20 days, 23:26" 1459257790\n'
+        b'\n'
+        b'telegraf.hostname.elasticsearch.172_17_0_5.uVowpVl3RmO_S22rVTgWBA.'
+        b'Thomas Halloway.elasticsearch_indices.percolate_current 0 1459257790'
+        b'\n'
+        b'telegraf.hostname.non\x01printable 1 1459257790\n'
+        b'telegraf.hostname.mem.used  42  1459257420\r'
+    )
+    result = bleemeo_agent.graphite.graphite_split_lines(memoryview(data))
+    assert result == [
+        (
+            1459257420.0,
+            'telegraf.hostname.ext4./boot.disk.used',
+            119843840.0,
+        ),
+        (
+            1459257790.0,
+            'telegraf.hostname.system.uptime_format',
+            '20 days, 23:26',
+        ),
+        (
+            1459257790.0,
+            'telegraf.hostname.elasticsearch.172_17_0_5.'
+            'uVowpVl3RmO_S22rVTgWBA.Thomas Halloway.'
+            'elasticsearch_indices.percolate_current',
+            0.0,
+        ),
+        (1459257420.0, 'telegraf.hostname.mem.used', 42.0),
+    ]
+
+    # Same result as graphite_split_line for each line
+    for line in data.split(b'\n'):
+        if b'\x01' in line or not line:
+            continue
+        (metric, value, timestamp) = (
+            bleemeo_agent.graphite.graphite_split_line(line)
+        )
+        assert (timestamp, metric, value) in result
+
+
 def test_disk_path_rename():
     ignore = [
         '/media'
@@ -133,3 +195,25 @@ def test_disk_path_rename():
         _disk_path_rename('/hostroot/media', '/hostroot', ignore) ==
         '/media'
     )
+
+
+def test_graphite_connection_feed():
+    connection = RecordingConnection()
+
+    # Lines could be split anywhere between two recv()
+    connection.feed(b'telegraf.mem.used;host=xenial 42 1000\ntelegraf.mem')
+    connection.feed(b'.free;host=xenial 12')
+    connection.feed(b' 1000\n\ntelegraf.cpu.usage_idle;cpu=cpu-total 90 990\n')
+    assert connection.emitted == []
+
+    connection.flush()
+    assert connection.emitted == [
+        ('telegraf.cpu.usage_idle;cpu=cpu-total', 990.0, 90.0),
+        ('telegraf.mem.free;host=xenial', 1000.0, 12.0),
+        ('telegraf.mem.used;host=xenial', 1000.0, 42.0),
+    ]
+
+    # An incomplete line is only processed once its end is received
+    connection.feed(b'telegraf.mem.used;host=xenial 43')
+    connection.close()
+    assert len(connection.emitted) == 3
@@ -0,0 +1,150 @@
+#
+#  Copyright 2015-2018 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import threading
+import time
+
+import pytest
+
+import bleemeo_agent.scheduler
+import bleemeo_agent.util
+
+
+def test_scheduler():
+    scheduler = bleemeo_agent.scheduler.Scheduler()
+    runs = []
+    done = threading.Event()
+
+    def record(name):
+        runs.append(name)
+        if name == 'once':
+            done.set()
+
+    with pytest.raises(ValueError):
+        scheduler.add_job(record, interval=0, args=('once',))
+
+    interval_job = scheduler.add_job(record, interval=3600, args=('every',))
+    scheduler.add_job(record, interval=0, args=('once',), next_run_in=0.1)
+    removed_job = scheduler.add_job(
+        record, interval=0, args=('removed',), next_run_in=0,
+    )
+    scheduler.unschedule(removed_job)
+    scheduler.unschedule(removed_job)
+    scheduler.unschedule(None)
+
+    scheduler.start()
+    try:
+        assert done.wait(5)
+        assert runs == ['once']
+
+        scheduler.trigger(interval_job)
+        deadline = time.time() + 5
+        while interval_job.runs == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert runs == ['once', 'every']
+        # The next run is one interval after the triggered run
+        assert interval_job.deadline > bleemeo_agent.util.get_clock() + 3000
+        assert scheduler.jobs() == [interval_job]
+    finally:
+        scheduler.shutdown()
+
+
+def test_scheduler_coalesce():
+    scheduler = bleemeo_agent.scheduler.Scheduler({'default': 2})
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    def failing():
+        raise RuntimeError('failing job')
+
+    job = scheduler.add_job(slow, interval=60, next_run_in=0)
+    failing_job = scheduler.add_job(failing, interval=60, next_run_in=0)
+    scheduler.start()
+    try:
+        assert started.wait(5)
+        started.clear()
+        # Triggered while running: runs once more after the current run
+        scheduler.trigger(job)
+        scheduler.trigger(job)
+        time.sleep(0.1)
+        assert job.coalesced == 1
+        release.set()
+        assert started.wait(5)
+
+        deadline = time.time() + 5
+        while (job.runs < 2 or failing_job.errors == 0) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        assert job.runs == 2
+        assert job.max_duration >= job.last_duration
+        assert failing_job.runs == 1
+        assert failing_job.errors == 1
+    finally:
+        scheduler.shutdown()
+
+
+def test_scheduler_stats():
+    scheduler = bleemeo_agent.scheduler.Scheduler({'default': 2})
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    job = scheduler.add_job(slow, interval=60, next_run_in=0)
+    scheduler.start()
+    try:
+        assert started.wait(5)
+        started.clear()
+        # First trigger is coalesced, the second one is skipped
+        scheduler.trigger(job)
+        time.sleep(0.05)
+        scheduler.trigger(job)
+        time.sleep(0.05)
+        release.set()
+        assert started.wait(5)
+
+        deadline = time.time() + 5
+        while job.runs < 2 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.shutdown()
+
+    assert job.coalesced == 1
+    assert job.skipped == 1
+    # The coalesced run waited for the first run to finish
+    assert job.last_lateness >= 0.1
+
+    stats = scheduler.stats()['test_scheduler_stats.<locals>.slow']
+    assert stats['runs'] == 2
+    assert stats['skipped'] == 1
+    assert stats['scheduled'] == 1
+    assert stats['max_lateness'] >= 0.1
+    assert sum(count for (_, count) in stats['histogram']) == 2
+
+    window = scheduler.pop_stats()['test_scheduler_stats.<locals>.slow']
+    assert window['runs'] == 2
+    assert window['max_duration'] >= window['avg_duration']
+    window = scheduler.pop_stats()['test_scheduler_stats.<locals>.slow']
+    assert window['runs'] == 0
+    assert window['avg_duration'] is None
@@ -0,0 +1,134 @@
+#
+#  Copyright 2015-2018 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+
+import bleemeo_agent.spool
+
+
+def test_segment_spool(tmpdir):
+    directory = str(tmpdir.join('spool'))
+    spool = bleemeo_agent.spool.SegmentSpool(
+        directory, max_size=10000, segment_size=100,
+    )
+    records = [('record %d' % i).encode('utf-8') for i in range(20)]
+    spool.append(records[:10])
+    spool.append(records[10:])
+
+    assert spool.read(5) == records[:5]
+    spool.close()
+
+    # Records not yet read are kept after a restart
+    spool = bleemeo_agent.spool.SegmentSpool(
+        directory, max_size=10000, segment_size=100,
+    )
+    assert spool.read(10) == records[5:15]
+    spool.append([b'last'])
+    assert spool.read(10) == records[15:] + [b'last']
+    assert spool.read(10) == []
+    assert spool.size() == 0
+    spool.close()
+
+
+def test_segment_spool_corrupted(tmpdir):
+    directory = str(tmpdir)
+    spool = bleemeo_agent.spool.SegmentSpool(directory, max_size=10000)
+    spool.append([b'first', b'second'])
+    spool.close()
+
+    # Simulate a crash during write of the second record
+    segment = os.path.join(directory, '000000000001.seg')
+    with open(segment, 'rb+') as fileobj:
+        fileobj.truncate(os.path.getsize(segment) - 2)
+
+    spool = bleemeo_agent.spool.SegmentSpool(directory, max_size=10000)
+    spool.append([b'third'])
+    assert spool.read(10) == [b'first', b'third']
+    spool.close()
+
+
+def test_segment_spool_max_size(tmpdir):
+    spool = bleemeo_agent.spool.SegmentSpool(
+        str(tmpdir), max_size=500, segment_size=100,
+    )
+    records = [('record %03d' % i).encode('utf-8') for i in range(100)]
+    for record in records:
+        spool.append([record])
+
+    # Oldest records are dropped
+    result = spool.read(100)
+    assert result == records[-len(result):]
+    assert len(result) < 100
+    assert spool.dropped_bytes > 0
+    spool.close()
+
+
+def test_segment_spool_peek(tmpdir):
+    directory = str(tmpdir)
+    spool = bleemeo_agent.spool.SegmentSpool(
+        directory, max_size=10000, segment_size=30,
+    )
+    records = [('record %d' % i).encode('utf-8') for i in range(5)]
+    spool.append(records[:2])
+    spool.append(records[2:])
+
+    (result, position) = spool.peek(3)
+    assert result == records[:3]
+    # Records are kept until commit, even after a restart
+    assert spool.peek(3)[0] == records[:3]
+    spool.close()
+    spool = bleemeo_agent.spool.SegmentSpool(
+        directory, max_size=10000, segment_size=30,
+    )
+    assert spool.peek(3) == (result, position)
+
+    spool.commit(position)
+    # An older position is ignored
+    spool.commit((1, 0))
+    assert spool.read(10) == records[3:]
+    spool.close()
+
+
+def test_metric_spool(tmpdir):
+    spool = bleemeo_agent.spool.MetricSpool(
+        str(tmpdir), 100000, frozenset(['cpu_used']),
+    )
+    assert not spool
+    spool.put([
+        {'uuid': 'a', 'measurement': 'disk_used', 'time': 10, 'value': 1.0},
+        {'uuid': 'b', 'measurement': 'cpu_used', 'time': 20, 'value': 2.0},
+        {'uuid': 'a', 'measurement': 'disk_used', 'time': 30, 'value': 3.0},
+        {'uuid': 'b', 'measurement': 'cpu_used', 'time': 40, 'value': 4.0},
+    ])
+    assert spool
+
+    # Priority metrics are sent first
+    assert [point['value'] for point in spool.get(3)] == [2.0, 4.0, 1.0]
+    assert [point['value'] for point in spool.get(3)] == [3.0]
+    assert not spool
+
+    # Points are only removed on commit
+    spool.put([
+        {'uuid': 'a', 'measurement': 'disk_used', 'time': 50, 'value': 5.0},
+    ])
+    (points, position) = spool.peek(10)
+    assert [point['value'] for point in points] == [5.0]
+    assert spool
+    spool.commit(position)
+    assert not spool
+    spool.close()
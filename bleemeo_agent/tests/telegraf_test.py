@@ -37,3 +37,142 @@ def test_compare_version():
     assert bleemeo_agent.telegraf.compare_version('1.0.1', '1.0.0')
     assert bleemeo_agent.telegraf.compare_version('1.1.0-beta1', '1.0.0')
     assert bleemeo_agent.telegraf.compare_version('2.0.0+bleemeo1-1', '1.0.0')
+
+
+class FakeCore:
+
+    def __init__(self):
+        self.points = []
+        self.services = {}
+        self.last_facts = {}
+
+    def add_scheduled_job(self, *args, **kwargs):
+        pass
+
+    def emit_metric(self, metric_point, no_emit=False):
+        self.points.append(metric_point)
+
+
+class FakeServer:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.core = FakeCore()
+        self.data_last_seen_at = None
+        self.decode_version = 0
+        self.service_index = bleemeo_agent.telegraf.ServiceIndex(
+            self.core.services,
+        )
+
+
+class FakeClient:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.server = FakeServer()
+        self.core = self.server.core
+
+
+def test_decode_cache():
+    client = FakeClient()
+    telegraf = bleemeo_agent.telegraf.Telegraf(client)
+
+    name = 'telegraf.system.load1;host=xenial'
+    telegraf.emit_metric(name, 1000, 0.5)
+    telegraf.emit_metric(name, 1010, 0.75)
+    telegraf.emit_metric('telegraf.unknown.metric;host=xenial', 1010, 1)
+    telegraf.emit_metric('telegraf.unknown.metric;host=xenial', 1020, 1)
+    assert telegraf.decode_cache_misses == 2
+    assert telegraf.decode_cache_hits == 2
+    assert [(x.label, x.value) for x in client.core.points] == [
+        ('system_load1', 0.5),
+        ('system_load1', 0.75),
+    ]
+
+    # A change on server (e.g. new discovery) invalidate the cache
+    client.server.decode_version += 1
+    telegraf.emit_metric(name, 1020, 1.0)
+    assert telegraf.decode_cache_misses == 3
+    assert client.core.points[-1].value == 1.0
+
+
+def test_plugin_decoder():
+    telegraf = bleemeo_agent.telegraf.Telegraf(FakeClient())
+    part = {
+        'telegraf_plugin': 'mem',
+        'metric_name': 'available',
+        'host': 'xenial',
+    }
+    decoder = bleemeo_agent.telegraf.get_plugin_decoder(part)
+    assert isinstance(decoder, bleemeo_agent.telegraf.MemDecoder)
+
+    decoded = decoder.decode(telegraf, part)
+    assert decoded.label == 'mem_available'
+    assert not decoded.derive
+    assert decoded.pending == (('mem_used', '', ''),)
+
+    part['metric_name'] = 'used'
+    assert decoder.decode(telegraf, part) is None
+
+    # net with interface=all isn't for the net plugin decoder
+    part = {
+        'telegraf_plugin': 'net',
+        'metric_name': 'tcp_established',
+        'interface': 'all',
+    }
+    decoder = bleemeo_agent.telegraf.get_plugin_decoder(part)
+    assert decoder is bleemeo_agent.telegraf.STATSD_DECODER
+    assert decoder.decode(telegraf, part) is None
+
+
+def test_service_index():
+    services = {
+        ('redis', ''): {'address': '127.0.0.1', 'port': 6379},
+        ('redis', 'other'): {'address': '127.0.0.1', 'port': 6379},
+        ('redis', 'redis2'): {'address': '172.17.0.2', 'port': 6379},
+        ('rabbitmq', ''): {'address': '127.0.0.1', 'port': 5672},
+        ('haproxy', ''): {'stats_url': 'http://127.0.0.1:8080/stats'},
+        ('elasticsearch', 'es1'): {
+            'address': '172.17.0.3', 'port': 9200, 'es_node_id': 'NODE1',
+        },
+        ('elasticsearch', 'es2'): {'address': '172.17.0.4', 'port': 9200},
+    }
+    index = bleemeo_agent.telegraf.ServiceIndex(services)
+    assert index.by_address[('redis', '127.0.0.1', 6379)] == ''
+    assert index.by_address[('redis', '172.17.0.2', 6379)] == 'redis2'
+    assert index.by_address[('rabbitmq', '127.0.0.1', 15672)] == ''
+    assert index.haproxy_by_stats_url[('127.0.0.1', 8080)] == ''
+    assert index.elasticsearch_by_node_id == {'NODE1': 'es1'}
+    assert index.elasticsearch_missing_node_id
+
+
+def test_container_tags_resolver():
+    resolver = bleemeo_agent.telegraf.ContainerTagsResolver({
+        'my_redis': {'Config': {'Labels': {'a_custom_label': 'my_value'}}},
+        'web.1': {'Config': {'Labels': None}},
+    })
+
+    # Telegraf 1.7 send tags sorted by name
+    part = (
+        'telegraf.xenial.my_value.redis.my_redis.unknown.xenial.18_09.'
+        'docker_container_mem.usage'
+    ).split('.')
+    assert resolver.resolve(part, []) == {
+        'a_custom_label': 'my_value',
+        'container_image': 'redis',
+        'container_name': 'my_redis',
+        'container_version': 'unknown',
+        'engine_host': 'xenial',
+        'server_version': '18_09',
+    }
+
+    part = (
+        'telegraf.xenial.nginx.web_1.unknown.xenial.total.'
+        'docker_container_net.rx_bytes'
+    ).split('.')
+    tags = resolver.resolve(part, ['network'])
+    assert tags['container_name'] == 'web.1'
+    assert tags['network'] == 'total'
+
+    part = 'telegraf.xenial.nginx.web_2.unknown.xenial.total.a.b'.split('.')
+    assert resolver.resolve(part, ['network']) is None
@@ -0,0 +1,52 @@
+#
+#  Copyright 2015-2016 Bleemeo
+#
+#  bleemeo.com an infrastructure monitoring solution in the Cloud
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import pytest
+
+import bleemeo_agent.type
+
+
+def test_metric_point():
+    point = bleemeo_agent.type.MetricPoint(
+        label='cpu_used', time=1000.0, value=42.0,
+    )
+    assert point == bleemeo_agent.type.DEFAULT_METRICPOINT._replace(
+        label='cpu_used', time=1000.0, value=42.0,
+    )
+    assert point.labels == {}
+    assert point.status_code is None
+
+    status = point._replace(label='cpu_used_status', status_code=1)
+    assert status.label == 'cpu_used_status'
+    assert status.value == 42.0
+    assert point.label == 'cpu_used'
+    assert status._asdict()['status_code'] == 1
+
+    with pytest.raises(ValueError):
+        point._replace(unknown_field=1)
+
+
+def test_intern_labels():
+    labels = bleemeo_agent.type.intern_labels({'item': 'sda'})
+    assert labels == {'item': 'sda'}
+    assert bleemeo_agent.type.intern_labels({'item': 'sda'}) is labels
+    assert (
+        bleemeo_agent.type.intern_labels({}) is
+        bleemeo_agent.type.EMPTY_LABELS
+    )
@@ -16,6 +16,12 @@
 #   limitations under the License.
 #
 
+import hashlib
+import json
+import os
+import time
+
+import bleemeo_agent.bleemeo
 import bleemeo_agent.util
 
 
@@ -168,3 +174,55 @@ def test_docker_cgroup_re():
 
     result = bleemeo_agent.util.get_docker_id_from_cgroup(docker2_cgroup)
     assert result == want
+
+
+def test_docker_inspect_hash():
+    inspect = {
+        'Name': '/web',
+        'Mounts': [
+            {'Source': '/srv/data', 'Destination': '/data'},
+            {'Source': '/etc/web', 'Destination': '/etc/web'},
+        ],
+    }
+    reordered = {
+        'Name': '/web',
+        'Mounts': list(reversed(inspect['Mounts'])),
+    }
+    inspect_hash = bleemeo_agent.util.docker_inspect_hash(inspect)
+    assert inspect_hash == bleemeo_agent.util.docker_inspect_hash(reordered)
+    # The inspect is not modified
+    assert inspect['Mounts'][0]['Source'] == '/srv/data'
+
+    # Same hash as the one stored in cache by previous versions
+    sorted_inspect = bleemeo_agent.bleemeo.sort_docker_inspect(inspect)
+    assert inspect_hash == hashlib.sha1(
+        json.dumps(sorted_inspect, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+    reordered['Name'] = '/db'
+    assert inspect_hash != bleemeo_agent.util.docker_inspect_hash(reordered)
+
+
+def test_update_process_psutil(monkeypatch):
+    monkeypatch.setattr(bleemeo_agent.util, 'PROCESS_STATIC_INFO_MIN_AGE', 0)
+    monkeypatch.setattr(bleemeo_agent.util, '_PROCESS_STATIC_INFO', {})
+    update_process_psutil = (
+        bleemeo_agent.util._update_process_psutil  # noqa pylint: disable=protected-access
+    )
+    pid = os.getpid()
+
+    processes = update_process_psutil({}, time.time())
+    create_time = processes[pid]['create_time']
+    static_info = bleemeo_agent.util._PROCESS_STATIC_INFO[(pid, create_time)]
+    assert static_info['cmdline'] == processes[pid]['cmdline']
+
+    # Static information are read from the cache
+    static_info['cmdline'] = 'cached cmdline'
+    processes = update_process_psutil({}, time.time())
+    assert processes[pid]['cmdline'] == 'cached cmdline'
+    assert processes[pid]['memory_rss'] > 0
+
+    # ... unless the process name changed, e.g. after an exec()
+    static_info['name'] = 'old-name'
+    processes = update_process_psutil({}, time.time())
+    assert processes[pid]['cmdline'] != 'cached cmdline'
@@ -16,8 +16,6 @@
 #   limitations under the License.
 #
 
-from collections import namedtuple
-
 STATUS_OK = 0
 STATUS_WARNING = 1
 STATUS_CRITICAL = 2
@@ -37,9 +35,48 @@ STATUS_NAME_TO_CODE = {
     'unknown': STATUS_UNKNOWN,
 }
 
-MetricPoint = namedtuple(
-    'MetricPoint',
-    [
+# Labels of points without labels. Like any labels of a MetricPoint, it must
+# not be modified.
+EMPTY_LABELS = {}
+
+# Interned labels, see intern_labels
+_INTERNED_LABELS = {}
+_INTERNED_LABELS_MAX_SIZE = 100000
+
+
+def intern_labels(labels):
+    """ Return a shared dict equal to labels
+
+        Points of the same metric could share one labels dict instead of
+        each point having its own copy. The returned dict must not be
+        modified.
+    """
+    if not labels:
+        return EMPTY_LABELS
+    key = tuple(sorted(labels.items()))
+    try:
+        return _INTERNED_LABELS[key]
+    except KeyError:
+        pass
+    if len(_INTERNED_LABELS) >= _INTERNED_LABELS_MAX_SIZE:
+        _INTERNED_LABELS.clear()
+    return _INTERNED_LABELS.setdefault(key, labels)
+
+
+class MetricPoint:
+    """ A point of a metric
+
+        Points are created for each sample received, so this class use
+        __slots__ and all fields have a default value: create points with
+        MetricPoint(label=..., time=..., value=...) instead of
+        DEFAULT_METRICPOINT._replace(...).
+
+        It keeps the part of the namedtuple API used on points (_replace,
+        _asdict, _fields). Points must not be modified once emitted.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    _fields = (
         'label',
         'labels',
         'time',
@@ -49,19 +86,62 @@ MetricPoint = namedtuple(
         'container_name',
         'status_code',
         'status_of',
-        'problem_origin'
-    ]
-)
-
-DEFAULT_METRICPOINT = MetricPoint(
-    label='',
-    labels={},
-    time=0.0,
-    value=0.0,
-    service_label='',
-    service_instance='',
-    container_name='',
-    status_code=None,
-    status_of='',
-    problem_origin='',
-)
+        'problem_origin',
+    )
+    __slots__ = _fields
+
+    def __init__(
+            self, label='', labels=EMPTY_LABELS, time=0.0, value=0.0,
+            service_label='', service_instance='', container_name='',
+            status_code=None, status_of='', problem_origin=''):
+        # pylint: disable=too-many-arguments
+        self.label = label
+        self.labels = labels
+        self.time = time
+        self.value = value
+        self.service_label = service_label
+        self.service_instance = service_instance
+        self.container_name = container_name
+        self.status_code = status_code
+        self.status_of = status_of
+        self.problem_origin = problem_origin
+
+    def _replace(self, **kwargs):
+        """ Return a copy of the point with given fields replaced
+        """
+        result = MetricPoint(
+            kwargs.pop('label', self.label),
+            kwargs.pop('labels', self.labels),
+            kwargs.pop('time', self.time),
+            kwargs.pop('value', self.value),
+            kwargs.pop('service_label', self.service_label),
+            kwargs.pop('service_instance', self.service_instance),
+            kwargs.pop('container_name', self.container_name),
+            kwargs.pop('status_code', self.status_code),
+            kwargs.pop('status_of', self.status_of),
+            kwargs.pop('problem_origin', self.problem_origin),
+        )
+        if kwargs:
+            raise ValueError('Got unexpected field names: %r' % list(kwargs))
+        return result
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def _astuple(self):
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other):
+        if not isinstance(other, MetricPoint):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'MetricPoint(%s)' % ', '.join(
+            '%s=%r' % (field, getattr(self, field)) for field in self._fields
+        )
+
+
+DEFAULT_METRICPOINT = MetricPoint()
@@ -17,7 +17,9 @@
 #
 # pylint: disable=too-many-lines
 
+import contextlib
 import datetime
+import hashlib
 import json
 import logging
 import os
@@ -58,6 +60,14 @@ except ImportError:
     docker = None
 
 
+# Processes started less than PROCESS_STATIC_INFO_MIN_AGE seconds ago don't
+# have their static information cached.
+PROCESS_STATIC_INFO_MIN_AGE = 60
+
+# (pid, create_time) => static information of the process, see
+# _update_process_psutil
+_PROCESS_STATIC_INFO = {}
+
 DOCKER_CGROUP_RE = re.compile(
     r'^\d+:[^:]+:'
     r'(/kubepods/.*pod[0-9a-fA-F-]+/|.*/docker[-/])'
@@ -889,6 +899,23 @@ def pull_raw_metric(core, name):
             core.emit_metric(metric_point)
 
 
+def docker_inspect_hash(inspect):
+    """ Return a hash of a docker inspect, used to detect changes
+
+        Mounts order does not matter but is not consistent between
+        call to docker inspect (at least on minikube), so they are sorted.
+    """
+    if inspect.get('Mounts'):
+        inspect = dict(inspect)
+        inspect['Mounts'] = sorted(
+            inspect['Mounts'],
+            key=lambda x: (x.get('Source', ''), x.get('Destination', '')),
+        )
+    return hashlib.sha1(
+        json.dumps(inspect, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
 def docker_exec(docker_client, container_name, command):
     """ Run a command on given container and return output.
 
@@ -1029,14 +1056,96 @@ def _get_docker_process(docker_client):
     return processes
 
 
+def _process_oneshot(process):
+    """ Return process.oneshot() context, or a no-op context for psutil < 5.0
+    """
+    if hasattr(process, 'oneshot'):
+        return process.oneshot()
+    return contextlib.ExitStack()
+
+
+def _get_process_static_info(process):
+    """ Return information which don't change during the process life:
+        username, cmdline, name and exe
+    """
+    try:
+        username = process.username()
+    except (KeyError, psutil.AccessDenied):
+        # the uid can't be resolved by the system
+        if os.name == 'nt':
+            username = ''
+        else:
+            username = str(process.uids().real)
+
+    # Cmdline may be unavailable (permission issue ?)
+    # When unavailable, depending on psutil version, it returns
+    # either [] or ['']
+    try:
+        cmdline = process.cmdline()
+        if cmdline and cmdline[0]:
+            # Remove empty argument. This is usually generated by
+            # processes which alter their name and result in
+            # npm '' '' '' '' '' '' '' '' '' '' '' ''
+            cmdline = [x for x in cmdline if x]
+
+            # shlex.quote is needed if the program path has space in
+            # the name. This is usually true under Windows but Windows
+            # has shlex.quote (Python 3.3+).
+            if hasattr(shlex, 'quote'):
+                cmdline = ' '.join(shlex.quote(x) for x in cmdline)
+            else:
+                cmdline = ' '.join(cmdline)
+            name = process.name()
+        else:
+            cmdline = process.name()
+            name = cmdline
+    except psutil.AccessDenied:
+        cmdline = process.name()
+        name = cmdline
+
+    try:
+        exe = process.exe()
+    except psutil.AccessDenied:
+        exe = ''
+
+    return {
+        'username': username,
+        'cmdline': cmdline,
+        'name': name,
+        'exe': exe,
+    }
+
+
+def _get_process_docker_id(pid):
+    """ Return the Docker ID of the container of process, based on its cgroup
+
+        Return None if the process isn't in a container.
+    """
+    try:
+        with open('/proc/%d/cgroup' % pid) as fileobj:
+            cgroup_data = fileobj.read()
+    except (OSError, IOError):
+        return None
+
+    docker_ids = get_docker_id_from_cgroup(cgroup_data)
+    if len(docker_ids) == 1:
+        return docker_ids.pop()
+    return None
+
+
 def _update_process_psutil(
         processes, only_started_before, docker_containers=None):
     """ If docker_containers is not None, try to use cgroup to ensure process
         without container are really without containers.
+
+        Static information of processes (see _get_process_static_info and
+        the Docker ID from cgroup) are kept in _PROCESS_STATIC_INFO, so only
+        dynamic information are read for processes already seen.
     """
     # pylint: disable=too-many-branches
     # pylint: disable=too-many-locals
-    # pylint: disable=too-many-statements
+    # pylint: disable=global-statement
+    global _PROCESS_STATIC_INFO  # pylint: disable=invalid-name
 
     # Process creation time is accurate up to 1/SC_CLK_TCK seconds,
     # usually 1/100th of seconds.
@@ -1044,6 +1153,12 @@ def _update_process_psutil(
     # Keep some additional margin by doubling this value.
     only_started_before -= 2/100
 
+    # This function could run concurrently (top info and discovery). Each
+    # call build a new cache, which also drop processes that terminated.
+    static_info_cache = _PROCESS_STATIC_INFO
+    new_static_info_cache = {}
+    cache_started_before = time.time() - PROCESS_STATIC_INFO_MIN_AGE
+
     for process in psutil.process_iter():
         try:
             if process.pid == 0:
@@ -1051,84 +1166,56 @@ def _update_process_psutil(
                 # PID 0 is not used Linux don't use it.
                 # Other system are currently not supported.
                 continue
-            create_time = process.create_time()
-            if create_time > only_started_before:
-                # Ignore process created very recently. This is done to avoid
-                # issue with process created in a container between the listing
-                # of container process and this update from psutil. Such
-                # process would be marked as running outside any container
-                # could lead to discovery error.
-                continue
-            try:
-                username = process.username()
-            except (KeyError, psutil.AccessDenied):
-                # the uid can't be resolved by the system
-                if os.name == 'nt':
-                    username = ''
-                else:
-                    username = str(process.uids().real)
-
-            # Cmdline may be unavailable (permission issue ?)
-            # When unavailable, depending on psutil version, it returns
-            # either [] or ['']
-            try:
-                cmdline = process.cmdline()
-                if cmdline and cmdline[0]:
-                    # Remove empty argument. This is usually generated by
-                    # processes which alter their name and result in
-                    # npm '' '' '' '' '' '' '' '' '' '' '' ''
-                    cmdline = [x for x in cmdline if x]
-
-                    # shlex.quote is needed if the program path has space in
-                    # the name. This is usually true under Windows but Windows
-                    # has shlex.quote (Python 3.3+).
-                    if hasattr(shlex, 'quote'):
-                        cmdline = ' '.join(shlex.quote(x) for x in cmdline)
-                    else:
-                        cmdline = ' '.join(cmdline)
-                    name = process.name()
-                else:
-                    cmdline = process.name()
-                    name = cmdline
-            except psutil.AccessDenied:
-                cmdline = process.name()
-                name = cmdline
-
-            cpu_times = process.cpu_times()
-            process_info = processes.get(process.pid, {})
-            process_info.update({
-                'pid': process.pid,
-                'ppid': process.ppid(),
-                'create_time': create_time,
-                'cmdline': cmdline,
-                'name': name,
-                'memory_rss': process.memory_info().rss / 1024,
-                'cpu_percent': process.cpu_percent(),
-                'cpu_times':
-                    cpu_times.user + cpu_times.system,
-                'status': process.status(),
-                'username': username,
-                '_psutil': True,
-            })
-            try:
-                process_info['exe'] = process.exe()
-            except psutil.AccessDenied:
-                process_info['exe'] = ''
+            with _process_oneshot(process):
+                create_time = process.create_time()
+                if create_time > only_started_before:
+                    # Ignore process created very recently. This is done to
+                    # avoid issue with process created in a container between
+                    # the listing of container process and this update from
+                    # psutil. Such process would be marked as running outside
+                    # any container could lead to discovery error.
+                    continue
+
+                key = (process.pid, create_time)
+                static_info = static_info_cache.get(key)
+                if (static_info is not None
+                        and static_info['name'] != process.name()):
+                    # The process called exec()
+                    static_info = None
+                if static_info is None:
+                    static_info = _get_process_static_info(process)
+                if create_time < cache_started_before:
+                    # Young processes may still change their user or their
+                    # cmdline, don't cache them yet.
+                    new_static_info_cache[key] = static_info
+
+                cpu_times = process.cpu_times()
+                process_info = processes.get(process.pid, {})
+                process_info.update({
+                    'pid': process.pid,
+                    'ppid': process.ppid(),
+                    'create_time': create_time,
+                    'cmdline': static_info['cmdline'],
+                    'name': static_info['name'],
+                    'memory_rss': process.memory_info().rss / 1024,
+                    'cpu_percent': process.cpu_percent(),
+                    'cpu_times':
+                        cpu_times.user + cpu_times.system,
+                    'status': process.status(),
+                    'username': static_info['username'],
+                    'exe': static_info['exe'],
+                    '_psutil': True,
+                })
 
             process_info.setdefault('instance', '')
             if docker_containers is not None:
                 # Check /proc/pid/cgroup to be double sure that this process
                 # run outside any container.
-                docker_id = None
-                try:
-                    with open('/proc/%d/cgroup' % process.pid) as fileobj:
-                        cgroup_data = fileobj.read()
-
-                    docker_ids = get_docker_id_from_cgroup(cgroup_data)
-                    if len(docker_ids) == 1:
-                        docker_id = docker_ids.pop()
-                except (OSError, IOError):
-                    pass
+                if 'docker_id' not in static_info:
+                    static_info['docker_id'] = _get_process_docker_id(
+                        process.pid,
+                    )
+                docker_id = static_info['docker_id']
 
                 if docker_id and docker_id in docker_containers:
                     container = docker_containers[docker_id]
@@ -1138,7 +1225,7 @@ def _update_process_psutil(
                         'Base on cgroup, process %d (%s) belong to '
                         'container %r',
                         process.pid,
-                        name,
+                        static_info['name'],
                         container_name,
                     )
                 elif docker_id and create_time > time.time() - 3:
@@ -1146,7 +1233,7 @@ def _update_process_psutil(
                         'Skipping process %d (%s) created recently and seems '
                         'to belong to a container',
                         process.pid,
-                        name,
+                        static_info['name'],
                     )
                     continue
 
@@ -1154,4 +1241,5 @@ def _update_process_psutil(
         except psutil.NoSuchProcess:
             continue
 
+    _PROCESS_STATIC_INFO = new_static_info_cache
     return processes
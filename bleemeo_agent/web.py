@@ -22,6 +22,7 @@ import flask
 import jinja2.filters
 
 import bleemeo_agent.checker
+import bleemeo_agent.scheduler
 import bleemeo_agent.type
 
 
@@ -34,16 +35,8 @@ def home():
     loads = bleemeo_agent.util.get_loadavg(app.core)
     check_info = _gather_checks_info()
     top_output = bleemeo_agent.util.get_top_output(app.core.top_info)
-    disks_used_perc = [
-        metric_point
-        for metric_point in app.core.last_metrics.values()
-        if metric_point.label == 'disk_used_perc'
-    ]
-    nets_bits_recv = [
-        metric_point
-        for metric_point in app.core.last_metrics.values()
-        if metric_point.label == 'net_bits_recv'
-    ]
+    disks_used_perc = app.core.last_metrics.get_by_label('disk_used_perc')
+    nets_bits_recv = app.core.last_metrics.get_by_label('net_bits_recv')
 
     uptime_seconds = bleemeo_agent.util.get_uptime()
     uptime_string = bleemeo_agent.util.format_uptime(uptime_seconds)
@@ -111,33 +104,31 @@ def _gather_checks_info():
     check_count_warning = 0
     check_count_critical = 0
     checks = []
-    for metric_point in app.core.last_metrics.values():
-        if (metric_point.status_code is not None
-                and metric_point.status_of == ''):
-            if metric_point.status_code == bleemeo_agent.type.STATUS_OK:
-                check_count_ok += 1
-            elif metric_point.status_code == bleemeo_agent.type.STATUS_WARNING:
-                check_count_warning += 1
-            else:
-                check_count_critical += 1
-            threshold = app.core.get_threshold(
-                metric_point.label, metric_point.labels.get('item', ''),
-            )
+    for metric_point in app.core.last_metrics.get_with_status():
+        if metric_point.status_code == bleemeo_agent.type.STATUS_OK:
+            check_count_ok += 1
+        elif metric_point.status_code == bleemeo_agent.type.STATUS_WARNING:
+            check_count_warning += 1
+        else:
+            check_count_critical += 1
+        threshold = app.core.get_threshold(
+            metric_point.label, metric_point.labels.get('item', ''),
+        )
 
-            pretty_name = metric_point.label
-            item = metric_point.labels.get('item', '')
-            if item:
-                pretty_name = '%s for %s' % (pretty_name, item)
-            checks.append({
-                'name': metric_point.label,
-                'pretty_name': pretty_name,
-                'item': item,
-                'status': bleemeo_agent.type.STATUS_NAME[
-                    metric_point.status_code
-                ],
-                'value': metric_point.value,
-                'threshold': threshold,
-            })
+        pretty_name = metric_point.label
+        item = metric_point.labels.get('item', '')
+        if item:
+            pretty_name = '%s for %s' % (pretty_name, item)
+        checks.append({
+            'name': metric_point.label,
+            'pretty_name': pretty_name,
+            'item': item,
+            'status': bleemeo_agent.type.STATUS_NAME[
+                metric_point.status_code
+            ],
+            'value': metric_point.value,
+            'threshold': threshold,
+        })
 
     return {
         'checks': checks,
@@ -159,6 +150,28 @@ def check():
     )
 
 
+@app.route('/jobs')
+def jobs():
+    stats = app.core.get_scheduler_stats()
+    # Jobs which used the most time first
+    jobs_stats = sorted(
+        stats.items(),
+        key=lambda x: x[1]['total_duration'],
+        reverse=True,
+    )
+    buckets = [
+        'inf' if bound == float('inf') else '%gs' % bound
+        for bound in bleemeo_agent.scheduler.DURATION_BUCKETS
+    ]
+
+    return flask.render_template(
+        'jobs.html',
+        core=app.core,
+        jobs_stats=jobs_stats,
+        buckets=buckets,
+    )
+
+
 @app.template_filter('netsizeformat')
 def filter_netsizeformat(value):
     """ Same as standard filesizeformat but for network.
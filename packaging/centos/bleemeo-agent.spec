@@ -22,7 +22,6 @@ Requires:       net-tools
 Requires:       ca-certificates
 Requires:       sudo
 Requires:       python36-docker
-Requires:       python36-APScheduler
 Requires:       python36-jinja2
 Requires:       python36-six
 Requires:       python36-PyYAML
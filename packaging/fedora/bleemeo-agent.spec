@@ -21,15 +21,11 @@ Requires:       python3-paho-mqtt
 Requires:       net-tools
 Requires:       ca-certificates
 Requires:       sudo
-Requires:       python3-APScheduler
 Requires:       python3-jinja2
 Requires:       python3-six
 Requires:       python3-PyYAML
 Requires:       python3-setuptools
 Requires:       bleemeo-agent-collector
-# This should be a requires of python3-tzlocal
-# https://bugzilla.redhat.com/show_bug.cgi?id=1393397
-Requires:       python3-pytz
 
 Recommends:     python3-docker
 Recommends:     python3-flask